@@ -1,7 +1,14 @@
+__version__ = '0.1.0'
+
 from .common import *  # noqa: F401,F403
 from .config import *  # noqa: F401,F403
 from .parameter import *   # noqa: F401, F403
+from .surrogate import *  # noqa: F401,F403
+from .spatial_index import *  # noqa: F401,F403
+from .storage import *  # noqa: F401,F403
 from .objective_function import *  # noqa: F401,F403
 from .objective_function_misfit import *  # noqa: F401,F403
 from .objective_function_residual import *  # noqa: F401,F403
 from .objective_function_simobs import *  # noqa: F401,F403
+from .objective_function_async import *  # noqa: F401,F403
+from .service import *  # noqa: F401,F403
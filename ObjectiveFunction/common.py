@@ -1,7 +1,7 @@
 __all__ = ['PreliminaryRun', 'NewRun', 'Waiting', 'NoNewRun',
-           'LookupState']
+           'LookupState', 'RunPriority']
 
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class PreliminaryRun(Exception):
@@ -36,6 +36,7 @@ class LookupState(Enum):
      * RUN: the model has run
      * POSTPROCESSING: the model results are being post-processed
      * COMPLETED: completed parameter set
+     * CANCELLED: the parameter set is no longer required
     """
     PROVISIONAL = 1
     NEW = 2
@@ -45,3 +46,18 @@ class LookupState(Enum):
     RUN = 6
     POSTPROCESSING = 7
     COMPLETED = 8
+    CANCELLED = 9
+
+
+class RunPriority(IntEnum):
+    """the priority of NEW parameter sets
+
+    Parameter sets with a higher priority are handed out first.
+
+     * BACKGROUND: background design points, eg from a design of experiments
+     * SPECULATIVE: speculative points that may be required
+     * BLOCKING: points the optimiser is waiting for
+    """
+    BACKGROUND = 0
+    SPECULATIVE = 1
+    BLOCKING = 2
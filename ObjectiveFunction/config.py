@@ -1,6 +1,9 @@
 __all__ = ['ObjFunConfig']
 
 import logging
+import os
+import hashlib
+import json
 from configobj import ConfigObj, flatten_errors
 from validate import Validator
 from pathlib import Path
@@ -13,6 +16,10 @@ from .objective_function_misfit import ObjectiveFunctionMisfit
 from .objective_function_residual import ObjectiveFunctionResidual
 from .objective_function_simobs import ObjectiveFunctionSimObs
 from .parameter import ParameterFloat, ParameterInt
+from .storage import ResultStorage
+from .surrogate import SurrogateRBF, SurrogateQuadratic
+from .service import ObjectiveFunctionClient, SCHEME
+from . import __version__
 
 
 class ObjFunConfig:
@@ -20,6 +27,10 @@ class ObjFunConfig:
 
     :param fname: the name of the configuration file
     :type fname: Path
+    :param cache: directory in which validated configurations are cached.
+                  Defaults to the value of the OBJFUN_CONFIG_CACHE environment
+                  variable. No caching if neither is set.
+    :type cache: Path
     """
 
     setupCfgStr = """
@@ -29,6 +40,30 @@ class ObjFunConfig:
       basedir = string() # the base directory
       objfun = string(default=misfit)
       db = string(default=None) # SQLAlchemy DB connection string
+      gradient = option('none', 'forward', 'central', default='none')
+      fd_step = float(default=1e-3) # finite difference step relative to
+                                    # the parameter range
+      surrogate = option('none', 'rbf', 'quadratic', default='none')
+      speculate = integer(min=0, default=0) # number of points enqueued
+                                            # ahead using the surrogate
+      tolerance = integer(min=0, default=0) # reuse completed runs within
+                                             # tolerance resolution steps
+      threadsafe = boolean(default=False) # use a session for each thread
+      pool_size = integer(min=1, default=None) # DB connection pool size
+      buffered = boolean(default=False) # queue results and write in batches
+      batch_size = integer(min=1, default=100) # number of queued results
+      durable = boolean(default=None) # synchronise result files to disk
+      schedule = option('priority', 'shortest', default='priority')
+      expire_on_commit = boolean(default=True) # reload the study after
+                                               # each commit
+      result_dtype = option('float64', 'float32', default='float64')
+      compression = option('none', 'zlib', 'lzma', 'bz2', default='none')
+      compression_level = integer(min=0, max=9, default=None)
+      shuffle = boolean(default=True) # shuffle bytes before compressing
+      chunk_size = integer(min=1, default=None) # values per result chunk
+      inline_results = boolean(default=False) # store results in the DB
+      snapshot = boolean(default=False) # index completed runs in a file
+      sharded = boolean(default=False) # store runs of each scenario apart
     """
 
     parametersCfgStr = """
@@ -41,6 +76,7 @@ class ObjFunConfig:
           resolution = float(default=1e-6) # the resolution of the parameter
           constant = boolean(default=False) # if set to True the parameter is
                                              # not optimised for
+          tolerance = integer(min=0, default=None) # override the tolerance
       [[integer_parameters]]
         [[[__many__]]]
           value = integer() # the default value
@@ -48,6 +84,7 @@ class ObjFunConfig:
           max = integer() # the maximum value allowed
           constant = boolean(default=False) # if set to True the parameter is
                                             # not optimised for
+          tolerance = integer(min=0, default=None) # override the tolerance
     """
 
     targetsCfgStr = """
@@ -55,7 +92,13 @@ class ObjFunConfig:
       __many__ = float
     """
 
-    def __init__(self, fname: Path) -> None:
+    startPointsCfgStr = """
+    [start_points]
+      [[__many__]]
+        __many__ = float
+    """
+
+    def __init__(self, fname: Path, cache: Path = None) -> None:
         self._log = logging.getLogger('ObjectiveFunction.config')
 
         if not fname.is_file():
@@ -66,11 +109,75 @@ class ObjFunConfig:
         self._basedir = None
         self._path = fname.parent
 
+        self._params = None
+        self._optimise_params = None
+        self._values = None
+        self._start_values = None
+        self._targets = None
+        self._objfun = None
+        self._obsNames = None
+
         # read config file into string
         cfgData = fname.open('r').read()
         # expand any environment variables
         cfgData = expandvars(cfgData)
 
+        if cache is None and 'OBJFUN_CONFIG_CACHE' in os.environ:
+            cache = Path(os.environ['OBJFUN_CONFIG_CACHE'])
+        if cache is None:
+            self._validate(fname, cfgData)
+            return
+
+        # the cache is keyed by the package version, the configuration
+        # specification and the expanded configuration
+        key = hashlib.sha256(
+            (__version__ + self.defaultCfgStr + cfgData).encode()).hexdigest()
+        cacheName = cache / f'{key}.json'
+        if self._load_cached(cacheName):
+            return
+
+        self._validate(fname, cfgData)
+        cache.mkdir(parents=True, exist_ok=True)
+        tmpName = cacheName.with_suffix(f'.{os.getpid()}')
+        with tmpName.open('w') as f:
+            json.dump(self.cfg, f)
+        tmpName.replace(cacheName)
+
+    def _load_cached(self, cacheName):
+        """load a cached validated configuration
+
+        The cache only contains the validated configuration as plain JSON
+        data. The parameters and targets are derived from it again.
+
+        :param cacheName: the name of the cache file
+        :return: True if the configuration was loaded from the cache
+        """
+        if not cacheName.is_file():
+            return False
+        self._log.debug(f'loading cached configuration {cacheName}')
+        try:
+            with cacheName.open('r') as f:
+                cfg = json.load(f)
+        except (OSError, ValueError) as e:
+            self._log.warning(f'ignoring cached configuration {cacheName}: '
+                              f'{e}')
+            return False
+        sections = ConfigObj(self.defaultCfgStr.split('\n'),
+                             list_values=False, _inspec=True).sections
+        if not isinstance(cfg, dict) or \
+                not all(isinstance(cfg.get(s), dict) for s in sections):
+            self._log.warning(f'ignoring malformed cached configuration '
+                              f'{cacheName}')
+            return False
+        self._cfg = cfg
+        return True
+
+    def _validate(self, fname, cfgData):
+        """parse and validate the configuration
+
+        :param fname: the name of the configuration file
+        :param cfgData: the expanded contents of the configuration file
+        """
         # populate the default  config object which is used as a validator
         objfunDefaults = ConfigObj(self.defaultCfgStr.split('\n'),
                                    list_values=False, _inspec=True)
@@ -78,12 +185,6 @@ class ObjFunConfig:
 
         self._cfg = ConfigObj(StringIO(cfgData), configspec=objfunDefaults)
 
-        self._params = None
-        self._optimise_params = None
-        self._values = None
-        self._objfun = None
-        self._obsNames = None
-
         res = self._cfg.validate(validator, preserve_errors=True)
         errors = []
         # loop over any configuration errors
@@ -105,6 +206,9 @@ class ObjFunConfig:
             for e in errors:
                 self._log.error(e)
             raise RuntimeError(msg)
+        # the configuration is a plain dictionary whether it was cached or
+        # not
+        self._cfg = self._cfg.dict()
 
     def expand_path(self, path):
         return (self._path / path).absolute()
@@ -113,7 +217,8 @@ class ObjFunConfig:
     def defaultCfgStr(self):
         return self.setupCfgStr + '\n' \
             + self.parametersCfgStr + '\n' \
-            + self.targetsCfgStr
+            + self.targetsCfgStr + '\n' \
+            + self.startPointsCfgStr
 
     def _get_params(self):
         self._params = {}
@@ -152,6 +257,36 @@ class ObjFunConfig:
             self._get_params()
         return self._values
 
+    @property
+    def startValues(self):
+        """a list of dictionaries of parameter values used as starting points
+
+        Each subsection of the start_points section defines a starting point
+        by overriding the default parameter values. If there are no start
+        points the default parameter values are used.
+        """
+        if self._start_values is None:
+            self._start_values = []
+            for name in self.cfg['start_points']:
+                values = dict(self.values)
+                for p in self.cfg['start_points'][name]:
+                    if p not in self.parameters:
+                        msg = f'unknown parameter {p} in start point {name}'
+                        self._log.error(msg)
+                        raise RuntimeError(msg)
+                    v = type(self.values[p])(self.cfg['start_points'][name][p])
+                    try:
+                        self.parameters[p].check_value(v)
+                    except ValueError as e:
+                        msg = f'problem with start point {name}: {e}'
+                        self._log.error(msg)
+                        raise RuntimeError(msg)
+                    values[p] = v
+                self._start_values.append(values)
+            if len(self._start_values) == 0:
+                self._start_values.append(self.values)
+        return self._start_values
+
     @property
     def parameters(self):
         """a dictionary of parameters"""
@@ -159,6 +294,22 @@ class ObjFunConfig:
             self._get_params()
         return self._params
 
+    @property
+    def tolerance(self):
+        """a dictionary of the tolerances used for approximate lookups
+
+        None if approximate lookups are disabled
+        """
+        tolerance = {}
+        for t in ['float_parameters', 'integer_parameters']:
+            for p in self.cfg['parameters'][t]:
+                tolerance[p] = self.cfg['parameters'][t][p]['tolerance']
+                if tolerance[p] is None:
+                    tolerance[p] = self.cfg['setup']['tolerance']
+        if not any(tolerance.values()):
+            return None
+        return tolerance
+
     @property
     def optimise_parameters(self):
         """a dictionary of parameters that should be optimised"""
@@ -197,28 +348,104 @@ class ObjFunConfig:
 
     @property
     def objectiveFunction(self):
-        """intantiate a ObjectiveFunction object from config object"""
+        """intantiate a ObjectiveFunction object from config object
+
+        A client of an objective function server is returned if the db
+        setting is of the form objfun://host:port
+        """
         if self._objfun is None:
-            if self.objfunType == 'misfit':
-                objfun = ObjectiveFunctionMisfit
-            elif self.objfunType == 'residual':
-                objfun = ObjectiveFunctionResidual
-            elif self.objfunType == 'simobs':
-                if len(self.targets) == 0:
-                    msg = 'targets required for simobs'
-                    self._log.error(msg)
-                    raise RuntimeError(msg)
-                objfun = partial(ObjectiveFunctionSimObs,
-                                 observationNames=self.observationNames)
+            db = self.cfg['setup']['db']
+            if db is not None and db.startswith(f'{SCHEME}://'):
+                self._objfun = ObjectiveFunctionClient(
+                    db, self.parameters, scenario=self.scenario)
             else:
-                msg = 'wrong type of objective function: ' + self.objfunType
+                self._objfun = self.createObjectiveFunction(db=db)
+        return self._objfun
+
+    @property
+    def storage(self):
+        """how the results are stored"""
+        setup = self.cfg['setup']
+        dtype = setup['result_dtype']
+        return ResultStorage(
+            dtype=None if dtype == 'float64' else dtype,
+            compression=setup['compression'],
+            level=setup['compression_level'],
+            shuffle=setup['shuffle'],
+            chunk_size=setup['chunk_size'])
+
+    def createObjectiveFunction(self, db=None):
+        """instantiate a new ObjectiveFunction object
+
+        :param db: database connection string, by default the database in
+                   the base directory is used
+        """
+        if self.objfunType == 'misfit':
+            objfun = ObjectiveFunctionMisfit
+        elif self.objfunType == 'residual':
+            objfun = partial(ObjectiveFunctionResidual, storage=self.storage,
+                             inline=self.cfg['setup']['inline_results'])
+        elif self.objfunType == 'simobs':
+            if len(self.targets) == 0:
+                msg = 'targets required for simobs'
                 self._log.error(msg)
                 raise RuntimeError(msg)
-            self._objfun = objfun(self.study, self.basedir,
-                                  self.parameters,
-                                  scenario=self.scenario,
-                                  db=self.cfg['setup']['db'])
-        return self._objfun
+            objfun = partial(ObjectiveFunctionSimObs,
+                             observationNames=self.observationNames,
+                             inline=self.cfg['setup']['inline_results'])
+        else:
+            msg = 'wrong type of objective function: ' + self.objfunType
+            self._log.error(msg)
+            raise RuntimeError(msg)
+        gradient = self.cfg['setup']['gradient']
+        if gradient == 'none':
+            gradient = None
+        surrogate = {'none': None,
+                     'rbf': SurrogateRBF,
+                     'quadratic': SurrogateQuadratic}[
+                         self.cfg['setup']['surrogate']]
+        return objfun(self.study, self.basedir,
+                      self.parameters,
+                      scenario=self.scenario,
+                      db=db,
+                      gradient=gradient,
+                      fd_step=self.cfg['setup']['fd_step'],
+                      surrogate=surrogate,
+                      tolerance=self.tolerance,
+                      threadsafe=self.cfg['setup']['threadsafe'],
+                      pool_size=self.cfg['setup']['pool_size'],
+                      buffered=self.cfg['setup']['buffered'],
+                      batch_size=self.cfg['setup']['batch_size'],
+                      durable=self.cfg['setup']['durable'],
+                      schedule=self.cfg['setup']['schedule'],
+                      expire_on_commit=self.cfg['setup']['expire_on_commit'],
+                      snapshot=self.cfg['setup']['snapshot'],
+                      sharded=self.cfg['setup']['sharded'])
+
+    @property
+    def startPoints(self):
+        """the starting points of the optimisers of the default scenario"""
+        return self.getStartPoints()
+
+    def getStartPoints(self, scenario=None):
+        """the starting points of the optimisers of a scenario
+
+        The starting points are stored with the scenario the first time
+        they are requested so that all optimisers sharing the scenario
+        start from the same points.
+
+        :param scenario: the name of the scenario, by default the scenario
+                         of the configuration
+        """
+        objfun = self.objectiveFunction
+        points = objfun.getStartPoints(scenario=scenario)
+        if len(points) == 0:
+            points = self.startValues
+            objfun.setStartPoints(points, scenario=scenario)
+        elif len(points) != len(self.startValues):
+            self._log.warning('number of start points in configuration does '
+                              'not match stored start points')
+        return points
 
     @property
     def observationNames(self):
@@ -229,7 +456,10 @@ class ObjFunConfig:
 
     @property
     def targets(self):
-        return pandas.Series(self.cfg['targets'])
+        """a pandas Series of the targets"""
+        if self._targets is None:
+            self._targets = pandas.Series(self.cfg['targets'], dtype=float)
+        return self._targets
 
 
 if __name__ == '__main__':
@@ -10,8 +10,8 @@ from .common import PreliminaryRun, NewRun, Waiting
 
 
 class DFOLSConfig(ObjFunConfig):
-    def __init__(self, fname: Path) -> None:
-        super().__init__(fname)
+    def __init__(self, fname: Path, cache: Path = None) -> None:
+        super().__init__(fname, cache=cache)
         self._log = logging.getLogger('ObjectiveFunction.dfolscfg')
         if self.objfunType not in ['residual', 'simobs']:
             msg = 'objective function type must be either residual or simobs'
@@ -19,9 +19,64 @@ class DFOLSConfig(ObjFunConfig):
             raise RuntimeError(msg)
 
 
+def optimise(objfun, startPoints, scenario=None, speculate=0):
+    """run one optimiser per start point
+
+    All optimisers share the lookup table of the scenario but each uses its
+    own provisional slot.
+
+    :param objfun: the objective function
+    :param startPoints: list of parameter dictionaries ordered by slot
+    :param scenario: the name of the scenario, by default the default
+                     scenario of the objective function
+    :param speculate: the maximum number of parameter sets each optimiser
+                      enqueues ahead using the surrogate model once it
+                      created a new parameter set
+    :return: list of the status of each optimiser, either new, waiting or
+             done
+    """
+    log = logging.getLogger('ObjectiveFunction.dfols')
+    name = '' if scenario is None else f'{scenario} '
+
+    status = []
+    for slot, start in enumerate(startPoints):
+        objfun.slot = slot
+
+        def run():
+            return solve(
+                lambda x: objfun(x, numpy.array([]), scenario=scenario),
+                objfun.params2values(start, include_constant=False),
+                bounds=(objfun.lower_bounds, objfun.upper_bounds),
+                scaling_within_bounds=True
+            )
+
+        # run optimiser twice to detect whether new parameter set is stable
+        for i in range(2):
+            try:
+                soln = run()
+            except PreliminaryRun:
+                log.info(f'new parameter set for {name}optimiser {slot}')
+                continue
+            except NewRun:
+                runids = objfun.speculate(run, max_points=speculate,
+                                          scenario=scenario)
+                if len(runids) > 0:
+                    log.info(f'{len(runids)} speculative parameter sets for '
+                             f'{name}optimiser {slot}')
+                status.append('new')
+                break
+            except Waiting:
+                status.append('waiting')
+                break
+
+            log.info(f"{name}optimiser {slot}: optimum at {soln.x}")
+            status.append('done')
+            break
+    return status
+
+
 def main():
     logging.basicConfig(level=logging.INFO)
-    log = logging.getLogger('ObjectiveFunction.dfols')
 
     parser = argparse.ArgumentParser()
     parser.add_argument('config', type=Path,
@@ -29,33 +84,15 @@ def main():
     args = parser.parse_args()
 
     cfg = DFOLSConfig(args.config)
+    status = optimise(cfg.objectiveFunction, cfg.startPoints,
+                      speculate=cfg.cfg['setup']['speculate'])
 
-    # run optimiser twice to detect whether new parameter set is stable
-    for i in range(2):
-        # start with lower bounds
-        try:
-            x = solve(
-                lambda x: cfg.objectiveFunction(x, numpy.array([])),
-                cfg.objectiveFunction.params2values(cfg.values,
-                                                    include_constant=False),
-                bounds=(
-                    cfg.objectiveFunction.lower_bounds,
-                    cfg.objectiveFunction.upper_bounds),
-                scaling_within_bounds=True
-            )
-        except PreliminaryRun:
-            log.info('new parameter set')
-            continue
-        except NewRun:
-            print('new')
-            sys.exit(1)
-        except Waiting:
-            print('waiting')
-            sys.exit(2)
-
-        break
-
-    log.info(f"optimum at {x}")
+    if 'new' in status:
+        print('new')
+        sys.exit(1)
+    if 'waiting' in status:
+        print('waiting')
+        sys.exit(2)
     print('done')
 
 
@@ -33,6 +33,110 @@ def model(x, y, params):
         + params['f']
 
 
+def generate(cfg, dname, scale):
+    """generate synthetic data
+
+    :param cfg: the configuration
+    :type cfg: ObjFunConfig
+    :param dname: the name of the data file
+    :type dname: Path
+    :param scale: scale for random noise to add to synthetic data
+    """
+    logging.info('generating synthetic data')
+    # create a random parameter set
+    params = {}
+    for p in cfg.optimise_parameters:
+        # generate a uniformly distributed random value
+        # using the range of the parameter
+        params[p] = cfg.optimise_parameters[p](
+            random.uniform(cfg.optimise_parameters[p].minv,
+                           cfg.optimise_parameters[p].maxv))
+    # store generated parameters in file
+    pname = cfg.basedir / 'parameters.data'
+    with pname.open('w') as poutput:
+        for p in params:
+            poutput.write(f'{p} {params[p]}\n')
+    # store synthetic data in file after adding some noise
+    with dname.open('w') as output:
+        for y in range(100):
+            y = y - 50
+            for x in range(100):
+                x = x - 50
+                output.write('{0},{1},{2}\n'.format(
+                    x, y, model(x, y, params) +  # noqa: W504
+                    numpy.random.normal(scale=scale)))
+
+
+def compute(cfg, dname, params):
+    """compute the result of the model for a parameter set
+
+    :param cfg: the configuration
+    :type cfg: ObjFunConfig
+    :param dname: the name of the data file
+    :type dname: Path
+    :param params: dictionary of parameters
+    :type params: dict
+    :return: the result of the type required by the objective function
+    """
+    if cfg.objfunType == 'simobs':
+        result = {}
+        for i, n in enumerate(cfg.observationNames):
+            result[n] = model(i * 5, 0, params) - cfg.targets[n]
+        return result
+
+    data = pandas.read_csv(dname, names=['x', 'y', 'z'])
+
+    # compute model values for parameter
+    data['computed'] = data.apply(lambda row:
+                                  model(row['x'], row['y'], params),
+                                  axis=1)
+
+    # compute difference between observation and model
+    data['diff'] = data['computed'] - data['z']
+
+    if cfg.objfunType == 'misfit':
+        # and standard devation
+        return data['diff'].std()
+    return data['diff'].to_numpy()
+
+
+def run(cfg, dname, delay):
+    """run the model for a new parameter set and store its result
+
+    :param cfg: the configuration
+    :type cfg: ObjFunConfig
+    :param dname: the name of the data file
+    :type dname: Path
+    :param delay: delay setting results by delay seconds
+    """
+    logging.info('running model')
+    objfun = cfg.objectiveFunction
+    start = time.perf_counter()
+    cpustart = time.process_time()
+    # get parameter set without result from lookup table
+    try:
+        runid, params = objfun.get_new(with_id=True)
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
+
+    result = compute(cfg, dname, params)
+
+    if delay > 0:
+        logging.info(f'waiting {delay} seconds')
+        time.sleep(delay)
+    logging.info(f'result {result}')
+
+    if objfun.is_cancelled(runid):
+        logging.info('run was cancelled')
+        return
+
+    # store results for parameter set in lookup table
+    objfun.set_result(params, result,
+                      walltime=time.perf_counter() - start,
+                      cputime=time.process_time() - cpustart)
+
+
 def main():
     logging.basicConfig(level=logging.INFO)
 
@@ -54,67 +158,9 @@ def main():
     if args.generate:
         if cfg.objfunType == 'simobs':
             parser.error('no need to generate data for simobs example')
-        logging.info('generating synthetic data')
-        # create a random parameter set
-        params = {}
-        for p in cfg.optimise_parameters:
-            # generate a uniformly distributed random value
-            # using the range of the parameter
-            params[p] = cfg.optimise_parameters[p](
-                random.uniform(cfg.optimise_parameters[p].minv,
-                               cfg.optimise_parameters[p].maxv))
-        # store generated parameters in file
-        pname = cfg.basedir / 'parameters.data'
-        with pname.open('w') as poutput:
-            for p in params:
-                poutput.write(f'{p} {params[p]}\n')
-        # store synthetic data in file after adding some noise
-        with dname.open('w') as output:
-            for y in range(100):
-                y = y - 50
-                for x in range(100):
-                    x = x - 50
-                    output.write('{0},{1},{2}\n'.format(
-                        x, y, model(x, y, params) +  # noqa: W504
-                        numpy.random.normal(scale=args.scale)))
+        generate(cfg, dname, args.scale)
     else:
-        logging.info('running model')
-        objfun = cfg.objectiveFunction
-        # get parameter set without result from lookup table
-        try:
-            params = objfun.get_new()
-        except Exception as e:
-            logging.error(e)
-            sys.exit(1)
-
-        if cfg.objfunType == 'simobs':
-            result = {}
-            for i, n in enumerate(cfg.observationNames):
-                result[n] = model(i * 5, 0, params) - cfg.targets[n]
-        else:
-            data = pandas.read_csv(dname, names=['x', 'y', 'z'])
-
-            # compute model values for parameter
-            data['computed'] = data.apply(lambda row:
-                                          model(row['x'], row['y'], params),
-                                          axis=1)
-
-            # compute difference between observation and model
-            data['diff'] = data['computed'] - data['z']
-
-            if cfg.objfunType == 'misfit':
-                # and standard devation
-                result = data['diff'].std()
-            elif cfg.objfunType == 'residual':
-                result = data['diff'].to_numpy()
-
-        if args.delay > 0:
-            logging.info(f'waiting {args.delay} seconds')
-            time.sleep(args.delay)
-        logging.info(f'result {result}')
-
-        # store results for parameter set in lookup table
-        objfun.set_result(params, result)
+        run(cfg, dname, args.delay)
 
 
 if __name__ == '__main__':
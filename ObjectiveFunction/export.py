@@ -0,0 +1,267 @@
+__all__ = ['export', 'read_export']
+
+import argparse
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+
+from .common import LookupState
+from .model import DBRun, DBRunParameters, DBParameter
+from .parameter import ParameterInt
+
+# the maximum number of values bound in a single IN clause
+IN_BATCH = 500
+
+
+def _format(fname, fmt):
+    if fmt is None:
+        fmt = 'parquet' if Path(fname).suffix == '.parquet' else 'arrow'
+    if fmt not in ['arrow', 'parquet']:
+        raise ValueError(f'unknown export format {fmt}')
+    return fmt
+
+
+def _result_size(objfun, runids):
+    """the number of values of each result, None for scalar results
+
+    :param runids: dictionary mapping the scenario names to the lists of
+                   run IDs
+    """
+    for scenario in runids:
+        objfun._route(scenario)
+        for i in range(0, len(runids[scenario]), IN_BATCH):
+            run = objfun._query_runs(with_result=True).filter(
+                objfun._Run.id.in_(runids[scenario][i:i + IN_BATCH]),
+                objfun._Run.state == LookupState.COMPLETED).first()
+            if run is not None:
+                result = numpy.asarray(objfun._read_result(run))
+                return None if result.ndim == 0 else result.size
+    if hasattr(objfun, 'observationNames'):
+        return len(objfun.observationNames)
+    return None if objfun._result_name == 'misfit' else 0
+
+
+def _schema(objfun, size):
+    fields = [pyarrow.field('runid', pyarrow.int64()),
+              pyarrow.field('scenario', pyarrow.string())]
+    for p in objfun.parameters:
+        if isinstance(objfun.parameters[p], ParameterInt):
+            fields.append(pyarrow.field(p, pyarrow.int64()))
+        else:
+            fields.append(pyarrow.field(p, pyarrow.float64()))
+    fields += [pyarrow.field('state', pyarrow.string()),
+               pyarrow.field('slot', pyarrow.int64()),
+               pyarrow.field('priority', pyarrow.int64()),
+               pyarrow.field('walltime', pyarrow.float64()),
+               pyarrow.field('cputime', pyarrow.float64())]
+    if size is None:
+        fields.append(pyarrow.field(objfun._result_name, pyarrow.float64()))
+    else:
+        fields.append(pyarrow.field(
+            objfun._result_name,
+            pyarrow.list_(pyarrow.float64(), size), nullable=False))
+    metadata = {'study': objfun.study,
+                'parameters': list(objfun.parameters),
+                'result': objfun._result_name}
+    if hasattr(objfun, 'observationNames'):
+        metadata['observationNames'] = objfun.observationNames
+    return pyarrow.schema(fields,
+                          metadata={'objfun': json.dumps(metadata)})
+
+
+def _read_chunk(objfun, runids, scenarios, schema, size, pool):
+    """read a chunk of runs into a record batch
+
+    The runs are queried in batches of IN_BATCH IDs so that the number of
+    bound parameters does not depend on the chunk size.
+    """
+    session = objfun.session
+    batches = [runids[i:i + IN_BATCH]
+               for i in range(0, len(runids), IN_BATCH)]
+
+    runs = []
+    for batch in batches:
+        runs += objfun._query_runs(with_result=True).filter(
+            objfun._Run.id.in_(batch)).order_by(objfun._Run.id)
+    columns = {'runid': [run.id for run in runs],
+               'scenario': [scenarios[run.scenario_id] for run in runs],
+               'state': [run.state.name for run in runs],
+               'slot': [run.slot for run in runs],
+               'priority': [run.priority for run in runs],
+               'walltime': [run.walltime for run in runs],
+               'cputime': [run.cputime for run in runs]}
+
+    # decode the parameter values of all runs of the chunk at once
+    values = {p: {} for p in objfun.parameters}
+    for batch in batches:
+        rows = session.query(DBRunParameters.lid, DBParameter.name,
+                             DBRunParameters.value).join(
+            DBParameter, DBRunParameters.pid == DBParameter.id).filter(
+                DBRunParameters.lid.in_(batch))
+        for lid, name, value in rows:
+            values[name][lid] = value
+    for p in objfun.parameters:
+        param = objfun.parameters[p]
+        columns[p] = [param.inv_transform(values[p][run.id])
+                      for run in runs]
+
+    # read the results of the completed runs in parallel
+    completed = [run for run in runs if run.state == LookupState.COMPLETED]
+    results = dict(zip([run.id for run in completed],
+                       pool.map(objfun._read_result, completed)))
+    session.commit()
+    if size is None:
+        columns[objfun._result_name] = [
+            results[run.id] if run.id in results else None for run in runs]
+    else:
+        # missing results are stored as NaN so that the values can be
+        # mapped into a contiguous array
+        data = numpy.full((len(runs), size), numpy.nan)
+        for i, run in enumerate(runs):
+            if run.id in results:
+                data[i] = results[run.id]
+        columns[objfun._result_name] = pyarrow.FixedSizeListArray.from_arrays(
+            pyarrow.array(data.ravel()), size)
+
+    arrays = []
+    for f in schema:
+        if isinstance(columns[f.name], pyarrow.Array):
+            arrays.append(columns[f.name])
+        else:
+            arrays.append(pyarrow.array(columns[f.name], type=f.type))
+    return pyarrow.record_batch(arrays, schema=schema)
+
+
+def export(objfun, fname, scenario=None, fmt=None, chunk_size=10000):
+    """export the lookup table of a study to a columnar file
+
+    The runs are read and written in chunks so that the memory use is
+    bounded by the chunk size. The parameter values are stored as typed
+    columns. Scalar results are stored in a float column and vector results
+    in a fixed size list column where the results of runs that are not
+    completed are NaN. The export requires the optional pyarrow package.
+
+    :param objfun: the objective function
+    :type objfun: ObjectiveFunction
+    :param fname: the name of the output file
+    :type fname: Path
+    :param scenario: the name of the scenario to export. All scenarios of
+                     the study are exported when set to None
+    :param fmt: the format of the output file, either arrow (Arrow IPC) or
+                parquet. By default the format is determined from the
+                suffix of the file name
+    :param chunk_size: the number of runs per chunk
+    :return: the number of exported runs
+    """
+    fmt = _format(fname, fmt)
+
+    if scenario is None:
+        dbScenarios = objfun._study.scenarios
+    else:
+        dbScenarios = [objfun.getScenario(scenario)]
+    scenarios = {s.id: s.name for s in dbScenarios}
+    # the runs of each scenario may be stored in a shard of their own
+    runids = {}
+    for sid, name in scenarios.items():
+        objfun._route(name)
+        runids[name] = [i for (i, ) in objfun.session.query(DBRun.id).filter(
+            DBRun.scenario_id == sid).order_by(DBRun.id)]
+
+    size = _result_size(objfun, runids)
+    schema = _schema(objfun, size)
+
+    if fmt == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(str(fname), schema)
+    else:
+        writer = pyarrow.ipc.new_file(str(fname), schema)
+    with writer, ThreadPoolExecutor() as pool:
+        for name in runids:
+            objfun._route(name)
+            for i in range(0, len(runids[name]), chunk_size):
+                batch = _read_chunk(objfun, runids[name][i:i + chunk_size],
+                                    scenarios, schema, size, pool)
+                if fmt == 'parquet':
+                    writer.write_batch(batch)
+                else:
+                    writer.write(batch)
+    return sum(len(r) for r in runids.values())
+
+
+def read_export(fname, fmt=None, concatenate=True):
+    """read an exported study
+
+    Arrow IPC files are memory mapped. The export holds a record batch for
+    each chunk of runs. The vector results of a batch are mapped into a 2D
+    numpy array without copying them. If the export holds several batches
+    the arrays are concatenated into a single array, which copies them,
+    unless concatenate is False. The scalar columns are copied into the
+    DataFrame if the export holds several batches.
+
+    :param fname: the name of the exported file
+    :type fname: Path
+    :param fmt: the format of the file, either arrow or parquet. By default
+                the format is determined from the suffix of the file name
+    :param concatenate: when False the vector results are returned as lists
+                        of the arrays of the batches which are not copied
+    :return: a pandas DataFrame with the scalar columns, a dictionary
+             mapping the names of vector results to 2D numpy arrays with a
+             row for each run, or lists of them, and the metadata of the
+             export
+    """
+    fmt = _format(fname, fmt)
+    if fmt == 'parquet':
+        table = pyarrow.parquet.read_table(str(fname), memory_map=True)
+    else:
+        source = pyarrow.memory_map(str(fname), 'r')
+        table = pyarrow.ipc.open_file(source).read_all()
+    metadata = json.loads(table.schema.metadata[b'objfun'])
+
+    arrays = {}
+    for f in table.schema:
+        if isinstance(f.type, pyarrow.FixedSizeListType):
+            chunks = [c.values.to_numpy().reshape(-1, f.type.list_size)
+                      for c in table.column(f.name).chunks]
+            if not concatenate:
+                arrays[f.name] = chunks
+            elif len(chunks) == 1:
+                arrays[f.name] = chunks[0]
+            else:
+                arrays[f.name] = numpy.concatenate(
+                    chunks + [numpy.empty((0, f.type.list_size))])
+            table = table.drop([f.name])
+    return table.to_pandas(split_blocks=True), arrays, metadata
+
+
+def main():
+    from .config import ObjFunConfig
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', type=Path,
+                        help='name of configuration file')
+    parser.add_argument('output', type=Path,
+                        help='name of the output file')
+    parser.add_argument('-s', '--scenario',
+                        help='the scenario to export, by default all '
+                        'scenarios are exported')
+    parser.add_argument('-f', '--format', choices=['arrow', 'parquet'],
+                        help='the output format, by default it is '
+                        'determined from the suffix of the output file')
+    parser.add_argument('-c', '--chunk-size', type=int, default=10000,
+                        help='the number of runs per chunk')
+    args = parser.parse_args()
+
+    cfg = ObjFunConfig(args.config)
+    n = export(cfg.objectiveFunction, args.output, scenario=args.scenario,
+               fmt=args.format, chunk_size=args.chunk_size)
+    logging.info(f'exported {n} runs to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+__all__ = ['collect_garbage', 'enforce_quota']
+
+import argparse
+import gzip
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+import numpy
+
+from .common import LookupState, RunPriority
+from .model import DBScenario, DBRunPath, DBRunResult
+from .storage import ResultStorage
+
+RESULT_FILE = re.compile(r'^(residuals|simobs)_\d+\.(npy|npc|json|json\.gz)$')
+TEMPORARY_FILE = re.compile(r'^\.(residuals|simobs)_\d+\..+\..+$')
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+              'T': 1024 ** 4}
+
+
+def _result_files(basedir):
+    """the result files and temporary files in the base directory"""
+    results = []
+    temporary = []
+    for entry in os.scandir(basedir):
+        if not entry.is_file():
+            continue
+        if RESULT_FILE.match(entry.name):
+            results.append(entry)
+        elif TEMPORARY_FILE.match(entry.name):
+            temporary.append(entry)
+    return results, temporary
+
+
+def _referenced(objfun):
+    """the result files referenced by any study of the database"""
+    sessions = [objfun._session]
+    if objfun.sharded:
+        # the runs of other studies may be stored in shards as well
+        for (shard, ) in objfun._session.query(DBScenario.id):
+            if objfun._shard_exists(shard):
+                sessions.append(objfun._shard_session(shard))
+    referenced = set()
+    for session in sessions:
+        referenced.update(os.path.abspath(p) for (p, ) in session.query(
+            DBRunPath.path).filter(DBRunPath.path.isnot(None)))
+        session.commit()
+    return referenced
+
+
+def _remove(entries, dry_run, log):
+    """remove files and return the number of bytes freed"""
+    freed = 0
+    for entry in entries:
+        log.info(f'remove {entry.path}')
+        freed += entry.stat().st_size
+        if not dry_run:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+    return freed
+
+
+def _missing_results(objfun, scenario, log):
+    """the IDs of the completed runs of a scenario whose result file is
+    missing"""
+    missing = []
+    for run in objfun.iter_runs(scenario=scenario,
+                                state=LookupState.COMPLETED):
+        if run.result is None or not os.path.exists(run.result):
+            missing.append(run.id)
+    # results may be stored in the database instead
+    inline = set()
+    for i in range(0, len(missing), 500):
+        inline.update(runid for (runid, ) in objfun.session.query(
+            DBRunResult.id).filter(DBRunResult.id.in_(missing[i:i + 500])))
+    missing = [i for i in missing if i not in inline]
+    for runid in missing:
+        log.warning(f'result of run {runid} is missing')
+    return missing
+
+
+def collect_garbage(objfun, dry_run=False, requeue=False, min_age=3600.):
+    """reconcile the result files with the lookup table
+
+    Result files in the base directory that are not referenced by any run
+    of the database are removed. They are left behind when runs are deleted
+    or their results are replaced. Temporary files of interrupted writes
+    are removed as well. Only files older than min_age are removed since a
+    result file is renamed into place before its path is committed. The
+    orphaned files are checked against the database again just before
+    they are removed. Completed runs of the study whose result file is
+    missing are reported and optionally enqueued again.
+
+    :param objfun: the objective function
+    :type objfun: ObjectiveFunction
+    :param dry_run: when True only report what would be done
+    :type dry_run: bool
+    :param requeue: when True completed runs whose result file is missing
+                    are enqueued again with background priority
+    :type requeue: bool
+    :param min_age: the age in seconds after which orphaned and temporary
+                    files are removed
+    :return: dictionary with the lists of removed orphaned files
+             (orphans) and temporary files (temporary), the IDs of the
+             runs with a missing result file (missing) and the number of
+             bytes freed (freed)
+    """
+    log = logging.getLogger('ObjectiveFunction.garbage')
+    stats = {'orphans': [], 'temporary': [], 'missing': [], 'freed': 0}
+    if objfun._result_handle != 'path':
+        return stats
+
+    results, temporary = _result_files(objfun.basedir)
+    now = time.time()
+    # the files of results that are being stored are not referenced yet
+    results = [e for e in results if now - e.stat().st_mtime >= min_age]
+    temporary = [e for e in temporary if now - e.stat().st_mtime >= min_age]
+    referenced = _referenced(objfun)
+    orphans = [e for e in results
+               if os.path.abspath(e.path) not in referenced]
+    if len(orphans) > 0 and not dry_run:
+        # check again in case a result was replaced in the meantime
+        referenced = _referenced(objfun)
+        orphans = [e for e in orphans
+                   if os.path.abspath(e.path) not in referenced]
+    stats['freed'] = _remove(orphans + temporary, dry_run, log)
+    stats['orphans'] = [e.path for e in orphans]
+    stats['temporary'] = [e.path for e in temporary]
+
+    for scenario in objfun.scenarios:
+        missing = _missing_results(objfun, scenario, log)
+        stats['missing'] += missing
+        if requeue and not dry_run and len(missing) > 0:
+            runs = objfun._query_runs().filter(
+                objfun._Run.id.in_(missing)).all()
+            for run in runs:
+                run.path = None
+                objfun._enqueue(run, RunPriority.BACKGROUND)
+            objfun.session.commit()
+            objfun._states_changed(runs)
+    return stats
+
+
+def _best_run(objfun, runs):
+    """the run with the smallest sum of squared residuals"""
+    if objfun._result_name != 'residuals':
+        raise ValueError('the centre is required for '
+                         f'{objfun._result_name} results')
+    best = None
+    for run in runs:
+        misfit = numpy.sum(numpy.square(objfun.storage.load(run.result)))
+        if best is None or misfit < best[0]:
+            best = (misfit, run)
+    return best[1]
+
+
+def _compact(fname, storage):
+    """the new name and the contents of a compacted result file
+
+    :return: None if the file is already compact
+    """
+    if fname.endswith('.json'):
+        with open(fname, 'rb') as f:
+            return fname + '.gz', gzip.compress(f.read())
+    if fname.endswith('.npy') and storage.compact:
+        return fname[:-len('.npy')] + storage.suffix, storage.dumps(
+            storage.load(fname))
+    return None
+
+
+def _archive(fname, new):
+    """copy a result file to the archive"""
+    tmpname = os.path.join(os.path.dirname(new),
+                           f'.{os.path.basename(new)}.tmp')
+    shutil.copyfile(fname, tmpname)
+    with open(tmpname, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmpname, new)
+
+
+def _distances(objfun, runs, centre):
+    """the distances of the runs from the centre
+
+    Each parameter is scaled by its range.
+    """
+    scale = numpy.array([
+        objfun.parameters[p].maxv - objfun.parameters[p].minv
+        for p in objfun._paramlist], dtype=float)
+    scale[scale == 0] = 1
+    centre = objfun.params2values(centre)
+    return [numpy.linalg.norm((run.values - centre) / scale)
+            for run in runs]
+
+
+def _evict(objfun, run, archive, storage, dry_run, log):
+    """archive or compact the result of a run
+
+    :return: the new name of the result file and the number of bytes freed
+             or None if the result cannot be compacted
+    """
+    size = os.path.getsize(run.result)
+    if archive is not None:
+        log.info(f'archive result of run {run.id}')
+        new = os.path.join(str(archive), os.path.basename(run.result))
+        freed = size
+        if not dry_run:
+            _archive(run.result, new)
+    else:
+        compacted = _compact(run.result, storage)
+        if compacted is None:
+            return None
+        log.info(f'compact result of run {run.id}')
+        new, data = compacted
+        freed = size - len(data)
+        if not dry_run:
+            # the original file is removed once the database is updated
+            objfun._atomic_write(new, data, sync=True)
+    if not dry_run:
+        objfun._route_run(run.id)
+        objfun.session.query(DBRunPath).filter_by(id=run.id).update(
+            {'path': new}, synchronize_session=False)
+        objfun.session.commit()
+        os.unlink(run.result)
+    return new, freed
+
+
+def enforce_quota(objfun, quota, centre=None, scenario=None, archive=None,
+                  storage=None, dry_run=False):
+    """reduce the disk usage of the result files below a quota
+
+    The results of completed runs of the scenario are compacted, or moved
+    to the archive directory, starting with the runs furthest from the
+    centre until the result files in the base directory use less than
+    quota bytes. Distances are measured with each parameter scaled by its
+    range. Residuals are compacted using the storage, simulated
+    observations are compressed with gzip. The results remain readable.
+
+    :param objfun: the objective function
+    :type objfun: ObjectiveFunction
+    :param quota: the number of bytes the result files may use
+    :type quota: int
+    :param centre: dictionary of parameter values, eg the current optimum.
+                   By default the completed run with the smallest sum of
+                   squared residuals is used which requires reading all
+                   results
+    :param scenario: the name of the scenario
+    :param archive: the directory to which results are moved. By default
+                    results are compacted
+    :type archive: Path
+    :param storage: the storage used to compact residuals, by default
+                    float32 values compressed with zlib
+    :type storage: ResultStorage
+    :param dry_run: when True only report what would be done
+    :type dry_run: bool
+    :return: list of tuples of the run ID, the old and the new name of the
+             result file and the number of bytes freed
+    """
+    log = logging.getLogger('ObjectiveFunction.garbage')
+    if storage is None:
+        storage = ResultStorage(dtype='float32', compression='zlib')
+    if archive is not None:
+        os.makedirs(archive, exist_ok=True)
+
+    results, _ = _result_files(objfun.basedir)
+    usage = sum(entry.stat().st_size for entry in results)
+    if usage <= quota:
+        return []
+
+    runs = [run for run in objfun.iter_runs(scenario=scenario,
+                                            state=LookupState.COMPLETED)
+            if run.result is not None and os.path.exists(run.result)]
+    if len(runs) == 0:
+        return []
+    if centre is None:
+        centre = objfun.getParameters(_best_run(objfun, runs).id)
+    distances = _distances(objfun, runs, centre)
+
+    evicted = []
+    for i in numpy.argsort(distances)[::-1]:
+        if usage <= quota:
+            break
+        result = _evict(objfun, runs[i], archive, storage, dry_run, log)
+        if result is None:
+            continue
+        new, freed = result
+        usage -= freed
+        evicted.append((runs[i].id, runs[i].result, new, freed))
+    return evicted
+
+
+def _size(value):
+    """parse a size with an optional unit, eg 10G"""
+    match = re.match(r'^\s*([0-9.]+)\s*([KMGT]?)i?B?\s*$', value.upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f'invalid size {value}')
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def main():
+    from .config import ObjFunConfig
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description='remove orphaned result files and enforce a quota')
+    parser.add_argument('config', type=Path,
+                        help='name of configuration file')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only report what would be done')
+    parser.add_argument('-r', '--requeue', action='store_true',
+                        help='enqueue completed runs whose result file is '
+                        'missing again')
+    parser.add_argument('-q', '--quota', type=_size,
+                        help='the disk space the result files may use, '
+                        'eg 10G')
+    parser.add_argument('-a', '--archive', type=Path,
+                        help='move results to the archive directory instead '
+                        'of compacting them to enforce the quota')
+    parser.add_argument('-s', '--scenario',
+                        help='the scenario whose results are evicted, by '
+                        'default the scenario of the configuration')
+    args = parser.parse_args()
+
+    cfg = ObjFunConfig(args.config)
+    objfun = cfg.createObjectiveFunction(db=cfg.cfg['setup']['db'])
+    stats = collect_garbage(objfun, dry_run=args.dry_run,
+                            requeue=args.requeue)
+    logging.info(f'removed {len(stats["orphans"])} orphaned and '
+                 f'{len(stats["temporary"])} temporary files, '
+                 f'freed {stats["freed"]} bytes')
+    if len(stats['missing']) > 0:
+        logging.warning(f'{len(stats["missing"])} completed runs have no '
+                        'result file')
+    if args.quota is not None:
+        storage = cfg.storage if cfg.storage.compact else None
+        evicted = enforce_quota(objfun, args.quota, scenario=args.scenario,
+                                archive=args.archive, storage=storage,
+                                dry_run=args.dry_run)
+        logging.info(f'evicted {len(evicted)} results, freed '
+                     f'{sum(e[3] for e in evicted)} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,46 @@
 __all__ = ['Base', 'DBStudy', 'DBParameterInt', 'DBParameterFloat',
-           'getDBParameter', 'DBScenario']
-
-from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Float, Enum
-from sqlalchemy import ForeignKey, UniqueConstraint
+           'getDBParameter', 'DBScenario', 'DBStartPoint',
+           'DBApproximateHit', 'SCHEMA_VERSION', 'schema_version',
+           'upgrade_schema']
+
+from sqlalchemy.orm import declarative_base, relationship, deferred
+from sqlalchemy import Column, Integer, String, Float, Enum, JSON, DateTime
+from sqlalchemy import LargeBinary, BigInteger
+from sqlalchemy import ForeignKey, UniqueConstraint, Index
+from sqlalchemy import inspect, select, func, text
+import datetime
+import json
 
 from .parameter import ParameterInt, ParameterFloat
 from .common import LookupState
 
 Base = declarative_base()
 
+# the tables of runs are placed in a separate schema which is mapped to the
+# shard of a scenario or to the default schema if the database is not
+# sharded
+SHARD = 'shard'
+# the IDs of the runs of a shard start at the scenario ID shifted by
+# SHARD_BITS so that they are unique across shards
+SHARD_BITS = 32
+RunID = BigInteger().with_variant(Integer, 'sqlite')
+# the version of the schema, increment it whenever a table changes
+SCHEMA_VERSION = 4
+
+
+class DBSchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+
 
 class DBStudy(Base):
     __tablename__ = 'studies'
 
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
+    fingerprint = Column(String)
+    class_fingerprint = Column(String)
 
     obsnames = relationship("DBObsName", order_by="DBObsName.name",
                             back_populates="study")
@@ -129,6 +154,9 @@ class DBScenario(Base):
 
     study = relationship("DBStudy", back_populates="scenarios")
     runs = relationship("DBRun", back_populates="scenario")
+    start_points = relationship("DBStartPoint", order_by="DBStartPoint.slot",
+                                back_populates="scenario",
+                                cascade="all, delete-orphan")
 
     __table_args__ = (UniqueConstraint('name', 'study_id',
                                        name='_unique_scenario'), )
@@ -137,19 +165,34 @@ class DBScenario(Base):
 class DBRun(Base):
     __tablename__ = 'runs'
 
-    id = Column(Integer, primary_key=True)
+    id = Column(RunID, primary_key=True)
     scenario_id = Column(Integer, ForeignKey('scenarios.id'))
     state = Column(Enum(LookupState))
     type = Column(String)
+    slot = Column(Integer, default=0)
+    priority = Column(Integer, default=0)
+    enqueued = Column(DateTime, default=datetime.datetime.utcnow)
+    walltime = Column(Float)
+    cputime = Column(Float)
 
     values = relationship("DBRunParameters", back_populates="_run",
                           cascade="all, delete-orphan")
     scenario = relationship("DBScenario", back_populates="runs")
+    approximate_hits = relationship("DBApproximateHit", back_populates="run",
+                                    cascade="all, delete-orphan")
 
     __mapper_args__ = {
         'polymorphic_identity': 'run',
         'polymorphic_on': type}
 
+    # the work queue is ordered by priority and enqueue time
+    __table_args__ = (
+        Index('ix_runs_queue', 'scenario_id', 'state', 'priority',
+              'enqueued'),
+        # the runs added since a given run are found without a scan
+        Index('ix_runs_scenario', 'scenario_id', 'id'),
+        {'schema': SHARD, 'sqlite_autoincrement': True})
+
     def __init__(self, scenario, parameters):
         self.scenario = scenario
         for db_param in self.scenario.study.parameters:
@@ -168,8 +211,9 @@ class DBRun(Base):
 
 class DBRunMisfit(DBRun):
     __tablename__ = 'runs_misfit'
+    __table_args__ = {'schema': SHARD}
 
-    id = Column(Integer, ForeignKey('runs.id'), primary_key=True)
+    id = Column(RunID, ForeignKey(f'{SHARD}.runs.id'), primary_key=True)
     misfit = Column(Float)
 
     __mapper_args__ = {
@@ -178,19 +222,50 @@ class DBRunMisfit(DBRun):
 
 class DBRunPath(DBRun):
     __tablename__ = 'runs_path'
+    __table_args__ = {'schema': SHARD}
 
-    id = Column(Integer, ForeignKey('runs.id'), primary_key=True)
+    id = Column(RunID, ForeignKey(f'{SHARD}.runs.id'), primary_key=True)
     path = Column(String)
 
+    blob = relationship("DBRunResult", back_populates="run", uselist=False,
+                        cascade="all, delete-orphan")
+
     __mapper_args__ = {
         'polymorphic_identity': 'path'}
 
+    @property
+    def result_data(self):
+        """the result stored in the database"""
+        if self.blob is None:
+            return None
+        return self.blob.data
+
+    @result_data.setter
+    def result_data(self, data):
+        if self.blob is None:
+            self.blob = DBRunResult(data=data)
+        else:
+            self.blob.data = data
+
+
+class DBRunResult(Base):
+    __tablename__ = 'run_results'
+    __table_args__ = {'schema': SHARD}
+
+    id = Column(RunID, ForeignKey(f'{SHARD}.runs_path.id'),
+                primary_key=True)
+    # the result is only loaded when it is accessed or requested
+    data = deferred(Column(LargeBinary))
+
+    run = relationship(DBRunPath, back_populates="blob")
+
 
 class DBRunParameters(Base):
     __tablename__ = 'run_parameters'
+    __table_args__ = {'schema': SHARD}
 
     id = Column(Integer, primary_key=True)
-    lid = Column(Integer, ForeignKey('runs.id'))
+    lid = Column(RunID, ForeignKey(f'{SHARD}.runs.id'))
     pid = Column(Integer, ForeignKey('parameters.id'))
     value = Column(Integer)
 
@@ -202,6 +277,140 @@ class DBRunParameters(Base):
         return self.parameter.name
 
 
+class DBApproximateHit(Base):
+    __tablename__ = 'approximate_hits'
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(RunID, ForeignKey(f'{SHARD}.runs.id'))
+    parameters = Column(JSON)
+    # the parameters in canonical form so that each hit is recorded once
+    key = Column(String)
+
+    run = relationship(DBRun, back_populates="approximate_hits")
+
+    __table_args__ = (
+        Index('ix_approximate_hits_key', 'run_id', 'key', unique=True),
+        {'schema': SHARD})
+
+    def __init__(self, run, parameters):
+        self.run = run
+        self.parameters = parameters
+        self.key = self.make_key(parameters)
+
+    @staticmethod
+    def make_key(parameters):
+        """the canonical form of a dictionary of parameter values"""
+        return json.dumps(parameters, sort_keys=True)
+
+
+class DBStartPoint(Base):
+    __tablename__ = 'start_points'
+
+    id = Column(Integer, primary_key=True)
+    scenario_id = Column(Integer, ForeignKey('scenarios.id'))
+    slot = Column(Integer)
+
+    values = relationship("DBStartPointParameters", back_populates="_start",
+                          cascade="all, delete-orphan")
+    scenario = relationship("DBScenario", back_populates="start_points")
+
+    __table_args__ = (UniqueConstraint('scenario_id', 'slot',
+                                       name='_unique_start_point'), )
+
+    def __init__(self, scenario, slot, parameters):
+        self.scenario = scenario
+        self.slot = slot
+        for db_param in self.scenario.study.parameters:
+            DBStartPointParameters(
+                _start=self, parameter=db_param,
+                value=db_param.param.transform(parameters[db_param.name]))
+
+    @property
+    def parameters(self):
+        values = {}
+        for v in self.values:
+            p = v.parameter
+            values[p.name] = p.param.inv_transform(v.value)
+        return values
+
+
+class DBStartPointParameters(Base):
+    __tablename__ = 'start_point_parameters'
+
+    id = Column(Integer, primary_key=True)
+    sid = Column(Integer, ForeignKey('start_points.id'))
+    pid = Column(Integer, ForeignKey('parameters.id'))
+    value = Column(Integer)
+
+    _start = relationship(DBStartPoint, back_populates="values")
+    parameter = relationship("DBParameter")
+
+
+def schema_version(conn):
+    """the version of the schema of a database
+
+    :param conn: a connection to the database
+    :return: the version or 0 if the database predates schema versions
+    """
+    if not inspect(conn).has_table(DBSchemaVersion.__tablename__):
+        return 0
+    version = conn.execute(select(func.max(DBSchemaVersion.version)))\
+        .scalar()
+    return 0 if version is None else version
+
+
+def _add_columns(conn, table):
+    """add the columns and indices missing from a table"""
+    schema = conn.schema_for_object(table)
+    preparer = conn.dialect.identifier_preparer
+    name = preparer.quote(table.name)
+    if schema is not None:
+        name = f'{preparer.quote_schema(schema)}.{name}'
+    existing = {c['name'] for c in inspect(conn).get_columns(
+        table.name, schema=schema)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = (f'ALTER TABLE {name} ADD COLUMN '
+               f'{preparer.quote(column.name)} '
+               f'{column.type.compile(dialect=conn.dialect)}')
+        if column.default is not None and column.default.is_scalar:
+            # existing rows get the default value
+            ddl += f' DEFAULT {column.default.arg!r}'
+        conn.execute(text(ddl))
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def upgrade_schema(conn, tables=None):
+    """create the tables and upgrade tables created by older versions
+
+    Columns and indices added since the tables were created are added to
+    them.
+
+    :param conn: a connection to the database
+    :param tables: the tables to upgrade, by default all tables
+    :raises RuntimeError: if the database was created by a newer version
+    """
+    version = schema_version(conn) if tables is None else 0
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f'the database schema version {version} is newer '
+                           f'than the supported version {SCHEMA_VERSION}')
+    if tables is None:
+        tables = Base.metadata.sorted_tables
+    existing = []
+    if version < SCHEMA_VERSION:
+        existing = [t for t in tables if inspect(conn).has_table(
+            t.name, schema=conn.schema_for_object(t))]
+    Base.metadata.create_all(conn, tables=tables)
+    for table in existing:
+        _add_columns(conn, table)
+    if version != SCHEMA_VERSION and DBSchemaVersion.__table__ in tables:
+        conn.execute(DBSchemaVersion.__table__.delete())
+        conn.execute(DBSchemaVersion.__table__.insert().values(
+            version=SCHEMA_VERSION))
+
+
 if __name__ == '__main__':
     from sqlalchemy import create_engine
     from sqlalchemy.orm import sessionmaker
@@ -0,0 +1,108 @@
+__all__ = ['combine_status', 'run_scenarios']
+
+import argparse
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# the exit codes of the status of the workflow
+EXIT_CODES = {'done': 0, 'new': 1, 'waiting': 2}
+
+
+def combine_status(status):
+    """the status of the workflow given the status of its optimisers
+
+    :param status: sequence of the status of the optimisers, either new,
+                   waiting or done
+    :return: new if any optimiser created new parameter sets, waiting if
+             any optimiser waits for parameter sets to be completed and
+             done otherwise
+    """
+    for s in ['new', 'waiting']:
+        if s in status:
+            return s
+    return 'done'
+
+
+def run_scenarios(optimise, scenarios, max_workers=None):
+    """step the optimisers of several scenarios concurrently
+
+    The optimisers of each scenario are run in a thread of a pool. The
+    optimisers of all scenarios should share a thread safe objective
+    function so that they share its database engine and caches. Lookups
+    spend most of their time waiting for the database which releases the
+    GIL.
+
+    :param optimise: function called with the name of a scenario that runs
+                     the optimisers of the scenario and returns the list of
+                     their status
+    :param scenarios: the names of the scenarios
+    :param max_workers: the maximum number of threads, by default the
+                        default of ThreadPoolExecutor
+    :return: dictionary mapping the names of the scenarios to their
+             combined status
+    """
+    log = logging.getLogger('ObjectiveFunction.multi')
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix='scenario') as pool:
+        futures = {s: pool.submit(optimise, s) for s in scenarios}
+    status = {}
+    for s in futures:
+        status[s] = combine_status(futures[s].result())
+        log.info(f'scenario {s}: {status[s]}')
+    return status
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description='run the optimisers of several scenarios concurrently')
+    parser.add_argument('config', type=Path,
+                        help='name of configuration file')
+    parser.add_argument('scenarios', nargs='*',
+                        help='the names of the scenarios, by default all '
+                        'scenarios of the study')
+    parser.add_argument('-o', '--optimiser', choices=['dfols', 'nlopt'],
+                        default='dfols', help='the optimiser to use')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='the number of scenarios optimised at the '
+                        'same time')
+    args = parser.parse_args()
+
+    if args.optimiser == 'dfols':
+        from .dfols import DFOLSConfig as Config, optimise
+    else:
+        from .optimise import NLConfig as Config, optimise
+    cfg = Config(args.config)
+    # the objective function is shared by the threads
+    cfg.cfg['setup']['threadsafe'] = True
+    objfun = cfg.objectiveFunction
+
+    scenarios = args.scenarios
+    if len(scenarios) == 0:
+        scenarios = objfun.scenarios
+    startPoints = {}
+    for s in scenarios:
+        objfun.createScenario(s)
+        startPoints[s] = cfg.getStartPoints(s)
+
+    speculate = cfg.cfg['setup']['speculate']
+
+    def step(scenario):
+        if args.optimiser == 'dfols':
+            return optimise(objfun, startPoints[scenario], scenario=scenario,
+                            speculate=speculate)
+        return optimise(cfg.createOptimiser(scenario), objfun,
+                        startPoints[scenario], scenario=scenario,
+                        speculate=speculate)
+
+    status = combine_status(
+        run_scenarios(step, scenarios, max_workers=args.workers).values())
+    print(status)
+    sys.exit(EXIT_CODES[status])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,253 @@
-__all__ = ['ObjectiveFunction']
+__all__ = ['ObjectiveFunction', 'RunRecord']
 
 import logging
+import datetime
+import threading
+import atexit
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Mapping
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.schema import CreateSchema
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, scoped_session, joinedload
+from sqlalchemy.orm import selectinload
+from sqlalchemy.pool import SingletonThreadPool, StaticPool
 import numpy
 import pandas
 from abc import ABCMeta, abstractmethod
 
-from .parameter import Parameter
+from .parameter import Parameter, ParameterSpace
 from .model import Base, DBStudy, getDBParameter, DBScenario, DBRun
+from .model import DBStartPoint, DBApproximateHit
+from .model import DBParameter, DBRunParameters, DBRunPath, DBRunResult
+from .model import SHARD, SHARD_BITS, SCHEMA_VERSION
+from .model import schema_version, upgrade_schema
 from .common import PreliminaryRun, NewRun, Waiting, NoNewRun
-from .common import LookupState
+from .common import LookupState, RunPriority
+from .spatial_index import SpatialIndex
+from .snapshot import LookupSnapshot
+
+
+# the objective functions with queued results, they are kept alive until
+# their results are flushed
+_unflushed = {}
+_unflushed_lock = threading.Lock()
+
+
+def _register_unflushed(objfun):
+    """keep an objective function with queued results alive"""
+    with _unflushed_lock:
+        _unflushed[id(objfun)] = objfun
+
+
+def _release_flushed(objfun):
+    """release an objective function once its queue is empty"""
+    with _unflushed_lock:
+        _unflushed.pop(id(objfun), None)
+
+
+@atexit.register
+def _flush_at_exit():
+    """flush the queued results of all objective functions"""
+    with _unflushed_lock:
+        objfuns = list(_unflushed.values())
+    for objfun in objfuns:
+        objfun.flush()
+
+
+def _readonly_url(connstr):
+    """the connection string of a read-only connection
+
+    SQLite databases are opened in read-only mode, PostgreSQL connections
+    use read-only transactions.
+    """
+    url = make_url(connstr)
+    if url.get_backend_name() == 'sqlite' and url.database \
+       and url.database != ':memory:' and 'mode' not in url.query:
+        database = url.database
+        if not database.startswith('file:'):
+            database = 'file:' + database
+        url = url.set(database=database,
+                      query=dict(url.query, mode='ro', uri='true'))
+    return str(url)
+
+
+def _block_flush(session, flush_context, instances):
+    """prevent changes to objects of a read-only database"""
+    raise RuntimeError('the objective function is read-only')
+
+
+def _block_bulk_writes(orm_execute_state):
+    """prevent bulk updates and deletes of a read-only database"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        raise RuntimeError('the objective function is read-only')
+
+
+def _shard_path(connstr, shard):
+    """the name of the database file of a shard of a SQLite database"""
+    url = make_url(connstr)
+    if not url.database or url.database == ':memory:':
+        raise ValueError('sharding requires a database file')
+    root, ext = os.path.splitext(url.database)
+    return f'{root}_scenario{shard}{ext}'
+
+
+def _create_shard(engine, shard):
+    """create the tables of runs of a shard
+
+    The IDs of the runs of the shard start at the scenario ID shifted by
+    SHARD_BITS.
+    """
+    tables = [t for t in Base.metadata.sorted_tables if t.schema == SHARD]
+    start = shard << SHARD_BITS
+    with engine.begin() as conn:
+        if engine.dialect.name == 'sqlite':
+            upgrade_schema(conn, tables=tables)
+            conn.execute(text(
+                "INSERT INTO shard.sqlite_sequence (name, seq) "
+                "SELECT 'runs', :start WHERE NOT EXISTS ("
+                "SELECT 1 FROM shard.sqlite_sequence WHERE name = 'runs')"),
+                {'start': start})
+        else:
+            schema = f'scenario_{shard}'
+            if schema not in inspect(conn).get_schema_names():
+                conn.execute(CreateSchema(schema))
+            upgrade_schema(conn, tables=tables)
+            conn.execute(text(
+                f"SELECT setval('{schema}.runs_id_seq', :start) WHERE ("
+                f"SELECT last_value FROM {schema}.runs_id_seq) < :start"),
+                {'start': start})
+
+
+def _prepare_schema(engine, readonly, shard):
+    """create or upgrade the tables of a database or of a shard
+
+    The schema of a database opened read-only must be current.
+    """
+    if readonly:
+        if shard is not None:
+            return
+        with engine.connect() as conn:
+            version = schema_version(conn)
+        if version != SCHEMA_VERSION:
+            raise RuntimeError(
+                f'the database schema version {version} does not match '
+                f'version {SCHEMA_VERSION}, open the database for writing to '
+                'upgrade it')
+    elif shard is None:
+        # the tables of databases created by older versions are upgraded
+        with engine.begin() as conn:
+            upgrade_schema(conn)
+    else:
+        _create_shard(engine, shard)
 
 
 class SessionMaker:
+    _engines = {}
     _sessions = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _create_engine(connstr, readonly, pool_size, shard, path):
+        """create an engine
 
-    def __call__(self, connstr):
-        if connstr not in self._sessions:
-            engine = create_engine(connstr)
-            Base.metadata.create_all(engine)
-            self._sessions[connstr] = sessionmaker(bind=engine)
-        return self._sessions[connstr]()
+        The tables of runs are mapped to the default schema if shard is
+        None. Otherwise the shard is attached to each connection of a
+        SQLite database or the tables are mapped to the schema of the
+        shard.
+        """
+        kwds = {}
+        if connstr.startswith('sqlite'):
+            # connections may be closed by a different thread
+            # when the session of a thread is garbage collected
+            kwds['connect_args'] = {'check_same_thread': False}
+        elif pool_size is not None:
+            kwds['pool_size'] = pool_size
+        engine = create_engine(connstr, **kwds)
+        if shard is None:
+            schema = None
+        elif engine.dialect.name == 'sqlite':
+            schema = SHARD
+            if readonly:
+                path = f'file:{path}?mode=ro'
+
+            @event.listens_for(engine, 'connect')
+            def attach(dbapi_connection, connection_record):
+                dbapi_connection.execute(
+                    f'ATTACH DATABASE ? AS {SHARD}', (path, ))
+        else:
+            schema = f'scenario_{shard}'
+        engine = engine.execution_options(
+            schema_translate_map={SHARD: schema})
+        if readonly:
+            if engine.dialect.name == 'postgresql':
+                engine = engine.execution_options(postgresql_readonly=True)
+        _prepare_schema(engine, readonly, shard)
+        return engine
+
+    def __call__(self, connstr, threadsafe=False, pool_size=None,
+                 expire_on_commit=True, readonly=False, shard=None):
+        """get a session
+
+        :param connstr: database connection string
+        :param threadsafe: when True return a scoped session which
+                           provides a separate session for each thread
+        :param pool_size: the size of the connection pool, only used
+                          when the engine is created
+        :param expire_on_commit: when False objects are not expired when
+                                 the session is committed
+        :param readonly: when True the database is opened read-only and
+                         the session refuses to write
+        :param shard: the ID of the scenario whose shard holds the runs.
+                      By default the runs are stored in the database itself
+        """
+        path = None
+        if shard is not None and connstr.startswith('sqlite'):
+            path = _shard_path(connstr, shard)
+        if readonly:
+            connstr = _readonly_url(connstr)
+        key = (connstr, expire_on_commit, readonly, shard)
+        with self._lock:
+            if (connstr, readonly, shard) not in self._engines:
+                self._engines[connstr, readonly, shard] = \
+                    self._create_engine(connstr, readonly, pool_size, shard,
+                                        path)
+            if key not in self._sessions:
+                factory = sessionmaker(
+                    bind=self._engines[connstr, readonly, shard],
+                    expire_on_commit=expire_on_commit)
+                if readonly:
+                    event.listen(factory, 'before_flush', _block_flush)
+                    event.listen(factory, 'do_orm_execute',
+                                 _block_bulk_writes)
+                self._sessions[key] = factory
+        if threadsafe:
+            return scoped_session(self._sessions[key])
+        return self._sessions[key]()
 
 
 _sessionmaker = SessionMaker()
 
+RunRecord = namedtuple('RunRecord', ['id', 'state', 'values', 'result'])
+RunRecord.__doc__ = """a lightweight record of a run
+
+ * id: the ID of the run
+ * state: the state of the run
+ * values: array of the parameter values ordered by parameter name
+ * result: the misfit or the name of the result file, None if not set
+"""
 
-class ObjectiveFunction(metaclass=ABCMeta):
+# a completed run found in the snapshot whose result is read from its file
+_FileRun = namedtuple('_FileRun', ['id', 'state', 'path', 'result_data'])
+
+
+class ObjectiveFunction(ParameterSpace, metaclass=ABCMeta):
     """class maintaining a lookup table for an objective function
 
     :param study: the name of the study
@@ -46,85 +264,277 @@ class ObjectiveFunction(metaclass=ABCMeta):
                    PreliminaryRun exception otherwise a
                    NewRun exception is raised. Default=True
     :type prelim: bool
+    :param gradient: the finite difference scheme used to compute gradients,
+                     either forward or central. Gradients are not supported
+                     when set to None. Default=None
+    :type gradient: str
+    :param fd_step: the finite difference step relative to the range of
+                    each parameter. The step is rounded to a multiple of the
+                    parameter resolution. Default=1e-3
+    :type fd_step: float
+    :param surrogate: the class of surrogate model used to predict values
+                      for parameter sets that are not yet completed. A
+                      random value is used when set to None. Default=None
+    :type surrogate: Surrogate
+    :param tolerance: when set a failed lookup returns a completed run whose
+                      parameters differ by at most tolerance multiples of
+                      the resolution. Either a single value for all
+                      parameters or a dictionary mapping parameter names to
+                      tolerances. Default=None
+    :type tolerance: int
+    :param threadsafe: when True each thread uses its own database session
+                       so that get_new, set_result and get_result can be
+                       called concurrently from multiple threads.
+                       Default=False
+    :type threadsafe: bool
+    :param pool_size: the size of the database connection pool. This is
+                      ignored for SQLite databases. Default=None
+    :type pool_size: int
+    :param buffered: when True results are queued by set_result and
+                     written in batches. Default=False
+    :type buffered: bool
+    :param batch_size: the number of queued results after which the queue
+                       is flushed. Default=100
+    :type batch_size: int
+    :param durable: when True result files and the base directory are
+                    synchronised to disk before the results are committed so
+                    that they survive a crash of the operating system.
+                    By default only buffered objective functions are durable.
+                    Default=None
+    :type durable: bool
+    :param schedule: the order in which NEW parameter sets are handed out,
+                     either priority (in order of priority and enqueue
+                     time) or shortest (shortest predicted wall time first
+                     within each priority). Default=priority
+    :type schedule: str
+    :param expire_on_commit: when False the study, its parameters and the
+                             scenarios are kept in memory instead of being
+                             reloaded after each commit. Only the runs,
+                             whose state may be changed by other processes,
+                             are reloaded when they are queried.
+                             Default=True
+    :type expire_on_commit: bool
+    :param readonly: when True the database is opened read-only. The study
+                     and the scenario must exist. Lookups never create
+                     entries and any attempt to write raises a
+                     RuntimeError. Default=False
+    :type readonly: bool
+    :param cache_table: when True the lookup table of each scenario is read
+                        once and kept in memory. Entries added by other
+                        processes are only seen after calling
+                        :meth:`refresh`. The table can only be cached when
+                        the database is opened read-only. Default=False
+    :type cache_table: bool
+    :param snapshot: when True the completed runs are indexed in a memory
+                     mapped snapshot file next to the database which is
+                     updated whenever results are stored. Completed
+                     parameter sets are then looked up in the snapshot
+                     without reading the lookup table. Default=False
+    :type snapshot: bool
+    :param sharded: when True the runs of each scenario are stored in a
+                    shard of their own, ie a separate SQLite database file
+                    next to the database or a separate schema of other
+                    databases, while the studies, parameters and scenarios
+                    remain in the database. Queries are routed to the shard
+                    of the scenario selected by :meth:`getScenario` so that
+                    the scenarios can be written concurrently. The layout
+                    cannot be changed for an existing study. Default=False
+    :type sharded: bool
     """
 
     _Run = DBRun
+    _result_name = 'result'
+    _result_handle = None
+    _inline = False
 
     def __init__(self, study: str, basedir: Path,  # noqa C901
                  parameters: Mapping[str, Parameter],
-                 scenario=None, db=None, prelim=True):
+                 scenario=None, db=None, prelim=True,
+                 gradient=None, fd_step=1e-3, surrogate=None,
+                 tolerance=None, threadsafe=False, pool_size=None,
+                 buffered=False, batch_size=100, durable=None,
+                 schedule='priority',
+                 expire_on_commit=True, readonly=False, cache_table=False,
+                 snapshot=False, sharded=False):
         """constructor"""
 
-        if len(parameters) == 0:
-            raise RuntimeError('no parameters given')
+        super().__init__(parameters)
+        if gradient not in [None, 'forward', 'central']:
+            raise ValueError(f'unknown finite difference scheme {gradient}')
+        if schedule not in ['priority', 'shortest']:
+            raise ValueError(f'unknown schedule {schedule}')
+        if cache_table and not readonly:
+            raise ValueError('the lookup table can only be cached when the '
+                             'database is read-only')
 
-        self._parameters = parameters
-        self._constant_parameters = {}
-        self._active_parameters = {}
-        for p in self.parameters:
-            if self.parameters[p].constant:
-                self._constant_parameters[p] = self.parameters[p]
-            else:
-                self._active_parameters[p] = self.parameters[p]
-        self._paramlist = tuple(
-            sorted(list(self.parameters.keys())))
-        self._active_paramlist = tuple(
-            sorted(list(self.active_parameters.keys())))
         self._log = logging.getLogger(
             f'ObjectiveFunction.{self.__class__.__name__}')
         self._basedir = basedir
         self._session = None
+        self._study_id = None
+        self._scenario_id = None
+        self._lock = threading.RLock()
+        self._buffered = buffered
+        self._batch_size = batch_size
+        self._durable = buffered if durable is None else durable
+        self._queue = {}
+        self._threadsafe = threadsafe
         self._prelim = prelim
+        self._slot = 0
+        self._priority = RunPriority.BLOCKING
+        self._gradient = gradient
+        self._fd_step = fd_step
+        self._surrogate = surrogate
+        self._surrogates = {}
+        self._indices = {}
+        self._costs = {}
+        self._predictions = {}
+        self._cursors = {}
+        self._hits = set()
+        self._schedule = schedule
+        self._expire_on_commit = expire_on_commit
+        self._readonly = readonly
+        self._tables = {} if cache_table else None
+        self._snapshot = None
+        self._scenario_ids = {}
+        self._sharded = sharded
+        self._shards = {}
+        self._local = threading.local()
+        self._tolerance = None
+        if tolerance is not None:
+            if not isinstance(tolerance, Mapping):
+                tolerance = {p: tolerance for p in self.active_parameters}
+            self._tolerance = numpy.array(
+                [tolerance.get(p, 0) for p in self._active_paramlist])
 
         if db is None:
             dbName = 'sqlite:///' + str(basedir / 'objective_function.sqlite')
         else:
             dbName = db
 
-        self._session = _sessionmaker(dbName)
+        self._dbName = dbName
+        self._session_options = {'threadsafe': threadsafe,
+                                 'pool_size': pool_size,
+                                 'expire_on_commit': expire_on_commit,
+                                 'readonly': readonly}
+        self._session = _sessionmaker(dbName, **self._session_options)
 
         # get the study
-        self._study = self._session.query(DBStudy).filter_by(
+        fingerprint = self._fingerprint()
+        class_fingerprint = self._class_fingerprint()
+        dbStudy = self._session.query(DBStudy).filter_by(
             name=study).one_or_none()
-        if self._study is None:
+        if dbStudy is None and readonly:
+            raise LookupError(f'no study {study}')
+        elif dbStudy is None:
             self._log.debug(f'creating study {study}')
-            self._study = DBStudy(name=study)
-            self.session.add(self._study)
-            for p in self.parameters:
-                getDBParameter(self._study, p, self.parameters[p])
-            self.session.commit()
+            dbStudy = DBStudy(name=study, fingerprint=fingerprint,
+                              class_fingerprint=class_fingerprint)
+            self.session.add(dbStudy)
+            self.session.flush()
+            self._study_id = dbStudy.id
+            self._populate_study()
+            try:
+                self.session.commit()
+            except Exception as e:
+                self.session.rollback()
+                self._log.error(e)
+                raise RuntimeError(f'failed to create study {study}')
             self._is_new = True
         else:
             self._log.debug(f'loading study {study}')
-            error = False
-            if self.num_params != len(self._study.parameters):
-                self._log.error(
-                    f'number of parameters in {study} does not match')
-                error = True
-            else:
-                for p in self._study.parameters:
-                    if p.name not in self.parameters:
-                        self._log.error(
-                            f'parameter {p.name} missing from configuration')
-                        error = True
-                        continue
-                    if self.parameters[p.name] != p.param:
-                        self._log.error(f'parameter {p.name} does not match')
-                        self._log.error(f'parameter in DB: {p.param}')
-                        self._log.error(
-                            f'parameter in config: {self.parameters[p.name]}')
-                        error = True
-            if error:
-                raise RuntimeError('configuration does not match database')
+            self._study_id = dbStudy.id
+            # only compare the configuration in detail if the
+            # fingerprints differ
+            if self._study.fingerprint != fingerprint:
+                self._check_study()
+                if not readonly:
+                    self._study.fingerprint = fingerprint
+                    self.session.commit()
+            if class_fingerprint is not None and \
+               self._study.class_fingerprint != class_fingerprint:
+                self._check_class()
+                if not readonly:
+                    self._study.class_fingerprint = class_fingerprint
+                    self.session.commit()
             self._is_new = False
 
-        self._lb = None
-        self._ub = None
+        if snapshot:
+            self._snapshot = LookupSnapshot(
+                Path(basedir) / f'objective_function_{self._study_id}'
+                '.snapshot', self.num_params + 1)
+            if self._is_new:
+                # the snapshot belongs to a previous database
+                self._snapshot.clear()
 
-        self._scenario = None
         if scenario is not None:
             self.setDefaultScenario(scenario)
 
+    @classmethod
+    def open_readonly(cls, *args, cache_table=True, **kwds):
+        """open the lookup table of an existing study read-only
+
+        The objective function never writes to the database so that it
+        can be used to analyse a study while the optimisation is running.
+        By default the lookup table is read once and kept in memory so that
+        repeated lookups do not access the database.
+
+        The arguments are passed to the constructor.
+
+        :param cache_table: keep the lookup table in memory
+        :type cache_table: bool
+        """
+        return cls(*args, readonly=True, cache_table=cache_table, **kwds)
+
+    def _populate_study(self):
+        """add the configuration to a new study"""
+        for p in self.parameters:
+            getDBParameter(self._study, p, self.parameters[p])
+
+    def _check_study(self):
+        """check that the configuration matches the study
+
+        :raises RuntimeError: when the configuration does not match
+        """
+        error = False
+        if self.num_params != len(self._study.parameters):
+            self._log.error(
+                f'number of parameters in {self.study} does not match')
+            error = True
+        else:
+            for p in self._study.parameters:
+                if p.name not in self.parameters:
+                    self._log.error(
+                        f'parameter {p.name} missing from configuration')
+                    error = True
+                    continue
+                if self.parameters[p.name] != p.param:
+                    self._log.error(f'parameter {p.name} does not match')
+                    self._log.error(f'parameter in DB: {p.param}')
+                    self._log.error(
+                        f'parameter in config: {self.parameters[p.name]}')
+                    error = True
+        if error:
+            raise RuntimeError('configuration does not match database')
+
+    def _class_fingerprint(self):
+        """a hash of the configuration specific to the objective function class
+
+        The specific configuration is not covered by the fingerprint of the
+        parameters. It is only checked in detail if the hash differs from
+        the one stored with the study.
+
+        :return: the hash or None if the class has no specific configuration
+        """
+        return None
+
+    def _check_class(self):
+        """check the configuration specific to the objective function class
+
+        :raises RuntimeError: when the configuration does not match
+        """
+        pass
+
     @property
     def basedir(self):
         """the basedirectory"""
@@ -132,108 +542,241 @@ class ObjectiveFunction(metaclass=ABCMeta):
 
     @property
     def session(self):
+        """the database session
+
+        If the objective function is sharded this is the session of the
+        shard of the scenario last selected by the calling thread, by
+        default the shard of the default scenario.
+        """
+        if self._sharded:
+            shard = getattr(self._local, 'shard', self._scenario_id)
+            if shard is not None:
+                return self._shard_session(shard)
         return self._session
 
     @property
-    def prelim(self):
-        return self._prelim
+    def sharded(self):
+        """whether the runs of each scenario are stored in their own shard"""
+        return self._sharded
 
-    @property
-    def study(self):
-        """the name of the study"""
-        return str(self._study.name)
+    def _shard_session(self, shard):
+        """the session of a shard
+
+        :param shard: the ID of the scenario
+        """
+        with self._lock:
+            if shard not in self._shards:
+                self._shards[shard] = _sessionmaker(
+                    self._dbName, shard=shard, **self._session_options)
+            return self._shards[shard]
+
+    def _shard_exists(self, shard):
+        """whether the shard of a scenario was created
+
+        :param shard: the ID of the scenario
+        """
+        if self._dbName.startswith('sqlite'):
+            return os.path.exists(_shard_path(self._dbName, shard))
+        return f'scenario_{shard}' in inspect(
+            self._session.get_bind()).get_schema_names()
+
+    def _route_shard(self, shard):
+        """route the queries of the calling thread to a shard
+
+        :param shard: the ID of the scenario
+        """
+        if self._sharded:
+            self._local.shard = shard
+
+    def _route(self, scenario=None):
+        """route the queries of the calling thread to the shard of a
+        scenario
+
+        :param scenario: the name of the scenario
+        """
+        if self._sharded:
+            self._route_shard(self._scenario_key(scenario))
+
+    def _route_run(self, runid):
+        """route the queries of the calling thread to the shard of a run
+
+        :param runid: the ID of the run
+        """
+        if self._sharded:
+            self._route_shard(int(runid) >> SHARD_BITS)
 
     @property
-    def num_params(self):
-        """the number of parameters"""
-        return len(self._parameters)
+    def threadsafe(self):
+        """whether each thread uses its own database session"""
+        return self._threadsafe
 
     @property
-    def num_active_params(self):
-        """the number of parameters"""
-        return len(self._active_parameters)
+    def buffered(self):
+        """whether results are queued and written in batches"""
+        return self._buffered
 
     @property
-    def parameters(self):
-        """dictionary of parameters"""
-        return self._parameters
+    def durable(self):
+        """whether result files are synchronised to disk"""
+        return self._durable
 
     @property
-    def active_parameters(self):
-        """the constant parameters"""
-        return self._active_parameters
+    def expire_on_commit(self):
+        """whether the study and scenarios are reloaded after a commit"""
+        return self._expire_on_commit
+
+    def _cached(self, key, load):
+        """get an object that does not change from the session cache
+
+        When the session does not expire its objects on commit, the
+        objects are kept in a cache attached to the session so that they
+        are only loaded once per session.
+
+        :param key: the key of the object
+        :param load: function loading the object, the object is not cached
+                     when it returns None
+        """
+        if self.expire_on_commit:
+            return load()
+        cache = self.session.info.setdefault('objfun', {})
+        if key not in cache:
+            obj = load()
+            if obj is None:
+                return None
+            cache[key] = obj
+        return cache[key]
 
     @property
-    def constant_parameters(self):
-        """the constant parameters"""
-        return self._constant_parameters
-
-    def getLowerBounds(self):
-        """an array containing the lower bounds"""
-        if self._lb is None:
-            self._lb = []
-            for p in self._active_paramlist:
-                self._lb.append(self.parameters[p].minv)
-            self._lb = numpy.array(self._lb)
-        return self._lb
-
-    def getUpperBounds(self):
-        """an array containing the upper bounds"""
-        if self._ub is None:
-            self._ub = []
-            for p in self._active_paramlist:
-                self._ub.append(self.parameters[p].maxv)
-            self._ub = numpy.array(self._ub)
-        return self._ub
+    def readonly(self):
+        """whether the database was opened read-only"""
+        return self._readonly
+
+    def refresh(self):
+        """discard the lookup tables kept in memory"""
+        if self._tables is not None:
+            self._tables = {}
+        for session in [self._session] + list(self._shards.values()):
+            session.expire_all()
 
     @property
-    def lower_bounds(self):
-        """an array containing the lower bounds"""
-        return self.getLowerBounds()
+    def inline(self):
+        """whether results are stored in the database"""
+        return self._inline
 
     @property
-    def upper_bounds(self):
-        """an array containing the upper bounds"""
-        return self.getUpperBounds()
-
-    def values2params(self, values):
-        """create a dictionary of parameter values from list of values
-        :param values: a list/tuple of values
-        :return: a dictionary of parameters
-        """
-        params = {}
-        if len(values) == len(self.parameters):
-            for i, p in enumerate(self._paramlist):
-                params[p] = values[i]
-        elif len(values) == len(self.active_parameters):
-            for i, p in enumerate(self._active_paramlist):
-                params[p] = values[i]
-            for p in self.constant_parameters:
-                params[p] = self.constant_parameters[p].value
-        else:
-            raise RuntimeError('Wrong number of parameters')
+    def snapshot(self):
+        """the snapshot of the completed runs or None if it is not used"""
+        return self._snapshot
 
-        return params
+    def _query_runs(self, entity=None, with_result=False):
+        """query run objects
 
-    def params2values(self, params, include_constant=True):
-        """create an array of values from a dictionary of parameters
-        :param params: a dictionary of parameters
-        :param include_constant: set to False to exclude constant parameters
-        :return: a array of values
+        When the session does not expire its objects on commit, the runs
+        already loaded are refreshed from the database since their state
+        may have been changed by other processes.
+
+        :param entity: the run class to query, by default the run class of
+                       the objective function
+        :param with_result: when True results stored in the database are
+                            loaded with the runs
         """
-        values = []
-        for p in self._paramlist:
-            if self.parameters[p].constant:
-                if include_constant:
-                    values.append(self.parameters[p].value)
+        query = self.session.query(self._Run if entity is None else entity)
+        if not self.expire_on_commit:
+            query = query.populate_existing()
+        if with_result and self.inline:
+            query = query.options(
+                joinedload(DBRunPath.blob).undefer(DBRunResult.data))
+        return query
+
+    def close(self):
+        """release the database session of the calling thread
+
+        Any queued results are flushed first.
+        """
+        self.flush()
+        for session in [self._session] + list(self._shards.values()):
+            # the cached objects are detached when the session is closed
+            session.info.pop('objfun', None)
+            if isinstance(session, scoped_session):
+                session.remove()
             else:
-                values.append(params[p])
-        return numpy.array(values)
+                session.close()
+
+    @property
+    def _study(self):
+        """the study object of the current session"""
+        return self._cached(
+            ('study', self._study_id),
+            lambda: self.session.get(DBStudy, self._study_id))
+
+    @property
+    def _scenario(self):
+        """the default scenario object of the current session"""
+        if self._scenario_id is None:
+            return None
+        return self._cached(
+            ('scenario', self._scenario_id),
+            lambda: self.session.get(DBScenario, self._scenario_id))
+
+    @property
+    def prelim(self):
+        return self._prelim
+
+    @prelim.setter
+    def prelim(self, value):
+        self._prelim = bool(value)
+
+    @property
+    def gradient(self):
+        """the finite difference scheme used to compute gradients"""
+        return self._gradient
+
+    @property
+    def slot(self):
+        """the optimiser slot
+
+        Each optimiser sharing a scenario should use its own slot. Every
+        slot can hold one provisional parameter set so that concurrent
+        optimisers do not drop each other's provisional entries. The slot is
+        local to the thread that sets it, other threads use the slot that
+        was set last.
+        """
+        return getattr(self._local, 'slot', self._slot)
+
+    @slot.setter
+    def slot(self, value):
+        self._slot = int(value)
+        self._local.slot = self._slot
+
+    @property
+    def schedule(self):
+        """the order in which NEW parameter sets are handed out"""
+        return self._schedule
+
+    @property
+    def priority(self):
+        """the priority of new parameter sets created by lookups
+
+        Parameter sets requested by the optimiser are BLOCKING by default.
+        A NEW parameter set is promoted when it is looked up with a higher
+        priority.
+        """
+        return self._priority
+
+    @priority.setter
+    def priority(self, value):
+        self._priority = RunPriority(value)
+
+    @property
+    def study(self):
+        """the name of the study"""
+        return str(self._study.name)
 
     @property
     def scenarios(self):
         """the list of scenario names associated with study"""
-        scenarios = [s.name for s in self._study.scenarios]
+        scenarios = [name for (name, ) in self.session.query(
+            DBScenario.name).filter_by(study_id=self._study_id)]
         return scenarios
 
     def _select_scenario(self, name, create=True):
@@ -245,8 +788,10 @@ class ObjectiveFunction(metaclass=ABCMeta):
         :type create: bool
         """
 
-        scenario = self._session.query(DBScenario).filter_by(
-            name=name, study=self._study).one_or_none()
+        scenario = self._cached(
+            ('scenario', name),
+            lambda: self.session.query(DBScenario).filter_by(
+                name=name, study=self._study).one_or_none())
         if scenario is None:
             if create:
                 self._log.debug(f'create scenario {name}')
@@ -257,13 +802,26 @@ class ObjectiveFunction(metaclass=ABCMeta):
                     f'study {self.study} has no scenario {name}')
         return scenario
 
+    def createScenario(self, name):
+        """create a scenario if it does not already exist
+
+        :param name: name of scenario
+        :type name: str
+        :return: the ID of the scenario
+        """
+        sid = self._select_scenario(name, create=not self.readonly).id
+        if self._sharded and not self.readonly:
+            # create the shard of a new scenario
+            self._shard_session(sid)
+        return sid
+
     def setDefaultScenario(self, name):
         """set the default scenario
 
         :param name: name of scenario
         :type name: str
         """
-        self._scenario = self._select_scenario(name)
+        self._scenario_id = self.createScenario(name)
 
     def getScenario(self, scenario=None):
         """get scenario object
@@ -271,7 +829,11 @@ class ObjectiveFunction(metaclass=ABCMeta):
         :param scenario: the name of the scenario or None
                            if None get the default scenario
         :type scenario: str
+
+        If the objective function is sharded the queries of the calling
+        thread are routed to the shard of the scenario.
         """
+        self._route(scenario)
         if scenario is not None:
             s = self._select_scenario(scenario, create=False)
         else:
@@ -280,44 +842,312 @@ class ObjectiveFunction(metaclass=ABCMeta):
             raise RuntimeError('no scenario selected')
         return s
 
-    def _getRun(self, parameters, scenario=None):
-        """look up parameters
+    def getStartPoints(self, scenario=None):
+        """get the starting points stored for a scenario
 
-        :param parms: dictionary containing parameter values
         :param scenario: the name of the scenario
-        :raises LookupError: when lookup fails
+        :return: list of parameter dictionaries ordered by slot
         """
         s = self.getScenario(scenario)
+        # the starting points may be changed by other processes
+        points = self.session.query(DBStartPoint).filter_by(
+            scenario=s).order_by(DBStartPoint.slot)
+        return [sp.parameters for sp in points]
+
+    def setStartPoints(self, points, scenario=None):
+        """store the starting points for a scenario
 
-        dbParams = {}
-        dbParams['runid'] = []
-        for p in s.study.parameters:
-            dbParams[p.name] = []
-        for run in s.runs:
-            dbParams['runid'].append(run.id)
-            for p in run.values:
-                dbParams[p.parameter.name].append(p.value)
-
-        # turn into pandas dataframe to query
-        dbParams = pandas.DataFrame(dbParams)
-        # construct query
-        query = []
+        Any previously stored starting points are replaced. The starting
+        point at position i of the list is used by the optimiser in slot i.
+
+        :param points: list of dictionaries of parameter values
+        :param scenario: the name of the scenario
+        """
+        s = self.getScenario(scenario)
+        if not self.expire_on_commit:
+            self.session.expire(s, ['start_points'])
+        s.start_points = []
+        self.session.flush()
+        for slot, point in enumerate(points):
+            params = dict(point)
+            for p in self.constant_parameters:
+                params[p] = self.constant_parameters[p].value
+            DBStartPoint(s, slot, params)
+        self.session.commit()
+
+    def _runTable(self, scenario=None):
+        """a dataframe of the transformed parameter values of all runs
+
+        :param scenario: the name of the scenario
+        """
+        s = self.getScenario(scenario)
+        if self._tables is not None and s.id in self._tables:
+            return self._tables[s.id]
+
+        # query the values only so that no run objects are loaded
+        rows = self.session.query(
+            DBRunParameters.lid, DBParameter.name, DBRunParameters.value)\
+            .join(DBParameter, DBRunParameters.pid == DBParameter.id)\
+            .join(DBRun, DBRunParameters.lid == DBRun.id)\
+            .filter(DBRun.scenario_id == s.id).all()
+        if len(rows) == 0:
+            table = pandas.DataFrame(columns=['runid'] + list(self._paramlist))
+        else:
+            table = pandas.DataFrame(rows, columns=['runid', 'name', 'value'])
+            table = table.pivot(index='runid', columns='name',
+                                values='value').reset_index()
+        if self._tables is not None:
+            self._tables[s.id] = table
+        return table
+
+    def iter_runs(self, scenario=None, state=None, chunk=1000):
+        """iterate over the runs of a scenario
+
+        The runs are read in chunks ordered by their ID. Only the columns
+        are queried so that no run objects are kept in the session and the
+        memory use is bounded by the chunk size.
+
+        :param scenario: the name of the scenario
+        :param state: only return runs in this state
+        :param chunk: the number of runs read at once
+        :return: iterator of :class:`RunRecord`
+
+        Each chunk is read using a connection of its own so that the
+        transaction of the session is left alone.
+        """
+        s = self.getScenario(scenario)
+        params = [self.parameters[p] for p in self._paramlist]
+        with self._read_connection() as conn:
+            index = {pid: self._paramlist.index(name)
+                     for pid, name in conn.execute(self.session.query(
+                         DBParameter.id, DBParameter.name).filter_by(
+                             study_id=self._study_id).statement)}
+        columns = [self._Run.id, self._Run.state]
+        if self._result_handle is not None:
+            columns.append(getattr(self._Run, self._result_handle))
+
+        last = 0
+        while True:
+            query = self.session.query(*columns).filter(
+                self._Run.scenario_id == s.id, self._Run.id > last)
+            if state is not None:
+                query = query.filter(self._Run.state == state)
+            query = query.order_by(self._Run.id).limit(chunk)
+            with self._read_connection() as conn:
+                rows = conn.execute(query.statement).all()
+                if len(rows) == 0:
+                    break
+                last = rows[-1][0]
+
+                ids = {row[0]: i for i, row in enumerate(rows)}
+                dbValues = numpy.zeros((len(rows), len(params)), dtype=int)
+                for lid, pid, value in conn.execute(self.session.query(
+                        DBRunParameters.lid, DBRunParameters.pid,
+                        DBRunParameters.value).filter(
+                            DBRunParameters.lid.in_(list(ids))).statement):
+                    dbValues[ids[lid], index[pid]] = value
+            values = numpy.empty(dbValues.shape)
+            for i, p in enumerate(params):
+                values[:, i] = [p.inv_transform(v) for v in dbValues[:, i]]
+
+            for i, row in enumerate(rows):
+                result = row[2] if len(row) > 2 else None
+                yield RunRecord(row[0], row[1], values[i], result)
+
+    @contextmanager
+    def _read_connection(self):
+        """a connection for reads outside the transaction of the session
+
+        Pools that hand out the connection of the session, eg for in-memory
+        SQLite databases, share the connection of the session instead.
+        """
+        bind = self.session.get_bind()
+        if isinstance(bind.pool, (SingletonThreadPool, StaticPool)):
+            yield self.session.connection()
+        else:
+            with bind.connect() as conn:
+                yield conn
+
+    def _getRunIDs(self, parameters, scenario=None, missing_ok=False):
+        """look up many parameter sets at once
+
+        :param parameters: list of dictionaries containing parameter values
+        :param scenario: the name of the scenario
+        :param missing_ok: when True the ID of parameter sets that are not
+                           found is None
+        :return: list of run IDs
+        :raises LookupError: when lookup of any parameter set fails
+        """
+        dbParams = self._runTable(scenario)
+
+        query = {}
         for p in self.parameters:
             if self.parameters[p].constant:
-                v = self.parameters[p].value
+                v = [self.parameters[p].value] * len(parameters)
             else:
-                v = parameters[p]
-            query.append('({}=={})'.format(
-                p, self.parameters[p].transform(v)))
-        query = ' & '.join(query)
-        runid = dbParams.query(query)
-
-        if len(runid) == 0:
-            raise LookupError("no entry for parameter set found")
-        runid = int(runid.runid.iloc[0])
-        run = self.session.query(self._Run).filter_by(id=runid).one()
+                v = [params[p] for params in parameters]
+            query[p] = [self.parameters[p].transform(x) for x in v]
+        query = pandas.DataFrame(query)
+        query['index'] = range(len(parameters))
+
+        if len(dbParams) == 0:
+            runids = query.assign(runid=None)
+        else:
+            runids = query.merge(dbParams, how='left',
+                                 on=list(self.parameters))
+            runids = runids.drop_duplicates('index').sort_values('index')
+        missing = runids.runid.isna()
+        if missing_ok:
+            return [None if m else int(r)
+                    for r, m in zip(runids.runid, missing)]
+        if missing.any():
+            if len(parameters) == 1:
+                raise LookupError("no entry for parameter set found")
+            raise LookupError('no entry for parameter sets '
+                              f'{list(runids["index"][missing])}')
+        return [int(r) for r in runids.runid]
+
+    def _getRun(self, parameters, scenario=None, with_result=False):
+        """look up parameters
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :param with_result: when True a result stored in the database is
+                            loaded with the run
+        :raises LookupError: when lookup fails
+        """
+        runid = self._getRunIDs([parameters], scenario=scenario)[0]
+        run = self._query_runs(with_result=with_result).filter_by(
+            id=runid).one()
         return run
 
+    def _scenario_key(self, scenario=None):
+        """the ID of a scenario
+
+        The IDs never change so that they are kept in memory.
+
+        :param scenario: the name of the scenario
+        """
+        if scenario is None:
+            if self._scenario_id is None:
+                raise RuntimeError('no scenario selected')
+            return self._scenario_id
+        if scenario not in self._scenario_ids:
+            self._scenario_ids[scenario] = self._select_scenario(
+                scenario, create=False).id
+        return self._scenario_ids[scenario]
+
+    def _snapshot_value(self, value):
+        """the value of a result stored in the snapshot"""
+        return value if isinstance(value, float) else numpy.nan
+
+    def _in_result_file(self, runid, handle):
+        """whether a result is stored in the result file named after the run
+
+        :param runid: the ID of the run
+        :param handle: the value of the result handle of the run
+        """
+        fname = self._result_file(runid)
+        return fname is not None and handle == str(fname)
+
+    def _snapshot_entry(self, parameters, scenario=None):
+        """look up a completed run in the snapshot
+
+        :param parameters: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :return: the entry of the run or None if the parameter set is not
+                 found or the snapshot is not used
+        :rtype: SnapshotEntry
+        """
+        if self._snapshot is None:
+            return None
+        key = [self._scenario_key(scenario)]
+        for p in self._paramlist:
+            param = self.parameters[p]
+            key.append(param.transform(
+                param.value if param.constant else parameters[p]))
+        entry = self._snapshot.lookup(key)
+        if entry is None or entry.state != LookupState.COMPLETED:
+            return None
+        return entry
+
+    def _snapshot_keys(self, runs):
+        """the keys of runs in the snapshot
+
+        :param runs: list of run objects
+        :return: array with a row for each run
+        """
+        keys = numpy.zeros((len(runs), self.num_params + 1), dtype=int)
+        rows = {}
+        for i, run in enumerate(runs):
+            keys[i, 0] = run.scenario_id
+            rows[run.id] = i
+        columns = {p: i + 1 for i, p in enumerate(self._paramlist)}
+        runids = list(rows)
+        for i in range(0, len(runids), 500):
+            for lid, name, value in self.session.query(
+                    DBRunParameters.lid, DBParameter.name,
+                    DBRunParameters.value).join(
+                        DBParameter, DBRunParameters.pid == DBParameter.id)\
+                    .filter(DBRunParameters.lid.in_(runids[i:i + 500])):
+                keys[rows[lid], columns[name]] = value
+        return keys
+
+    def _states_changed(self, runs):
+        """record the current state of runs in the caches and the snapshot
+
+        Runs that are no longer completed are removed from the spatial
+        index and the surrogate of their scenario and are then looked up in
+        the database again.
+
+        :param runs: list of run objects
+        """
+        for run in runs:
+            if run.state != LookupState.COMPLETED:
+                self._forget_runs(run.scenario_id, [run.id])
+        if self._snapshot is None or len(runs) == 0:
+            return
+        results = []
+        in_file = []
+        for run in runs:
+            handle = getattr(run, self._result_handle, None)
+            if run.state == LookupState.COMPLETED:
+                results.append(self._snapshot_value(handle))
+                in_file.append(self._in_result_file(run.id, handle))
+            else:
+                results.append(numpy.nan)
+                in_file.append(False)
+        self._snapshot.append(self._snapshot_keys(runs),
+                              [run.id for run in runs],
+                              [run.state for run in runs], results,
+                              in_file=in_file)
+
+    def compact_snapshot(self, rebuild=False):
+        """merge the entries appended to the snapshot
+
+        :param rebuild: when True all completed runs of the study are added
+                        to the snapshot first, eg when the snapshot is
+                        enabled for an existing study
+        """
+        if self._snapshot is None:
+            raise RuntimeError('the objective function has no snapshot')
+        if rebuild:
+            for (name, ) in self.session.query(DBScenario.name).filter_by(
+                    study_id=self._study_id):
+                sid = self._scenario_key(name)
+                runs = list(self.iter_runs(scenario=name,
+                                           state=LookupState.COMPLETED))
+                keys = [[sid] + [self.parameters[p].transform(v)
+                                 for p, v in zip(self._paramlist, run.values)]
+                        for run in runs]
+                self._snapshot.append(
+                    keys, [run.id for run in runs],
+                    [run.state for run in runs],
+                    [self._snapshot_value(run.result) for run in runs],
+                    in_file=[self._in_result_file(run.id, run.result)
+                             for run in runs])
+        self._snapshot.compact()
+
     def getRunID(self, parameters, scenario=None):
         """get ID of run
 
@@ -333,22 +1163,116 @@ class ObjectiveFunction(metaclass=ABCMeta):
         :param runid: ID of ru
         :return: state of run
         """
-        run = self.session.query(self._Run).filter_by(id=runid).one_or_none()
+        self._route_run(runid)
+        run = self._query_runs().filter_by(id=runid).one_or_none()
         if run is None:
             raise LookupError(f'no run with ID {runid}')
         return run.state
 
+    def getParameters(self, runid):
+        """get the parameter values of a run with ID
+
+        :param runid: ID of run
+        :return: dictionary of parameter values
+        """
+        self._route_run(runid)
+        run = self._query_runs().filter_by(id=runid).one_or_none()
+        if run is None:
+            raise LookupError(f'no run with ID {runid}')
+        return run.parameters
+
     def setState(self, runid, state):
         """set the state of run
 
         :param runid: ID of run
         :param state: the new state
         """
-        run = self.session.query(self._Run).filter_by(id=runid).one_or_none()
+        self._route_run(runid)
+        run = self._query_runs().filter_by(id=runid).one_or_none()
         if run is None:
             raise LookupError(f'no run with ID {runid}')
         run.state = state
         self.session.commit()
+        self._states_changed([run])
+
+    def is_cancelled(self, runid):
+        """check whether a run was cancelled
+
+        Only the state of the run is queried so that workers can check
+        cheaply whether they should abort.
+
+        :param runid: ID of run
+        :return: True if the run was cancelled
+        """
+        self._route_run(runid)
+        state = self.session.query(DBRun.state).filter_by(
+            id=runid).one_or_none()
+        self.session.commit()
+        if state is None:
+            raise LookupError(f'no run with ID {runid}')
+        return state[0] == LookupState.CANCELLED
+
+    def cancel(self, keep=None, lb=None, ub=None, active=False,
+               all_slots=False, scenario=None):
+        """cancel runs that are no longer required
+
+        :param keep: list of dictionaries of parameters or run IDs of runs
+                     that should not be cancelled
+        :param lb: dictionary of the lower bounds of a box, eg the trust
+                   region of the optimiser. Runs within the box are not
+                   cancelled
+        :param ub: dictionary of the upper bounds of the box
+        :param active: when True runs that are being processed are
+                       cancelled as well, otherwise only NEW runs are
+                       cancelled
+        :param all_slots: when True the runs of all optimisers are
+                          cancelled, otherwise only the runs created in the
+                          slot of the caller
+        :param scenario: the name of the scenario
+        :return: the number of cancelled runs
+
+        Workers can check whether their run was cancelled using
+        :meth:`is_cancelled`. A cancelled run is revived when its
+        parameter set is looked up again.
+        """
+        s = self.getScenario(scenario)
+        keep = [] if keep is None else list(keep)
+
+        keepIDs = [r for r in keep if not isinstance(r, Mapping)]
+        params = [r for r in keep if isinstance(r, Mapping)]
+        if len(params) > 0:
+            keepIDs += [r for r in self._getRunIDs(params, scenario=scenario,
+                                                   missing_ok=True)
+                        if r is not None]
+        if lb is not None or ub is not None:
+            lb = {} if lb is None else lb
+            ub = {} if ub is None else ub
+            table = self._runTable(scenario)
+            inside = numpy.ones(len(table), dtype=bool)
+            for p in self.active_parameters:
+                param = self.parameters[p]
+                lo = param.transform(max(lb.get(p, param.minv), param.minv))
+                hi = param.transform(min(ub.get(p, param.maxv), param.maxv))
+                inside &= (table[p] >= lo).values & (table[p] <= hi).values
+            keepIDs += [int(r) for r in table.runid[inside]]
+
+        if active:
+            first = LookupState.NEW.value
+            last = LookupState.COMPLETED.value
+            states = [st for st in LookupState if first <= st.value < last]
+        else:
+            states = [LookupState.NEW]
+        query = self.session.query(DBRun).filter(
+            DBRun.scenario_id == s.id, DBRun.state.in_(states))
+        if not all_slots:
+            query = query.filter(DBRun.slot == self.slot)
+        if len(keepIDs) > 0:
+            query = query.filter(DBRun.id.notin_(keepIDs))
+        cancelled = query.update({'state': LookupState.CANCELLED},
+                                 synchronize_session=False)
+        self.session.commit()
+        self._log.info(f'cancelled {cancelled} runs')
+        return cancelled
 
     def state(self, parameters, scenario=None):
         """get run state
@@ -359,7 +1283,7 @@ class ObjectiveFunction(metaclass=ABCMeta):
         run = self._getRun(parameters, scenario=scenario)
         return run.state
 
-    def _lookupRun(self, parameters, scenario=None):
+    def _lookupRun(self, parameters, scenario=None):  # noqa C901
         """look up parameters
 
         :param parmeters: dictionary containing parameter values
@@ -367,18 +1291,59 @@ class ObjectiveFunction(metaclass=ABCMeta):
         :raises NewRun: when lookup fails
         :raises Waiting: when completed entries are required
         """
+        entry = self._snapshot_entry(parameters, scenario=scenario)
+        fname = None
+        if entry is not None and entry.in_file:
+            fname = self._result_file(entry.runid)
+        if fname is not None and os.path.exists(fname):
+            # the result is read from its file without querying the database
+            self._log.debug('hit completed parameter set in snapshot')
+            return _FileRun(entry.runid, LookupState.COMPLETED, str(fname),
+                            None)
+        if entry is not None:
+            # only a completed run is fetched, the lookup table is not read
+            self._route(scenario)
+            run = self._query_runs(with_result=True).filter_by(
+                id=entry.runid).one_or_none()
+            if run is not None and run.state == LookupState.COMPLETED:
+                self._log.debug('hit completed parameter set in snapshot')
+                return run
+
         s = self.getScenario(scenario)
 
+        if self.readonly:
+            # entries are never created
+            return self._getRun(parameters, scenario=scenario,
+                                with_result=True)
+
         run = None
         try:
-            run = self._getRun(parameters, scenario=scenario)
+            # fetch a result stored in the database in the same round trip
+            run = self._getRun(parameters, scenario=scenario,
+                               with_result=True)
         except LookupError:
-            pass
+            run = self._approximateRun(parameters, scenario=scenario)
+
+        speculative = getattr(self._local, 'speculative', None)
+        if speculative is not None and run is None:
+            # the optimiser follows the values predicted by the surrogate
+            surrogate = self.getSurrogate(scenario)
+            if len(speculative) >= self._local.max_speculative or \
+                    surrogate is None or not surrogate.ready:
+                raise NewRun
+            self._log.info('new speculative parameter set')
+            run = self._Run(s, parameters)
+            run.slot = self.slot
+            self._enqueue(run, priority=RunPriority.SPECULATIVE)
+            self.session.commit()
+            speculative.append(run.id)
+            return run
 
         if run is None:
-            # check if we already have a provisional entry
-            run = self.session.query(self._Run).filter_by(
-                scenario=s, state=LookupState.PROVISIONAL).one_or_none()
+            # check if we already have a provisional entry for this slot
+            run = self._query_runs().filter_by(
+                scenario=s, state=LookupState.PROVISIONAL,
+                slot=self.slot).one_or_none()
             if run is not None:
                 # we already have a provisional value
                 # delete the previous one and wait
@@ -390,27 +1355,166 @@ class ObjectiveFunction(metaclass=ABCMeta):
             # create a new entry
             self._log.info('new provisional parameter set')
             run = self._Run(s, parameters)
+            run.slot = self.slot
             if self.prelim:
                 run.state = LookupState.PROVISIONAL
                 self.session.commit()
                 raise PreliminaryRun
             else:
-                run.state = LookupState.NEW
+                self._enqueue(run)
                 self.session.commit()
                 raise NewRun
 
+        if speculative is not None:
+            # speculative lookups neither promote nor enqueue existing runs
+            return run
+
         if run.state == LookupState.PROVISIONAL:
             self._log.info('provisional parameter set changed to new')
-            run.state = LookupState.NEW
+            self._enqueue(run)
+            self.session.commit()
+            raise NewRun
+        elif run.state == LookupState.CANCELLED:
+            self._log.info('cancelled parameter set changed to new')
+            self._enqueue(run)
             self.session.commit()
             raise NewRun
         elif run.state == LookupState.COMPLETED:
             self._log.debug('hit completed parameter set')
         else:
             self._log.debug('hit new/active parameter set')
+            if run.state == LookupState.NEW and run.priority < self.priority:
+                run.priority = int(self.priority)
+                self.session.commit()
 
         return run
 
+    def _enqueue(self, run, priority=None):
+        """move a run into the NEW state
+
+        :param run: the run object
+        :param priority: the priority of the run, by default the priority of
+                         the objective function is used
+        """
+        if priority is None:
+            priority = self.priority
+        run.state = LookupState.NEW
+        run.priority = int(priority)
+        run.enqueued = datetime.datetime.utcnow()
+
+    def speculate(self, evaluate, max_points=4, scenario=None):
+        """speculatively enqueue the points an optimiser will likely need
+
+        While the optimiser waits for its NEW parameter sets it is run again
+        with the values of the pending parameter sets predicted by the
+        surrogate model. Parameter sets that are not in the lookup table are
+        added in the NEW state with SPECULATIVE priority and their predicted
+        values are returned so that the optimiser proceeds along its likely
+        path. The optimiser is stopped once max_points parameter sets were
+        added. The workers can then start on the next points before the
+        blocking ones are completed.
+
+        :param evaluate: function without arguments that runs the optimiser
+        :param max_points: the maximum number of parameter sets to add
+        :param scenario: the name of the scenario
+        :return: list of the IDs of the runs that were added
+        """
+        if self.readonly:
+            raise RuntimeError('cannot speculate on a read-only database')
+        surrogate = self.getSurrogate(scenario)
+        if surrogate is None or not surrogate.ready or max_points < 1:
+            return []
+        with self._speculation(max_points) as speculative:
+            try:
+                evaluate()
+            except (NewRun, PreliminaryRun, Waiting):
+                pass
+        return speculative
+
+    @contextmanager
+    def _speculation(self, max_points):
+        """look up parameter sets speculatively in the current thread
+
+        :param max_points: the maximum number of parameter sets to add
+        :return: the list the IDs of the runs added are appended to
+        """
+        speculative = []
+        self._local.speculative = speculative
+        self._local.max_speculative = max_points
+        try:
+            yield speculative
+        finally:
+            del self._local.speculative
+            del self._local.max_speculative
+
+    def enqueue(self, points, priority=RunPriority.BACKGROUND,
+                scenario=None):
+        """add parameter sets to the work queue
+
+        :param points: list of dictionaries containing parameter values
+        :param priority: the priority of the parameter sets
+        :param scenario: the name of the scenario
+        :return: list of the run ID of each point
+
+        Parameter sets that are not in the lookup table are added in the NEW
+        state. NEW parameter sets with a lower priority are promoted.
+        Completed and active parameter sets are left unchanged. Points that
+        map to the same parameter set are only added once.
+        """
+        s = self.getScenario(scenario)
+        priority = RunPriority(priority)
+        # the points are compared at the resolution of the parameters
+        keys = [tuple(self.parameters[p].transform(
+            self.parameters[p].value if self.parameters[p].constant
+            else params[p]) for p in self._paramlist) for params in points]
+        unique = {}
+        for params, key in zip(points, keys):
+            unique.setdefault(key, params)
+        points = list(unique.values())
+        runids = self._getRunIDs(points, scenario=scenario, missing_ok=True)
+        runs = {}
+        if any(r is not None for r in runids):
+            runs = self._query_runs().filter(
+                self._Run.id.in_([r for r in runids if r is not None]))
+            runs = {run.id: run for run in runs}
+        created = []
+        for params, runid in zip(points, runids):
+            if runid is None:
+                run = self._Run(s, params)
+                run.slot = self.slot
+                self._enqueue(run, priority=priority)
+                created.append(run)
+                continue
+            run = runs[runid]
+            if run.state in [LookupState.PROVISIONAL,
+                             LookupState.CANCELLED]:
+                self._enqueue(run, priority=priority)
+            elif run.state == LookupState.NEW and run.priority < priority:
+                run.priority = int(priority)
+        self.session.commit()
+        created = iter(created)
+        runids = dict(zip(unique, [next(created).id if r is None else r
+                                   for r in runids]))
+        return [runids[key] for key in keys]
+
+    def _claim(self, runid, state, new_state):
+        """change the state of a run if it is still in state
+
+        :param runid: the ID of the run
+        :param state: the expected state of the run
+        :param new_state: the new state of the run
+        :return: True if the state was changed
+        """
+        # only change the state if no other process has changed it
+        # in the meantime
+        self._route_run(runid)
+        claimed = self.session.query(DBRun)\
+                              .filter_by(id=runid, state=state)\
+                              .update({'state': new_state},
+                                      synchronize_session=False)
+        self.session.commit()
+        return claimed == 1
+
     def get_with_state(self, state, scenario=None, with_id=False,
                        new_state=None):
         """get a set of parameters in a particular state
@@ -421,7 +1525,9 @@ class ObjectiveFunction(metaclass=ABCMeta):
         :param new_state: when not None set the state of the run to new_state
 
         Get a set of parameters for a run in a particular state. Optionally
-        the run transitions to new_state.
+        the run transitions to new_state. Runs with the highest priority are
+        returned first and runs with the same priority in the order in
+        which they were enqueued.
 
         :return: dictionary of parameter values for which to compute the model
         :raises LookupError: if there is no parameter set in specified state
@@ -429,17 +1535,18 @@ class ObjectiveFunction(metaclass=ABCMeta):
 
         s = self.getScenario(scenario)
 
-        run = self.session.query(DBRun)\
-                          .filter_by(scenario=s,
-                                     state=state)\
-                          .with_for_update().first()
+        while True:
+            run = self._query_runs(DBRun)\
+                      .filter_by(scenario=s, state=state)\
+                      .order_by(DBRun.priority.desc(),
+                                DBRun.enqueued, DBRun.id)\
+                      .with_for_update(skip_locked=True).first()
 
-        if run is None:
-            raise LookupError(f'no parameter set in state {state.name}')
+            if run is None:
+                raise LookupError(f'no parameter set in state {state.name}')
 
-        if new_state is not None:
-            run.state = new_state
-            self.session.commit()
+            if new_state is None or self._claim(run.id, state, new_state):
+                break
 
         if with_id:
             return run.id, run.parameters
@@ -452,12 +1559,24 @@ class ObjectiveFunction(metaclass=ABCMeta):
         :param scenario: the name of the scenario
         :param with_id: when set to True also return run ID
 
-        The parameter set changes set from new to active
+        The parameter set changes set from new to active. Parameter sets are
+        handed out in order of their priority. Each parameter set
+        is only handed out once, even when called concurrently from several
+        threads or processes. The method can be called from multiple threads
+        if the objective function was created with threadsafe=True.
 
         :return: dictionary of parameter values for which to compute the model
         :raises NoNewRun: if there is no new parameter set
         """
 
+        if self.schedule == 'shortest':
+            for runid, params, cost in self._scheduled_runs(scenario):
+                if self._claim(runid, LookupState.NEW, LookupState.ACTIVE):
+                    if with_id:
+                        return runid, params
+                    return params
+            raise NoNewRun('no new parameter sets')
+
         try:
             res = self.get_with_state(LookupState.NEW, scenario=scenario,
                                       with_id=with_id,
@@ -467,6 +1586,417 @@ class ObjectiveFunction(metaclass=ABCMeta):
 
         return res
 
+    def _scheduled_runs(self, scenario=None, default_cost=None):
+        """iterate over the NEW runs of a scenario in the order in which they
+        are handed out
+
+        Only the IDs of the NEW runs are read up front. The runs themselves
+        are loaded one priority at a time, with the priority schedule in
+        chunks, so that callers that stop early neither load nor predict
+        the whole queue.
+
+        :param scenario: the name of the scenario
+        :param default_cost: the wall time assumed for runs without a cost
+                             prediction
+        :return: iterator over tuples of run ID, parameters and predicted
+                 wall time
+        """
+        s = self.getScenario(scenario)
+        queue = self.session.query(DBRun.id, DBRun.priority).filter_by(
+            scenario=s, state=LookupState.NEW).order_by(
+                DBRun.priority.desc(), DBRun.enqueued, DBRun.id).all()
+        self.session.commit()
+        levels = {}
+        for runid, priority in queue:
+            levels.setdefault(priority, []).append(runid)
+        with self._lock:
+            # the predictions of runs that are no longer NEW are dropped
+            cache = self._predictions.get(s.id, (None, {}))[1]
+            for runid in set(cache).difference(r for r, p in queue):
+                del cache[runid]
+
+        for runids in levels.values():
+            if self.schedule == 'shortest':
+                runs = self._load_scheduled(runids, default_cost,
+                                            scenario=scenario)
+                # the runs of a priority are ordered by their predicted
+                # wall time, the sort is stable
+                yield from sorted(runs, key=lambda r: r[2] or 0.)
+                continue
+            for i in range(0, len(runids), 500):
+                yield from self._load_scheduled(runids[i:i + 500],
+                                                default_cost,
+                                                scenario=scenario)
+
+    def _load_scheduled(self, runids, default_cost, scenario=None):
+        """load runs and predict their wall times
+
+        :param runids: list of run IDs
+        :param default_cost: the wall time assumed for runs without a cost
+                             prediction
+        :param scenario: the name of the scenario
+        :return: list of tuples of run ID, parameters and predicted wall time
+                 in the order of runids
+        """
+        runs = self._query_runs().options(
+            selectinload(DBRun.values)).filter(self._Run.id.in_(runids))
+        params = {run.id: run.parameters for run in runs}
+        self.session.commit()
+        runids = [r for r in runids if r in params]
+        costs = self._predict_costs(runids, params, scenario=scenario)
+        return [(r, params[r], default_cost if c is None else c)
+                for r, c in zip(runids, costs)]
+
+    def _predict_costs(self, runids, params, scenario=None):
+        """predict the wall times of NEW runs
+
+        The predictions are cached until the next run with a recorded wall
+        time is completed.
+
+        :param runids: list of run IDs
+        :param params: dictionary mapping run IDs to parameters
+        :param scenario: the name of the scenario
+        :return: list of predicted wall times or None
+        """
+        s = self.getScenario(scenario)
+        with self._lock:
+            self.getIndex(scenario)
+            known = len(self._costs[s.id][0])
+            if self._predictions.get(s.id, (None, ))[0] != known:
+                self._predictions[s.id] = (known, {})
+            cache = self._predictions[s.id][1]
+            for runid in runids:
+                if runid not in cache:
+                    cache[runid] = self.predict_cost(params[runid],
+                                                     scenario=scenario)
+            return [cache[runid] for runid in runids]
+
+    def get_batch(self, walltime, scenario=None, with_id=False,
+                  default_cost=None):
+        """get parameter sets that fit into an allocation
+
+        NEW parameter sets are packed into an allocation of length walltime
+        using their predicted wall times. They are considered in the order
+        given by the schedule and each is added if it still fits. At least
+        one parameter set is returned even if it exceeds the allocation.
+        The parameter sets change from new to active.
+
+        :param walltime: the length of the allocation in seconds
+        :param scenario: the name of the scenario
+        :param with_id: when set to True also return run IDs
+        :param default_cost: the wall time assumed for parameter sets
+                             without a prediction, ie before any run with a
+                             recorded wall time is completed. By default the
+                             length of the allocation so that only a single
+                             parameter set is handed out.
+        :return: list of dictionaries of parameter values or of pairs of run
+                 ID and parameter values
+        :raises NoNewRun: if there is no new parameter set
+        """
+        if default_cost is None:
+            default_cost = walltime
+        batch = []
+        total = 0.
+        for runid, params, cost in self._scheduled_runs(
+                scenario, default_cost=default_cost):
+            if total >= walltime:
+                break
+            if len(batch) > 0 and total + cost > walltime:
+                continue
+            if self._claim(runid, LookupState.NEW, LookupState.ACTIVE):
+                batch.append((runid, params) if with_id else params)
+                total += cost
+        if len(batch) == 0:
+            raise NoNewRun('no new parameter sets')
+        return batch
+
+    def _completed_since(self, scenario, kind):
+        """iterate over the runs completed since the cache was last updated
+
+        Each cache of a scenario has a cursor holding the largest run ID
+        seen and the IDs of the runs seen that were not completed. Only
+        runs with a larger ID and these pending runs are queried, so that
+        the cost does not grow with the number of completed runs.
+
+        :param scenario: the scenario object
+        :param kind: the name of the cache
+        """
+        cursor = self._cursors.setdefault(
+            (kind, scenario.id), {'last': 0, 'pending': set()})
+        completed = []
+        for runid, state in self.session.query(DBRun.id, DBRun.state).filter(
+                DBRun.scenario_id == scenario.id,
+                DBRun.id > cursor['last']).order_by(DBRun.id):
+            cursor['last'] = runid
+            if state == LookupState.COMPLETED:
+                completed.append(runid)
+            else:
+                cursor['pending'].add(runid)
+        pending = list(cursor['pending'])
+        # runs that were deleted are dropped
+        still_pending = set()
+        for i in range(0, len(pending), 500):
+            for runid, state in self.session.query(
+                    DBRun.id, DBRun.state).filter(
+                        DBRun.id.in_(pending[i:i + 500])):
+                if state == LookupState.COMPLETED:
+                    completed.append(runid)
+                else:
+                    still_pending.add(runid)
+        cursor['pending'] = still_pending
+        for i in range(0, len(completed), 500):
+            for run in self._query_runs().filter(
+                    self._Run.id.in_(completed[i:i + 500])):
+                yield run
+
+    def getSurrogate(self, scenario=None):
+        """get the surrogate model of a scenario
+
+        The surrogate is updated with any runs that were completed since
+        it was last used.
+
+        :param scenario: the name of the scenario
+        :return: the surrogate model or None if no surrogate is used
+        """
+        if self._surrogate is None:
+            return None
+        s = self.getScenario(scenario)
+        with self._lock:
+            if s.id not in self._surrogates:
+                self._surrogates[s.id] = self._surrogate(
+                    self.num_active_params)
+            surrogate = self._surrogates[s.id]
+            for run in self._completed_since(s, 'surrogate'):
+                surrogate.add(run.id, self._normalise(run.parameters),
+                              self._read_result(run))
+        return surrogate
+
+    def getIndex(self, scenario=None):
+        """get the spatial index of the completed runs of a scenario
+
+        The index is updated with any runs that were completed since it
+        was last used.
+
+        :param scenario: the name of the scenario
+        :rtype: SpatialIndex
+        """
+        s = self.getScenario(scenario)
+        with self._lock:
+            if s.id not in self._indices:
+                self._indices[s.id] = SpatialIndex(self.num_active_params)
+                self._costs[s.id] = (SpatialIndex(self.num_active_params),
+                                     {})
+            index = self._indices[s.id]
+            costIndex, walltimes = self._costs[s.id]
+            for run in self._completed_since(s, 'index'):
+                x = self._normalise(run.parameters)
+                index.add(run.id, x)
+                if run.walltime is not None:
+                    costIndex.add(run.id, x)
+                    walltimes[run.id] = run.walltime
+        return index
+
+    def _forget_runs(self, sid, runids):
+        """remove runs that are no longer completed from the caches
+
+        The runs are added again once they are completed.
+
+        :param sid: the ID of the scenario
+        :param runids: list of run IDs
+        """
+        with self._lock:
+            for kind, cache in [('index', self._indices.get(sid)),
+                                ('surrogate', self._surrogates.get(sid))]:
+                if cache is None:
+                    continue
+                for runid in runids:
+                    if runid in cache:
+                        cache.remove(runid)
+                        self._cursors[kind, sid]['pending'].add(runid)
+
+    def _verify_completed(self, scenario, runids):
+        """check that runs found in the spatial index are still completed
+
+        Runs whose state was changed by other processes are removed from
+        the caches.
+
+        :param scenario: the scenario object
+        :param runids: list of run IDs
+        :return: list of the IDs of the runs that are completed
+        """
+        completed = set()
+        for i in range(0, len(runids), 500):
+            completed.update(runid for (runid, ) in self.session.query(
+                DBRun.id).filter(DBRun.id.in_(runids[i:i + 500]),
+                                 DBRun.state == LookupState.COMPLETED))
+        stale = [runid for runid in runids if runid not in completed]
+        if len(stale) > 0:
+            self._forget_runs(scenario.id, stale)
+        return [runid for runid in runids if runid in completed]
+
+    def predict_cost(self, params, k=4, scenario=None):
+        """predict the wall time of a run
+
+        The wall time is interpolated from the k nearest completed runs
+        with a recorded wall time using inverse distance weighting.
+
+        :param params: dictionary of parameter values
+        :param k: the number of completed runs to use
+        :param scenario: the name of the scenario
+        :return: the predicted wall time in seconds or None if no completed
+                 run has a recorded wall time
+        """
+        s = self.getScenario(scenario)
+        with self._lock:
+            self.getIndex(scenario)
+            costIndex, walltimes = self._costs[s.id]
+            if len(costIndex) == 0:
+                return None
+            nearest = costIndex.nearest(self._normalise(params), k=k)
+        w = numpy.array([walltimes[runid] for runid, d in nearest])
+        d = numpy.array([d for runid, d in nearest])
+        if d[0] == 0:
+            return float(w[0])
+        return float(numpy.sum(w / d) / numpy.sum(1 / d))
+
+    def runs_in_box(self, lb, ub, scenario=None):
+        """find the completed runs within a box
+
+        :param lb: vector of active parameter values of the lower corner
+        :param ub: vector of active parameter values of the upper corner
+        :param scenario: the name of the scenario
+        :return: list of run IDs
+        """
+        lb = numpy.maximum(lb, self.lower_bounds)
+        ub = numpy.minimum(ub, self.upper_bounds)
+        s = self.getScenario(scenario)
+        with self._lock:
+            index = self.getIndex(scenario)
+            runids = index.in_box(
+                self._normalise(self.values2params(lb)),
+                self._normalise(self.values2params(ub)))
+            return sorted(self._verify_completed(s, runids))
+
+    def nearest_runs(self, x, k=1, scenario=None):
+        """find the k completed runs nearest to x
+
+        Distances are measured in parameter space normalised by the
+        range of each parameter.
+
+        :param x: vector of active parameter values
+        :param k: the number of runs to find
+        :param scenario: the name of the scenario
+        :return: list of pairs of run ID and distance sorted by distance
+        """
+        s = self.getScenario(scenario)
+        x = self._normalise(self.values2params(x))
+        with self._lock:
+            index = self.getIndex(scenario)
+            while True:
+                nearest = index.nearest(x, k=k)
+                runids = [runid for runid, d in nearest]
+                # stale runs are removed from the index, look again
+                if len(self._verify_completed(s, runids)) == len(runids):
+                    return nearest
+
+    def _approximateRun(self, parameters, scenario=None):
+        """look up a completed run within tolerance of the parameters
+
+        :param parameters: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :return: the nearest completed run within tolerance or None
+        """
+        if self._tolerance is None:
+            return None
+        # the half width of the box in normalised coordinates, the extra
+        # half step excludes runs that are one resolution step too far
+        width = []
+        for t, p in zip(self._tolerance, self._active_paramlist):
+            param = self.parameters[p]
+            span = param.transform(param.maxv) - param.transform(param.minv)
+            width.append((t + 0.5) / span)
+        x = self._normalise(parameters)
+        s = self.getScenario(scenario)
+        with self._lock:
+            index = self.getIndex(scenario)
+            candidates = self._verify_completed(
+                s, index.in_box(x - width, x + width))
+            if len(candidates) == 0:
+                return None
+            runid = min(candidates,
+                        key=lambda r: numpy.linalg.norm(index.point(r) - x))
+        run = self._query_runs().filter_by(id=runid).one()
+
+        self._log.info(f'approximate hit of run {runid}')
+        values = {}
+        for p in self.parameters:
+            values[p] = type(self.parameters[p].value)(parameters[p])
+        self._record_hit(run, values)
+        return run
+
+    def _record_hit(self, run, values):
+        """record an approximate hit unless it was recorded before
+
+        Optimisers replay their evaluations, so the same hits are looked up
+        again and again.
+
+        :param run: the run object
+        :param values: dictionary of the requested parameter values
+        """
+        key = DBApproximateHit.make_key(values)
+        with self._lock:
+            if (run.id, key) in self._hits:
+                return
+        if self.session.query(DBApproximateHit.id).filter_by(
+                run_id=run.id, key=key).first() is None:
+            DBApproximateHit(run=run, parameters=values)
+            try:
+                self.session.commit()
+            except IntegrityError:
+                # recorded by another process in the meantime
+                self.session.rollback()
+        else:
+            self.session.commit()
+        with self._lock:
+            self._hits.add((run.id, key))
+
+    def getApproximateHits(self, scenario=None):
+        """get the record of approximate hits of a scenario
+
+        :param scenario: the name of the scenario
+        :return: list of pairs of run ID and the requested parameter values
+        """
+        s = self.getScenario(scenario)
+        hits = self.session.query(DBApproximateHit).join(DBRun).filter(
+            DBRun.scenario == s).order_by(DBApproximateHit.id)
+        return [(h.run_id, h.parameters) for h in hits]
+
+    def _proxy_result(self, params, scenario=None):
+        """the value used for a parameter set that is not completed
+
+        :param params: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :return: the value predicted by the surrogate model if available
+                 otherwise a random value
+        """
+        surrogate = self.getSurrogate(scenario)
+        if surrogate is not None and surrogate.ready:
+            return surrogate.predict(self._normalise(params))
+        return self._random_result()
+
+    @abstractmethod
+    def _read_result(self, run):
+        """read the result of a completed run
+
+        :param run: the run object
+        """
+        pass
+
+    @abstractmethod
+    def _random_result(self):
+        """a random result"""
+        pass
+
     @abstractmethod
     def get_result(self, params, scenario=None):
         """look up parameters
@@ -476,38 +2006,407 @@ class ObjectiveFunction(metaclass=ABCMeta):
         :raises NewRun: when lookup fails
         :raises Waiting: when completed entries are required
         :return: returns the value if lookup succeeds and state is completed
-                 return a random value otherwise
+                 return a proxy value otherwise
+
+        The method can be called from multiple threads if the objective
+        function was created with threadsafe=True.
         """
         pass
 
+    def _result_file(self, runid):
+        """the name of the file the result of a run is stored in
+
+        :param runid: the ID of the run
+        :return: the name of the file or None if results are not stored
+                 in files named after the run
+        :rtype: Path
+        """
+        return None
+
     @abstractmethod
-    def set_result(self, params, result, scenario=None, force=False):
+    def _write_result(self, runid, result):
+        """store the result of a run
+
+        :param runid: the ID of the run
+        :param result: the result value
+        :return: dictionary of the run attributes to set
+
+        The method is called from multiple threads when the result queue is
+        flushed and must not access the database.
+        """
+        pass
+
+    def _atomic_write(self, fname, data, sync=None):
+        """write data to a file
+
+        The data are written to a temporary file which is then renamed so
+        that the file is either complete or missing.
+
+        :param fname: the name of the file
+        :type fname: Path
+        :param data: the contents of the file
+        :type data: bytes
+        :param sync: when True the temporary file is synchronised to disk
+                     before it is renamed, by default only if the objective
+                     function is durable
+        :type sync: bool
+        """
+        if sync is None:
+            sync = self.durable
+        dirname, basename = os.path.split(str(fname))
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=f'.{basename}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmpname, fname)
+        except Exception:
+            os.unlink(tmpname)
+            raise
+
+    def _sync_basedir(self):
+        """synchronise the base directory so that renames are durable"""
+        try:
+            fd = os.open(self.basedir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _prepare_result(self, result):
+        """check a result before it is stored
+
+        :param result: the result value
+        :return: the result value to store
+        """
+        return result
+
+    def _check_result_state(self, run, force=False):
+        """check that the result of a run can be set
+
+        :param run: the run object
+        :param force: force setting results irrespective of state
+        :raises RuntimeError: if the run is in the wrong state
+        """
+        with self._lock:
+            queued = run.id in self._queue
+        valid = LookupState.CONFIGURED.value < run.state.value \
+            < LookupState.COMPLETED.value and not queued
+        if not (valid or force):
+            raise RuntimeError(
+                f'parameter set {run.id} is in wrong state {run.state}')
+
+    def _queue_results(self, runids, results, costs):
+        """add results to the queue and flush it when it is full"""
+        with self._lock:
+            self._queue.update(zip(runids, zip(results, costs)))
+            full = len(self._queue) >= self._batch_size
+            _register_unflushed(self)
+        if full:
+            self.flush()
+
+    def _write_results(self, runs, results):
+        """write the results of runs in parallel
+
+        :param runs: list of run objects
+        :param results: list of result values
+        :return: list of dictionaries of the run attributes to set
+        """
+        if len(runs) == 1:
+            values = [self._write_result(runs[0].id, results[0])]
+        else:
+            with ThreadPoolExecutor() as pool:
+                values = list(pool.map(self._write_result,
+                                       [run.id for run in runs], results))
+        if self.durable:
+            self._sync_basedir()
+        return values
+
+    def _store_results(self, runs, results, costs):
+        """write the results of runs and commit them in a single transaction
+
+        :param runs: list of run objects
+        :param results: list of result values
+        :param costs: list of dictionaries of the cost of each run
+        """
+        values = self._write_results(runs, results)
+        if self._snapshot is not None:
+            keys = self._snapshot_keys(runs)
+            runids = [run.id for run in runs]
+        replaced = []
+        for run, v, c in zip(runs, values, costs):
+            # a forced result may be stored in a different file
+            old = getattr(run, 'path', None)
+            if old is not None and old != v.get('path', old):
+                replaced.append(old)
+            for k in v:
+                setattr(run, k, v[k])
+            for k in c:
+                setattr(run, k, c[k])
+            run.state = LookupState.COMPLETED
+        try:
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        if self._snapshot is not None:
+            handles = [v.get(self._result_handle) for v in values]
+            self._snapshot.append(
+                keys, runids, [LookupState.COMPLETED] * len(runids),
+                [self._snapshot_value(h) for h in handles],
+                in_file=[self._in_result_file(r, h)
+                         for r, h in zip(runids, handles)])
+        self._remove_files(replaced)
+
+    @staticmethod
+    def _remove_files(fnames):
+        """remove files that are no longer referenced"""
+        for fname in fnames:
+            try:
+                os.unlink(fname)
+            except FileNotFoundError:
+                pass
+
+    def set_result(self, params, result, scenario=None, force=False,
+                   walltime=None, cputime=None):
         """set the result for a paricular parameter set
 
         :param parms: dictionary of parameters
         :param result: result value to set
         :param scenario: the name of the scenario
         :param force: force setting results irrespective of state
+        :param walltime: the wall time of the run in seconds
+        :param cputime: the CPU time of the run in seconds
+
+        The method can be called from multiple threads if the objective
+        function was created with threadsafe=True. If the objective function
+        is buffered the result is queued and only written when the queue is
+        flushed.
         """
-        pass
+        result = self._prepare_result(result)
+        run = self._getRun(params, scenario=scenario)
+        self._check_result_state(run, force=force)
+
+        costs = [{'walltime': walltime, 'cputime': cputime}]
+        if self.buffered:
+            self._queue_results([run.id], [result], costs)
+        else:
+            self._store_results([run], [result], costs)
+
+    def set_results(self, runs, results, scenario=None,  # noqa C901
+                    force=False, walltime=None, cputime=None):
+        """set the results for many parameter sets at once
+
+        :param runs: list of dictionaries of parameters or run IDs
+        :param results: list of result values
+        :param scenario: the name of the scenario
+        :param force: force setting results irrespective of state
+        :param walltime: list of the wall times of the runs in seconds
+        :param cputime: list of the CPU times of the runs in seconds
+        :raises LookupError: if any of the runs cannot be found
+        :raises RuntimeError: if any of the runs is in the wrong state
+
+        All runs are looked up in a single query and their states are checked
+        before any result is stored. The results are written in parallel and
+        committed in a single transaction.
+        """
+        if len(runs) != len(results):
+            raise ValueError('number of runs and results do not match')
+        results = [self._prepare_result(r) for r in results]
+
+        runids = list(runs)
+        params = [i for i, r in enumerate(runs) if isinstance(r, Mapping)]
+        if len(params) > 0:
+            ids = self._getRunIDs([runs[i] for i in params],
+                                  scenario=scenario)
+            for i, runid in zip(params, ids):
+                runids[i] = runid
+        runids = [int(r) for r in runids]
+        if len(set(runids)) != len(runids):
+            raise RuntimeError('runs must only be given once')
+        if self.sharded and len({r >> SHARD_BITS for r in runids}) > 1:
+            raise RuntimeError('runs must belong to a single scenario')
+        if len(runids) > 0:
+            self._route_run(runids[0])
+
+        dbRuns = self._query_runs().filter(
+            self._Run.id.in_(runids))
+        dbRuns = {run.id: run for run in dbRuns}
+        missing = [r for r in runids if r not in dbRuns]
+        if len(missing) > 0:
+            raise LookupError(f'no runs with IDs {missing}')
+        dbRuns = [dbRuns[r] for r in runids]
+        for run in dbRuns:
+            self._check_result_state(run, force=force)
+
+        if walltime is None:
+            walltime = [None] * len(runs)
+        if cputime is None:
+            cputime = [None] * len(runs)
+        costs = [{'walltime': w, 'cputime': c}
+                 for w, c in zip(walltime, cputime)]
+        if self.buffered:
+            self._queue_results(runids, results, costs)
+        else:
+            self._store_results(dbRuns, results, costs)
+
+    def flush(self):
+        """write all queued results
+
+        The result files are written in parallel and the database is updated
+        in a single transaction. All results are stored when the method
+        returns. Unless durable was explicitly disabled, the result files
+        are synchronised to disk before the results are committed.
+        """
+        with self._lock:
+            queue = self._queue
+            self._queue = {}
+        if len(queue) == 0:
+            return
+        self._log.debug(f'flushing {len(queue)} results')
+
+        # the results of each shard are stored in a transaction of their own
+        shards = {}
+        for r in queue:
+            shard = r >> SHARD_BITS if self.sharded else None
+            shards.setdefault(shard, []).append(r)
+        try:
+            for shard, runids in shards.items():
+                self._route_shard(shard)
+                runs = self._query_runs().filter(self._Run.id.in_(runids))
+                runs = {run.id: run for run in runs}
+                self._store_results([runs[r] for r in runids],
+                                    [queue[r][0] for r in runids],
+                                    [queue[r][1] for r in runids])
+                for r in runids:
+                    del queue[r]
+        except Exception:
+            with self._lock:
+                queue.update(self._queue)
+                self._queue = queue
+            raise
+        with self._lock:
+            if len(self._queue) == 0:
+                _release_flushed(self)
+
+    def _fd_steps(self, x):
+        """compute the finite difference perturbations for each parameter
+
+        :param x: vector containing active parameter values
+        :return: list of pairs of perturbed vectors
+        """
+        steps = []
+        for i, p in enumerate(self._active_paramlist):
+            param = self.parameters[p]
+            if hasattr(param, 'resolution'):
+                span = (param.maxv - param.minv) / param.resolution
+                n = max(1, round(self._fd_step * span))
+                h = n * param.resolution
+            else:
+                h = 1
+            xp = x.copy()
+            xm = x.copy()
+            if self.gradient == 'central':
+                xp[i] = min(x[i] + h, param.maxv)
+                xm[i] = max(x[i] - h, param.minv)
+            elif x[i] + h <= param.maxv:
+                xp[i] = x[i] + h
+            else:
+                xm[i] = x[i] - h
+            steps.append((xp, xm))
+        return steps
+
+    def _require_runs(self, points, scenario=None):
+        """make sure that all points are in the lookup table
+
+        Missing parameter sets are added to the lookup table in the NEW
+        state in one go so that they can be computed in parallel.
+
+        :param points: list of dictionaries containing parameter values
+        :param scenario: the name of the scenario
+        :raises NewRun: when new entries were created
+        :raises Waiting: when entries are not yet completed
+        """
+        s = self.getScenario(scenario)
+        new = False
+        completed = True
+        for params in points:
+            try:
+                run = self._getRun(params, scenario=scenario)
+            except LookupError:
+                run = self._Run(s, params)
+                run.slot = self.slot
+                self._enqueue(run)
+                new = True
+            if run.state in [LookupState.PROVISIONAL, LookupState.CANCELLED]:
+                self._enqueue(run)
+                new = True
+            if run.state != LookupState.COMPLETED:
+                completed = False
+        self.session.commit()
+        if new:
+            self._log.info('new parameter sets for gradient')
+            raise NewRun
+        if not completed:
+            raise Waiting
+
+    def _fd_gradient(self, x, grad, scenario=None):
+        """compute the value and gradient using finite differences
 
-    def __call__(self, x, grad):
+        :param x: vector containing active parameter values
+        :param grad: vector that is filled with the gradient
+        :param scenario: the name of the scenario
+        :return: the value at x
+        """
+        x = numpy.array([self.active_parameters[p](v) for p, v in
+                         zip(self._active_paramlist, x)])
+        steps = self._fd_steps(x)
+        points = [self.values2params(x)]
+        for xp, xm in steps:
+            points += [self.values2params(xp), self.values2params(xm)]
+        self._require_runs(points, scenario=scenario)
+
+        values = [self.get_result(p, scenario=scenario) for p in points]
+        if any(numpy.ndim(v) != 0 for v in values):
+            raise RuntimeError(
+                'gradients are only supported for scalar objective functions')
+        for i, (xp, xm) in enumerate(steps):
+            grad[i] = (values[2 * i + 1] - values[2 * i + 2]) / (xp[i] - xm[i])
+        return values[0]
+
+    def __call__(self, x, grad, scenario=None):
         """look up parameters
 
         :param x: vector containing parameter values
-        :param grad: vector of length 0
+        :param grad: vector of length 0 or vector that is filled with the
+                     gradient if a finite difference scheme is set
         :type grad: numpy.ndarray
+        :param scenario: the name of the scenario, the default scenario is
+                         used when set to None
         :raises NewRun: when lookup fails
         :raises Waiting: when completed entries are required
         :return: returns the value if lookup succeeds and state is completed
-                 return a random value otherwise
+                 return a proxy value otherwise
         :rtype: float
+
+        When the gradient is requested all parameter sets required for the
+        finite difference approximation are added to the lookup table at
+        once. A NewRun exception is raised when new entries were created and
+        a Waiting exception until all entries are completed.
         """
         if grad.size > 0:
-            raise RuntimeError(
-                'ObjectiveFunction only supports derivative '
-                'free optimisations')
-        return self.get_result(self.values2params(x))
+            if self.gradient is None:
+                raise RuntimeError(
+                    'ObjectiveFunction only supports derivative '
+                    'free optimisations')
+            return self._fd_gradient(x, grad, scenario=scenario)
+        return self.get_result(self.values2params(x), scenario=scenario)
 
 
 if __name__ == '__main__':
@@ -523,6 +2422,15 @@ if __name__ == '__main__':
         def get_result(self, params, scenario=None):
             raise NotImplementedError
 
+        def _read_result(self, run):
+            raise NotImplementedError
+
+        def _random_result(self):
+            raise NotImplementedError
+
+        def _write_result(self, runid, result):
+            raise NotImplementedError
+
     def set_result(self, params, result, scenario=None):
         raise NotImplementedError
 
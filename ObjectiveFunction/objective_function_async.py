@@ -0,0 +1,164 @@
+__all__ = ['AsyncObjectiveFunction']
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .objective_function import ObjectiveFunction
+from .common import LookupState, RunPriority
+
+
+class AsyncObjectiveFunction:
+    """asyncio interface to an objective function
+
+    The blocking database and file operations of the objective function are
+    run in a pool of threads so that they do not stall the event loop.
+
+    :param objfun: the objective function, it must have been created with
+                   threadsafe=True
+    :type objfun: ObjectiveFunction
+    :param max_workers: the maximum number of threads
+    :type max_workers: int
+    """
+
+    def __init__(self, objfun: ObjectiveFunction,
+                 max_workers: int = None) -> None:
+        """constructor"""
+        if not objfun.threadsafe:
+            raise RuntimeError('objective function must be thread safe')
+        self._objfun = objfun
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='objfun')
+
+    @property
+    def objfun(self):
+        """the underlying objective function"""
+        return self._objfun
+
+    async def _run(self, func, *args, **kwds):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwds))
+
+    async def enqueue(self, points, priority=RunPriority.BACKGROUND,
+                      scenario=None):
+        """add parameter sets to the work queue
+
+        :param points: list of dictionaries containing parameter values
+        :param priority: the priority of the parameter sets
+        :param scenario: the name of the scenario
+        :return: list of run IDs
+        """
+        return await self._run(self.objfun.enqueue, points,
+                               priority=priority, scenario=scenario)
+
+    async def get_new(self, scenario=None, with_id=False):
+        """get a set of parameters that are not yet processed
+
+        :param scenario: the name of the scenario
+        :param with_id: when set to True also return run ID
+        :return: dictionary of parameter values for which to compute the model
+        :raises NoNewRun: if there is no new parameter set
+        """
+        return await self._run(self.objfun.get_new, scenario=scenario,
+                               with_id=with_id)
+
+    async def set_result(self, params, result, scenario=None, force=False,
+                         walltime=None, cputime=None):
+        """set the result for a paricular parameter set
+
+        :param parms: dictionary of parameters
+        :param result: result value to set
+        :param scenario: the name of the scenario
+        :param force: force setting results irrespective of state
+        :param walltime: the wall time of the run in seconds
+        :param cputime: the CPU time of the run in seconds
+        """
+        return await self._run(self.objfun.set_result, params, result,
+                               scenario=scenario, force=force,
+                               walltime=walltime, cputime=cputime)
+
+    async def set_results(self, runs, results, scenario=None, force=False,
+                          walltime=None, cputime=None):
+        """set the results for many parameter sets at once
+
+        :param runs: list of dictionaries of parameters or run IDs
+        :param results: list of result values
+        :param scenario: the name of the scenario
+        :param force: force setting results irrespective of state
+        :param walltime: list of the wall times of the runs in seconds
+        :param cputime: list of the CPU times of the runs in seconds
+        """
+        return await self._run(self.objfun.set_results, runs, results,
+                               scenario=scenario, force=force,
+                               walltime=walltime, cputime=cputime)
+
+    async def get_batch(self, walltime, scenario=None, with_id=False):
+        """get parameter sets that fit into an allocation
+
+        :param walltime: the length of the allocation in seconds
+        :param scenario: the name of the scenario
+        :param with_id: when set to True also return run IDs
+        :return: list of dictionaries of parameter values
+        :raises NoNewRun: if there is no new parameter set
+        """
+        return await self._run(self.objfun.get_batch, walltime,
+                               scenario=scenario, with_id=with_id)
+
+    async def get_result(self, params, scenario=None):
+        """look up parameters
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :raises NewRun: when lookup fails
+        :raises Waiting: when completed entries are required
+        :return: returns the value if lookup succeeds and state is completed
+                 return a proxy value otherwise
+        """
+        return await self._run(self.objfun.get_result, params,
+                               scenario=scenario)
+
+    async def is_cancelled(self, runid):
+        """check whether a run was cancelled
+
+        :param runid: ID of run
+        :return: True if the run was cancelled
+        """
+        return await self._run(self.objfun.is_cancelled, runid)
+
+    async def state(self, params, scenario=None):
+        """get run state
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        """
+        return await self._run(self.objfun.state, params, scenario=scenario)
+
+    async def wait_for(self, params, scenario=None, interval=10.):
+        """wait until the run of a parameter set is completed
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :param interval: the time in seconds between checking the state
+        :return: the result of the run
+        :raises LookupError: when there is no run with the parameter set
+        :raises RuntimeError: when the run was cancelled
+        """
+        while True:
+            state = await self.state(params, scenario=scenario)
+            if state == LookupState.COMPLETED:
+                break
+            if state == LookupState.CANCELLED:
+                raise RuntimeError('run was cancelled')
+            await asyncio.sleep(interval)
+        return await self.get_result(params, scenario=scenario)
+
+    def close(self):
+        """wait for pending operations and shut down the threads"""
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
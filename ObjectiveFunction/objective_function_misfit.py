@@ -25,9 +25,13 @@ class ObjectiveFunctionMisfit(ObjectiveFunction):
                    PreliminaryRun exception otherwise a
                    NewRun exception is raised. Default=True
     :type prelim: bool
+    :param kwds: further keyword arguments are passed on to
+                 :class:`ObjectiveFunction`
     """
 
     _Run = DBRunMisfit
+    _result_name = 'misfit'
+    _result_handle = 'misfit'
 
     def get_result(self, params, scenario=None):
         """look up parameters
@@ -37,31 +41,26 @@ class ObjectiveFunctionMisfit(ObjectiveFunction):
         :raises NewRun: when lookup fails
         :raises Waiting: when completed entries are required
         :return: returns the value if lookup succeeds and state is completed
-                 return a random value otherwise
+                 return a proxy value otherwise
         :rtype: float
         """
 
+        # the misfit of a completed run is stored in the snapshot
+        entry = self._snapshot_entry(params, scenario=scenario)
+        if entry is not None:
+            return entry.result
+
         run = self._lookupRun(params, scenario=scenario)
         if run.state != LookupState.COMPLETED:
-            return random.random()
+            return float(self._proxy_result(params, scenario=scenario))
         else:
-            return run.misfit
+            return self._read_result(run)
 
-    def set_result(self, params, result, scenario=None, force=False):
-        """set the result for a paricular parameter set
+    def _read_result(self, run):
+        return run.misfit
 
-        :param parms: dictionary of parameters
-        :param result: result value to set
-        :param scenario: the name of the scenario
-        :param force: force setting results irrespective of state
-        :type result: float
-        """
+    def _random_result(self):
+        return random.random()
 
-        run = self._getRun(params, scenario=scenario)
-        if (run.state.value > LookupState.CONFIGURED.value
-            and run.state != LookupState.COMPLETED) or force:  # noqa W503
-            run.state = LookupState.COMPLETED
-            run.misfit = result
-            self.session.commit()
-        else:
-            raise RuntimeError(f'parameter set is in wrong state {run.state}')
+    def _write_result(self, runid, result):
+        return {'misfit': float(result)}
@@ -8,6 +8,7 @@ from pathlib import Path
 from .parameter import Parameter
 from .objective_function import ObjectiveFunction, LookupState
 from .model import DBRunPath
+from .storage import ResultStorage
 
 
 class ObjectiveFunctionResidual(ObjectiveFunction):
@@ -29,19 +30,37 @@ class ObjectiveFunctionResidual(ObjectiveFunction):
                    PreliminaryRun exception otherwise a
                    NewRun exception is raised. Default=True
     :type prelim: bool
+    :param storage: how the residuals are stored, by default they are
+                    stored in the numpy npy format
+    :type storage: ResultStorage
+    :param inline: when True the residuals are stored in the database
+                   instead of files. Default=False
+    :type inline: bool
+    :param kwds: further keyword arguments are passed on to
+                 :class:`ObjectiveFunction`
     """
 
     _Run = DBRunPath
+    _result_name = 'residuals'
+    _result_handle = 'path'
 
     def __init__(self, study: str, basedir: Path,  # noqa C901
                  parameters: Mapping[str, Parameter],
-                 scenario=None, db=None, prelim=True):
+                 scenario=None, db=None, prelim=True, storage=None,
+                 inline=False, **kwds):
         """constructor"""
 
+        self._inline = inline
         super().__init__(study, basedir, parameters,
-                         scenario=scenario, db=db, prelim=prelim)
+                         scenario=scenario, db=db, prelim=prelim, **kwds)
 
         self._num_residuals = None
+        self._storage = ResultStorage() if storage is None else storage
+
+    @property
+    def storage(self):
+        """how the residuals are stored"""
+        return self._storage
 
     @property
     def num_residuals(self):
@@ -59,39 +78,36 @@ class ObjectiveFunctionResidual(ObjectiveFunction):
         :raises NewRun: when lookup fails
         :raises Waiting: when completed entries are required
         :return: returns the value if lookup succeeds and state is completed
-                 return a random value otherwise
+                 return a proxy value otherwise
         :rtype: numpy.arraynd
         """
 
         run = self._lookupRun(params, scenario=scenario)
         if run.state != LookupState.COMPLETED:
-            return numpy.random.rand(self.num_residuals)
+            return self._proxy_result(params, scenario=scenario)
         else:
-            with open(run.path, 'rb') as f:
-                result = numpy.load(f)
-            if self._num_residuals is None:
-                self._num_residuals = result.size
-            return result
+            return self._read_result(run)
 
-    def set_result(self, params, result, scenario=None, force=False):
-        """set the result for a paricular parameter set
-
-        :param parms: dictionary of parameters
-        :param result: residuals to store
-        :param scenario: the name of the scenario
-        :param force: force setting results irrespective of state
-        :type result: numpy.ndarray
-        """
-
-        run = self._getRun(params, scenario=scenario)
-        if (run.state.value > LookupState.CONFIGURED.value
-            and run.state != LookupState.COMPLETED) or force:  # noqa W503
-            # store residuals in file
-            fname = self.basedir / f'residuals_{run.id}.npy'
-            with open(fname, 'wb') as f:
-                numpy.save(f, result)
-            run.path = str(fname)
-            run.state = LookupState.COMPLETED
-            self.session.commit()
+    def _read_result(self, run):
+        if run.path is None:
+            result = self.storage.loads(run.result_data)
         else:
-            raise RuntimeError(f'parameter set is in wrong state {run.state}')
+            result = self.storage.load(run.path)
+        if self._num_residuals is None:
+            self._num_residuals = result.size
+        return result
+
+    def _random_result(self):
+        return numpy.random.rand(self.num_residuals)
+
+    def _result_file(self, runid):
+        return self.basedir / f'residuals_{runid}{self.storage.suffix}'
+
+    def _write_result(self, runid, result):
+        if self.inline:
+            return {'path': None,
+                    'result_data': self.storage.dumps(result)}
+        # store residuals in file
+        fname = self._result_file(runid)
+        self._atomic_write(fname, self.storage.dumps(result))
+        return {'path': str(fname)}
@@ -1,5 +1,7 @@
 __all__ = ['ObjectiveFunctionSimObs']
 
+import io
+import hashlib
 from typing import Mapping, Sequence
 from pathlib import Path
 import pandas
@@ -30,43 +32,55 @@ class ObjectiveFunctionSimObs(ObjectiveFunction):
                    PreliminaryRun exception otherwise a
                    NewRun exception is raised. Default=True
     :type prelim: bool
+    :param inline: when True the simulated observations are stored in the
+                   database instead of files. Default=False
+    :type inline: bool
+    :param kwds: further keyword arguments are passed on to
+                 :class:`ObjectiveFunction`
     """
 
     _Run = DBRunPath
+    _result_name = 'simobs'
+    _result_handle = 'path'
 
     def __init__(self, study: str, basedir: Path,  # noqa C901
                  parameters: Mapping[str, Parameter],
                  observationNames: Sequence[str],
-                 scenario=None, db=None, prelim=True):
+                 scenario=None, db=None, prelim=True, inline=False,
+                 **kwds):
         """constructor"""
 
+        self._configObsNames = observationNames
+        self._inline = inline
         super().__init__(study, basedir, parameters,
-                         scenario=scenario, db=db, prelim=prelim)
-
-        if self._is_new:
-            for name in observationNames:
-                DBObsName(name=name, study=self._study)
-            try:
-                self.session.commit()
-            except Exception as e:
-                self._log.error(e)
-                raise RuntimeError('failed to set observation names')
+                         scenario=scenario, db=db, prelim=prelim, **kwds)
+
+    def _populate_study(self):
+        super()._populate_study()
+        for name in self._configObsNames:
+            DBObsName(name=name, study=self._study)
+
+    def _class_fingerprint(self):
+        names = '\n'.join(sorted(self._configObsNames))
+        return hashlib.sha256(names.encode()).hexdigest()
+
+    def _check_class(self):
+        # make sure that observation names match
+        error = False
+        if len(self._study.obsnames) != len(self._configObsNames):
+            self._log.error(
+                f'number of observations in {self.study} does not match')
+            error = True
         else:
-            # make sure that observation names match
-            error = False
-            if len(self._study.obsnames) != len(observationNames):
-                self._log.error(
-                    f'number of parameters in {study} does not match')
-                error = True
-            else:
-                for obsName in self._study.obsnames:
-                    if obsName.name not in observationNames:
-                        self._log.error(
-                            f'observation name {obsName} missing '
-                            'from configuration')
-                        error = True
-            if error:
-                raise RuntimeError('configuration does not match database')
+            names = set(self._configObsNames)
+            for obsName in self._study.obsnames:
+                if obsName.name not in names:
+                    self._log.error(
+                        f'observation name {obsName.name} missing '
+                        'from configuration')
+                    error = True
+        if error:
+            raise RuntimeError('configuration does not match database')
 
     @property
     def observationNames(self):
@@ -102,20 +116,33 @@ class ObjectiveFunctionSimObs(ObjectiveFunction):
         :raises NewRun: when lookup fails
         :raises Waiting: when completed entries are required
         :return: returns simulated observations if lookup succeeded or
-                 a random pandas Series
+                 a proxy pandas Series
         :rtype: pandas.Series
         """
 
         run = self._lookupRun(params, scenario=scenario)
         if run.state != LookupState.COMPLETED:
             result = pandas.Series(
-                numpy.random.rand(self.num_residuals),
+                self._proxy_result(params, scenario=scenario),
                 index=self.observationNames)
         else:
-            result = pandas.read_json(run.path, typ='series')
-            self._check_simobs(result)
+            result = self._read_simobs(run)
         return result
 
+    def _read_simobs(self, run):
+        if run.path is None:
+            source = io.StringIO(run.result_data.decode())
+        else:
+            source = run.path
+        result = pandas.read_json(source, typ='series')
+        return self._check_simobs(result)
+
+    def _read_result(self, run):
+        return self._read_simobs(run)[self.observationNames].values
+
+    def _random_result(self):
+        return numpy.random.rand(self.num_residuals)
+
     def get_result(self, params, scenario=None):
         """look up parameters
 
@@ -124,31 +151,22 @@ class ObjectiveFunctionSimObs(ObjectiveFunction):
         :raises NewRun: when lookup fails
         :raises Waiting: when completed entries are required
         :return: returns the value if lookup succeeds and state is completed
-                 return a random value otherwise
+                 return a proxy value otherwise
         :rtype: numpy.arraynd
         """
         result = self.get_simobs(params, scenario=scenario)
         return result.values
 
-    def set_result(self, params, result, scenario=None, force=False):
-        """set the result for a paricular parameter set
+    def _prepare_result(self, result):
+        return self._check_simobs(result)
 
-        :param parms: dictionary of parameters
-        :param result: residuals to store
-        :param scenario: the name of the scenario
-        :param force: force setting results irrespective of state
-        :type result: numpy.ndarray
-        """
-        result = self._check_simobs(result)
-
-        run = self._getRun(params, scenario=scenario)
-        if (run.state.value > LookupState.CONFIGURED.value
-            and run.state != LookupState.COMPLETED) or force:  # noqa W503
-            # store residuals in file
-            fname = self.basedir / f'simobs_{run.id}.json'
-            result.to_json(fname)
-            run.path = str(fname)
-            run.state = LookupState.COMPLETED
-            self.session.commit()
-        else:
-            raise RuntimeError(f'parameter set is in wrong state {run.state}')
+    def _result_file(self, runid):
+        return self.basedir / f'simobs_{runid}.json'
+
+    def _write_result(self, runid, result):
+        if self.inline:
+            return {'path': None, 'result_data': result.to_json().encode()}
+        # store simulated observations in file
+        fname = self._result_file(runid)
+        self._atomic_write(fname, result.to_json().encode())
+        return {'path': str(fname)}
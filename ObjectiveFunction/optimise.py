@@ -1,4 +1,5 @@
 import argparse
+from functools import partial
 from pathlib import Path
 import nlopt
 import sys
@@ -18,8 +19,8 @@ class NLConfig(ObjFunConfig):
     algorithm = string()
     """
 
-    def __init__(self, fname: Path) -> None:
-        super().__init__(fname)
+    def __init__(self, fname: Path, cache: Path = None) -> None:
+        super().__init__(fname, cache=cache)
         self._log = logging.getLogger('ObjectiveFunction.optimisecfg')
         self._opt = None
 
@@ -29,27 +30,97 @@ class NLConfig(ObjFunConfig):
 
     @property
     def optimiser(self):
+        """the optimiser of the default scenario"""
         if self._opt is None:
-            try:
-                alg = getattr(nlopt, self.cfg['nlopt']['algorithm'])
-            except AttributeError:
-                e = 'no such algorithm {}'.format(
-                    self.cfg['nlopt']['algorithm'])
-                self._log.error(e)
-                raise RuntimeError(e)
-            self._opt = nlopt.opt(
-                alg, self.objectiveFunction.num_active_params)
-            self._opt.set_lower_bounds(self.objectiveFunction.lower_bounds)
-            self._opt.set_upper_bounds(self.objectiveFunction.upper_bounds)
-            self._opt.set_min_objective(self.objectiveFunction)
-            self._opt.set_stopval(-0.1)
-            self._opt.set_xtol_rel(1e-2)
+            self._opt = self.createOptimiser()
         return self._opt
 
+    def createOptimiser(self, scenario=None):
+        """instantiate a new optimiser
+
+        Optimisers keep state between runs so concurrent optimisations
+        each need their own optimiser.
+
+        :param scenario: the name of the scenario whose objective function
+                         is minimised, by default the default scenario
+        """
+        try:
+            alg = getattr(nlopt, self.cfg['nlopt']['algorithm'])
+        except AttributeError:
+            e = 'no such algorithm {}'.format(
+                self.cfg['nlopt']['algorithm'])
+            self._log.error(e)
+            raise RuntimeError(e)
+        objfun = self.objectiveFunction
+        opt = nlopt.opt(alg, objfun.num_active_params)
+        opt.set_lower_bounds(objfun.lower_bounds)
+        opt.set_upper_bounds(objfun.upper_bounds)
+        if scenario is None:
+            opt.set_min_objective(objfun)
+        else:
+            opt.set_min_objective(partial(objfun, scenario=scenario))
+        opt.set_stopval(-0.1)
+        opt.set_xtol_rel(1e-2)
+        return opt
+
+
+def optimise(opt, objfun, startPoints, scenario=None, speculate=0):
+    """run one optimiser per start point
+
+    All optimisers share the lookup table of the scenario but each uses its
+    own provisional slot.
+
+    :param opt: the optimiser
+    :param objfun: the objective function minimised by the optimiser
+    :param startPoints: list of parameter dictionaries ordered by slot
+    :param scenario: the name of the scenario used in log messages
+    :param speculate: the maximum number of parameter sets each optimiser
+                      enqueues ahead using the surrogate model once it
+                      created a new parameter set
+    :return: list of the status of each optimiser, either new, waiting or
+             done
+    """
+    log = logging.getLogger('ObjectiveFunction.optimise')
+    name = '' if scenario is None else f'{scenario} '
+
+    status = []
+    for slot, start in enumerate(startPoints):
+        objfun.slot = slot
+        # run optimiser twice to detect whether new parameter set is stable
+        x0 = objfun.params2values(start, include_constant=False)
+        for i in range(2):
+            try:
+                x = opt.optimize(x0)
+            except PreliminaryRun:
+                log.info(f'new parameter set for {name}optimiser {slot}')
+                continue
+            except NewRun:
+                runids = objfun.speculate(partial(opt.optimize, x0),
+                                          max_points=speculate,
+                                          scenario=scenario)
+                if len(runids) > 0:
+                    log.info(f'{len(runids)} speculative parameter sets for '
+                             f'{name}optimiser {slot}')
+                status.append('new')
+                break
+            except Waiting:
+                status.append('waiting')
+                break
+
+            minf = opt.last_optimum_value()
+            results = opt.last_optimize_result()
+
+            if results == 1 or i == 1:
+                log.info(f"{name}optimiser {slot}: minimum value {minf}")
+                log.info(f"{name}optimiser {slot}: result code {results}")
+                log.info(f"{name}optimiser {slot}: optimum at {x}")
+                status.append('done')
+                break
+    return status
+
 
 def main():
     logging.basicConfig(level=logging.INFO)
-    log = logging.getLogger('ObjectiveFunction.optimise')
 
     parser = argparse.ArgumentParser()
     parser.add_argument('config', type=Path,
@@ -57,35 +128,15 @@ def main():
     args = parser.parse_args()
 
     cfg = NLConfig(args.config)
-    opt = cfg.optimiser
-
-    # run optimiser twice to detect whether new parameter set is stable
-    for i in range(2):
-        # start with lower bounds
-        try:
-            x = opt.optimize(
-                cfg.objectiveFunction.params2values(cfg.values,
-                                                    include_constant=False))
-        except PreliminaryRun:
-            log.info('new parameter set')
-            continue
-        except NewRun:
-            print('new')
-            sys.exit(1)
-        except Waiting:
-            print('waiting')
-            sys.exit(2)
-
-        minf = opt.last_optimum_value()
-        results = opt.last_optimize_result()
-
-        if results == 1:
-            break
-
-    log.info(f"minimum value {minf}")
-    log.info(f"result code {results}")
-    log.info(f"optimum at {x}")
-
+    status = optimise(cfg.optimiser, cfg.objectiveFunction, cfg.startPoints,
+                      speculate=cfg.cfg['setup']['speculate'])
+
+    if 'new' in status:
+        print('new')
+        sys.exit(1)
+    if 'waiting' in status:
+        print('waiting')
+        sys.exit(2)
     print('done')
 
 
@@ -1,8 +1,10 @@
-__all__ = ['Parameter', 'ParameterInt', 'ParameterFloat']
+__all__ = ['Parameter', 'ParameterInt', 'ParameterFloat', 'ParameterSpace']
 
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic
+from typing import TypeVar, Generic, Mapping
+import hashlib
 import sys
+import numpy
 
 T = TypeVar('T', int, float)
 
@@ -184,3 +186,161 @@ class ParameterFloat(Parameter[float]):
         value = self.minv + dbval * self.resolution
         self.check_value(value)
         return value
+
+
+class ParameterSpace:
+    """a collection of named parameters
+
+    map between dictionaries of parameter values and vectors of values
+    ordered by parameter name
+
+    :param parameters: a dictionary mapping parameter names to the range of
+        permissible parameter values
+    """
+
+    def __init__(self, parameters: Mapping[str, Parameter]) -> None:
+        """constructor"""
+
+        if len(parameters) == 0:
+            raise RuntimeError('no parameters given')
+
+        self._parameters = parameters
+        self._constant_parameters = {}
+        self._active_parameters = {}
+        for p in self.parameters:
+            if self.parameters[p].constant:
+                self._constant_parameters[p] = self.parameters[p]
+            else:
+                self._active_parameters[p] = self.parameters[p]
+        self._paramlist = tuple(
+            sorted(list(self.parameters.keys())))
+        self._active_paramlist = tuple(
+            sorted(list(self.active_parameters.keys())))
+        self._lb = None
+        self._ub = None
+
+    @property
+    def num_params(self):
+        """the number of parameters"""
+        return len(self._parameters)
+
+    @property
+    def num_active_params(self):
+        """the number of parameters"""
+        return len(self._active_parameters)
+
+    @property
+    def parameters(self):
+        """dictionary of parameters"""
+        return self._parameters
+
+    @property
+    def active_parameters(self):
+        """the constant parameters"""
+        return self._active_parameters
+
+    @property
+    def constant_parameters(self):
+        """the constant parameters"""
+        return self._constant_parameters
+
+    def _definition(self):
+        """a canonical description of the parameters
+
+        The description only covers the configuration shared by all
+        objective function classes so that opening a study with another
+        class does not change its fingerprint.
+
+        :return: list of strings
+        """
+        definition = []
+        for p in self._paramlist:
+            param = self.parameters[p]
+            definition.append(
+                f'parameter {p} {type(param).__name__} {param.minv!r} '
+                f'{param.maxv!r} {getattr(param, "resolution", None)!r}')
+        return definition
+
+    def _fingerprint(self):
+        """a hash of the canonical description of the parameters"""
+        definition = '\n'.join(self._definition())
+        return hashlib.sha256(definition.encode()).hexdigest()
+
+    def getLowerBounds(self):
+        """an array containing the lower bounds"""
+        if self._lb is None:
+            self._lb = []
+            for p in self._active_paramlist:
+                self._lb.append(self.parameters[p].minv)
+            self._lb = numpy.array(self._lb)
+        return self._lb
+
+    def getUpperBounds(self):
+        """an array containing the upper bounds"""
+        if self._ub is None:
+            self._ub = []
+            for p in self._active_paramlist:
+                self._ub.append(self.parameters[p].maxv)
+            self._ub = numpy.array(self._ub)
+        return self._ub
+
+    @property
+    def lower_bounds(self):
+        """an array containing the lower bounds"""
+        return self.getLowerBounds()
+
+    @property
+    def upper_bounds(self):
+        """an array containing the upper bounds"""
+        return self.getUpperBounds()
+
+    def _normalise(self, params):
+        """map parameter values to the unit hypercube
+
+        The coordinates are computed from the integer representation of
+        the active parameters and normalised by their range.
+
+        :param params: dictionary of parameter values
+        :return: array of normalised coordinates
+        """
+        coords = []
+        for p in self._active_paramlist:
+            param = self.parameters[p]
+            lo = param.transform(param.minv)
+            hi = param.transform(param.maxv)
+            coords.append((param.transform(params[p]) - lo) / (hi - lo))
+        return numpy.array(coords)
+
+    def values2params(self, values):
+        """create a dictionary of parameter values from list of values
+        :param values: a list/tuple of values
+        :return: a dictionary of parameters
+        """
+        params = {}
+        if len(values) == len(self.parameters):
+            for i, p in enumerate(self._paramlist):
+                params[p] = values[i]
+        elif len(values) == len(self.active_parameters):
+            for i, p in enumerate(self._active_paramlist):
+                params[p] = values[i]
+            for p in self.constant_parameters:
+                params[p] = self.constant_parameters[p].value
+        else:
+            raise RuntimeError('Wrong number of parameters')
+
+        return params
+
+    def params2values(self, params, include_constant=True):
+        """create an array of values from a dictionary of parameters
+        :param params: a dictionary of parameters
+        :param include_constant: set to False to exclude constant parameters
+        :return: a array of values
+        """
+        values = []
+        for p in self._paramlist:
+            if self.parameters[p].constant:
+                if include_constant:
+                    values.append(self.parameters[p].value)
+            else:
+                values.append(params[p])
+        return numpy.array(values)
@@ -0,0 +1,626 @@
+__all__ = ['ObjectiveFunctionServer', 'ObjectiveFunctionClient']
+
+import argparse
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Mapping
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+import numpy
+import pandas
+
+from .common import LookupState, PreliminaryRun, NewRun, Waiting, NoNewRun
+from .common import RunPriority
+from .parameter import Parameter, ParameterSpace
+
+SCHEME = 'objfun'
+
+# the exceptions that are passed on to the client
+EXCEPTIONS = {e.__name__: e for e in [PreliminaryRun, NewRun, Waiting,
+                                      NoNewRun, LookupError, RuntimeError,
+                                      ValueError]}
+
+
+def _encode(obj):
+    """encode objects that cannot be represented directly by JSON"""
+    if isinstance(obj, LookupState):
+        return {'__state__': obj.name}
+    if isinstance(obj, pandas.Series):
+        return {'__series__': {'index': list(obj.index),
+                               'values': obj.values.tolist()}}
+    if isinstance(obj, numpy.ndarray):
+        return {'__ndarray__': obj.tolist(), 'dtype': obj.dtype.str}
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+    raise TypeError(f'cannot encode object of type {type(obj).__name__}')
+
+
+def _decode(obj):
+    """decode objects encoded by _encode"""
+    if '__state__' in obj:
+        return LookupState[obj['__state__']]
+    if '__series__' in obj:
+        return pandas.Series(obj['__series__']['values'],
+                             index=obj['__series__']['index'])
+    if '__ndarray__' in obj:
+        return numpy.array(obj['__ndarray__'], dtype=obj['dtype'])
+    return obj
+
+
+def dumps(obj):
+    return json.dumps(obj, default=_encode).encode()
+
+
+def loads(data):
+    return json.loads(data, object_hook=_decode)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = loads(self.rfile.read(length))
+            response = self.server.handle_call(
+                request['method'], request.get('args', []),
+                request.get('kwargs', {}),
+                slot=request.get('slot', 0),
+                prelim=request.get('prelim', True),
+                priority=request.get('priority', RunPriority.BLOCKING),
+                speculate=request.get('speculate'))
+        except Exception as e:
+            response = {'error': type(e).__name__, 'message': str(e)}
+        data = dumps(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        self.server._log.debug(format % args)
+
+
+class ObjectiveFunctionServer(ThreadingHTTPServer):
+    """serve an objective function to clients over HTTP
+
+    The server owns the database session of the objective function. Calls
+    from all clients are serialised so that the database is only written
+    from a single process. The spatial index and surrogate models of the
+    objective function as well as the results of completed runs are kept in
+    memory.
+
+    :param objfun: the objective function to serve
+    :type objfun: ObjectiveFunction
+    :param host: the name of the host to listen on
+    :type host: str
+    :param port: the port to listen on, pick a free port when 0
+    :type port: int
+    :param cache_size: the maximum number of results of completed runs
+                       kept in memory, the least recently used results are
+                       dropped first
+    :type cache_size: int
+    """
+
+    # the methods of the objective function that can be called by clients
+    METHODS = ['get_new', 'get_with_state', 'get_result', 'get_simobs',
+               'set_result', 'set_results', 'state', 'getRunID',
+               'getState', 'setState', 'getParameters', 'getStartPoints',
+               'setStartPoints', 'runs_in_box', 'nearest_runs', 'scenarios',
+               'cancel', 'is_cancelled', 'enqueue', 'get_batch',
+               'predict_cost', 'createScenario', 'fingerprint', '__call__']
+    # the methods that modify results
+    MODIFY = ['set_result', 'set_results', 'setState']
+    # the methods whose results are cached for completed runs
+    CACHE = ['get_result', 'get_simobs']
+
+    def __init__(self, objfun, host: str = 'localhost',
+                 port: int = 0, cache_size: int = 1024) -> None:
+        """constructor"""
+        super().__init__((host, port), _RequestHandler)
+        self._log = logging.getLogger('ObjectiveFunction.server')
+        self._objfun = objfun
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    @property
+    def objfun(self):
+        """the objective function"""
+        return self._objfun
+
+    @property
+    def url(self):
+        """the URL used by clients to connect to the server"""
+        host, port = self.server_address[:2]
+        return f'{SCHEME}://{host}:{port}'
+
+    def _call(self, method, args, kwargs):
+        if method == 'scenarios':
+            return self.objfun.scenarios
+        if method == 'fingerprint':
+            return self.objfun._fingerprint()
+        if method == '__call__':
+            x, grad = args
+            value = self.objfun(numpy.asarray(x), grad, **kwargs)
+            return [value, grad]
+        return getattr(self.objfun, method)(*args, **kwargs)
+
+    def handle_call(self, method, args, kwargs, slot=0, prelim=True,
+                    priority=RunPriority.BLOCKING, speculate=None):
+        """call a method of the objective function
+
+        :param method: the name of the method
+        :param args: list of positional arguments
+        :param kwargs: dictionary of keyword arguments
+        :param slot: the optimiser slot of the client
+        :param prelim: the prelim setting of the client
+        :param priority: the priority setting of the client
+        :param speculate: the number of parameter sets the client may still
+                          add speculatively or None if the client does not
+                          speculate
+        :return: dictionary containing either the result or the name of the
+                 exception and its message and the IDs of the runs added
+                 speculatively
+        """
+        if speculate is None:
+            return self._handle_call(method, args, kwargs, slot, prelim,
+                                     priority)
+        with self._lock, \
+                self.objfun._speculation(speculate) as speculative:
+            response = self._handle_call(method, args, kwargs, slot, prelim,
+                                         priority)
+        response['speculative'] = speculative
+        return response
+
+    def _handle_call(self, method, args, kwargs, slot, prelim, priority):
+        if method not in self.METHODS:
+            raise RuntimeError(f'unknown method {method}')
+        key = None
+        if method in self.CACHE:
+            key = json.dumps([method, args, kwargs], sort_keys=True,
+                             default=_encode)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return {'result': self._cache[key]}
+            self.objfun.slot = slot
+            self.objfun.prelim = prelim
+            self.objfun.priority = priority
+            try:
+                result = self._call(method, args, kwargs)
+            except (PreliminaryRun, NewRun, Waiting, NoNewRun) as e:
+                return {'error': type(e).__name__, 'message': str(e)}
+            except Exception as e:
+                self.objfun.session.rollback()
+                self._log.error(f'{method}: {e}')
+                return {'error': type(e).__name__, 'message': str(e)}
+            if method in self.MODIFY:
+                self._cache.clear()
+            elif key is not None and \
+                    self.objfun.state(*args, **kwargs) == \
+                    LookupState.COMPLETED:
+                self._cache[key] = result
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return {'result': result}
+
+
+class ObjectiveFunctionClient(ParameterSpace):
+    """a client of an objective function server
+
+    The client provides the same interface as an objective function but
+    forwards all lookups to an :class:`ObjectiveFunctionServer`.
+
+    :param url: the URL of the server of the form objfun://host:port
+    :type url: str
+    :param parameters: a dictionary mapping parameter names to the range of
+        permissible parameter values
+    :param scenario: name of the default scenario
+    :type scenario: str
+    :param prelim: when True failed parameter look up raises a
+                   PreliminaryRun exception otherwise a
+                   NewRun exception is raised. Default=True
+    :type prelim: bool
+    :param timeout: the timeout of requests in seconds
+    :type timeout: float
+    :raises RuntimeError: if the parameters do not match the study served
+    """
+
+    def __init__(self, url: str, parameters: Mapping[str, Parameter],
+                 scenario=None, prelim=True, timeout=60.) -> None:
+        """constructor"""
+        super().__init__(parameters)
+        url = urlparse(url)
+        if url.scheme != SCHEME:
+            raise ValueError(f'wrong scheme {url.scheme}, expected {SCHEME}')
+        self._log = logging.getLogger('ObjectiveFunction.client')
+        self._url = f'http://{url.netloc}/'
+        self._scenario = scenario
+        self._prelim = prelim
+        self._slot = 0
+        self._local = threading.local()
+        self._priority = RunPriority.BLOCKING
+        self._timeout = timeout
+        if self._request('fingerprint') != self._fingerprint():
+            msg = f'parameters do not match the study served at {url.netloc}'
+            self._log.error(msg)
+            raise RuntimeError(msg)
+
+    @property
+    def prelim(self):
+        return self._prelim
+
+    @prelim.setter
+    def prelim(self, value):
+        self._prelim = bool(value)
+
+    @property
+    def slot(self):
+        """the optimiser slot, local to the thread that sets it"""
+        return getattr(self._local, 'slot', self._slot)
+
+    @slot.setter
+    def slot(self, value):
+        self._slot = int(value)
+        self._local.slot = self._slot
+
+    @property
+    def priority(self):
+        """the priority of new parameter sets created by lookups"""
+        return self._priority
+
+    @priority.setter
+    def priority(self, value):
+        self._priority = RunPriority(value)
+
+    @property
+    def scenarios(self):
+        """list of scenarios"""
+        return self._request('scenarios')
+
+    def createScenario(self, name):
+        """create a scenario if it does not already exist
+
+        :param name: name of scenario
+        :return: the ID of the scenario
+        """
+        return self._request('createScenario', name)
+
+    def _request(self, method, *args, **kwargs):
+        if 'scenario' in kwargs and kwargs['scenario'] is None:
+            kwargs['scenario'] = self._scenario
+        data = {'method': method, 'args': args, 'kwargs': kwargs,
+                'slot': self.slot, 'prelim': self.prelim,
+                'priority': int(self.priority)}
+        speculative = getattr(self._local, 'speculative', None)
+        if speculative is not None:
+            data['speculate'] = self._local.max_speculative - \
+                len(speculative)
+        request = Request(self._url, data=dumps(data),
+                          headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=self._timeout) as f:
+            response = loads(f.read())
+        if speculative is not None:
+            speculative += response.get('speculative', [])
+        if 'error' in response:
+            exc = EXCEPTIONS.get(response['error'], RuntimeError)
+            raise exc(response['message'])
+        return response['result']
+
+    def getStartPoints(self, scenario=None):
+        """get the starting points of the optimisers
+
+        :param scenario: the name of the scenario
+        :return: list of parameter dictionaries ordered by slot
+        """
+        return self._request('getStartPoints', scenario=scenario)
+
+    def setStartPoints(self, points, scenario=None):
+        """set the starting points of the optimisers
+
+        :param points: list of parameter dictionaries
+        :param scenario: the name of the scenario
+        """
+        return self._request('setStartPoints', points, scenario=scenario)
+
+    def getRunID(self, parameters, scenario=None):
+        """get ID of run
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        """
+        return self._request('getRunID', parameters, scenario=scenario)
+
+    def getState(self, runid):
+        """get the state of a run with ID
+
+        :param runid: ID of run
+        :return: state of run
+        """
+        return self._request('getState', runid)
+
+    def getParameters(self, runid):
+        """get the parameter values of a run with ID
+
+        :param runid: ID of run
+        :return: dictionary of parameter values
+        """
+        return self._request('getParameters', runid)
+
+    def setState(self, runid, state):
+        """set the state of run
+
+        :param runid: ID of run
+        :param state: the new state
+        """
+        return self._request('setState', runid, state)
+
+    def is_cancelled(self, runid):
+        """check whether a run was cancelled
+
+        :param runid: ID of run
+        :return: True if the run was cancelled
+        """
+        return self._request('is_cancelled', runid)
+
+    def cancel(self, keep=None, lb=None, ub=None, active=False,
+               all_slots=False, scenario=None):
+        """cancel runs that are no longer required
+
+        :param keep: list of dictionaries of parameters or run IDs of runs
+                     that should not be cancelled
+        :param lb: dictionary of the lower bounds of a box
+        :param ub: dictionary of the upper bounds of the box
+        :param active: when True runs that are being processed are
+                       cancelled as well
+        :param all_slots: when True the runs of all optimisers are
+                          cancelled, otherwise only the runs created in the
+                          slot of the client
+        :param scenario: the name of the scenario
+        :return: the number of cancelled runs
+        """
+        return self._request('cancel', keep=keep, lb=lb, ub=ub,
+                             active=active, all_slots=all_slots,
+                             scenario=scenario)
+
+    def state(self, parameters, scenario=None):
+        """get run state
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        """
+        return self._request('state', parameters, scenario=scenario)
+
+    def get_with_state(self, state, scenario=None, with_id=False,
+                       new_state=None):
+        """get a set of parameters in a particular state
+
+        :param state: find run in state
+        :param scenario: the name of the scenario
+        :param with_id: when set to True also return run ID
+        :param new_state: when not None set the state of the run to new_state
+        :return: dictionary of parameter values for which to compute the model
+        :raises LookupError: if there is no parameter set in specified state
+        """
+        result = self._request('get_with_state', state, scenario=scenario,
+                               with_id=with_id, new_state=new_state)
+        if with_id:
+            return tuple(result)
+        return result
+
+    def enqueue(self, points, priority=RunPriority.BACKGROUND,
+                scenario=None):
+        """add parameter sets to the work queue
+
+        :param points: list of dictionaries containing parameter values
+        :param priority: the priority of the parameter sets
+        :param scenario: the name of the scenario
+        :return: list of run IDs
+        """
+        return self._request('enqueue', points, priority=int(priority),
+                             scenario=scenario)
+
+    def get_new(self, scenario=None, with_id=False):
+        """get a set of parameters that are not yet processed
+
+        :param scenario: the name of the scenario
+        :param with_id: when set to True also return run ID
+        :return: dictionary of parameter values for which to compute the model
+        :raises NoNewRun: if there is no new parameter set
+        """
+        result = self._request('get_new', scenario=scenario, with_id=with_id)
+        if with_id:
+            return tuple(result)
+        return result
+
+    def runs_in_box(self, lb, ub, scenario=None):
+        """find the completed runs within a box
+
+        :param lb: vector of active parameter values of the lower corner
+        :param ub: vector of active parameter values of the upper corner
+        :param scenario: the name of the scenario
+        :return: list of run IDs
+        """
+        return self._request('runs_in_box', lb, ub, scenario=scenario)
+
+    def nearest_runs(self, x, k=1, scenario=None):
+        """find the completed runs nearest to a parameter set
+
+        :param x: vector of active parameter values
+        :param k: the number of runs to find
+        :param scenario: the name of the scenario
+        :return: list of pairs of run ID and normalised distance
+        """
+        return [tuple(r) for r in self._request('nearest_runs', x, k=k,
+                                                scenario=scenario)]
+
+    def get_result(self, params, scenario=None):
+        """look up parameters
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :raises NewRun: when lookup fails
+        :raises Waiting: when completed entries are required
+        :return: returns the value if lookup succeeds and state is completed
+                 return a proxy value otherwise
+        """
+        return self._request('get_result', params, scenario=scenario)
+
+    def speculate(self, evaluate, max_points=4, scenario=None):
+        """speculatively enqueue the points an optimiser will likely need
+
+        :param evaluate: function without arguments that runs the optimiser
+        :param max_points: the maximum number of parameter sets to add
+        :param scenario: the name of the scenario
+        :return: list of the IDs of the runs that were added
+        """
+        if max_points < 1:
+            return []
+        speculative = []
+        self._local.speculative = speculative
+        self._local.max_speculative = max_points
+        try:
+            evaluate()
+        except (NewRun, PreliminaryRun, Waiting):
+            pass
+        finally:
+            del self._local.speculative
+            del self._local.max_speculative
+        return speculative
+
+    def get_simobs(self, params, scenario=None):
+        """look up simulated observations
+
+        :param parms: dictionary containing parameter values
+        :param scenario: the name of the scenario
+        :raises NewRun: when lookup fails
+        :raises Waiting: when completed entries are required
+        :rtype: pandas.Series
+        """
+        return self._request('get_simobs', params, scenario=scenario)
+
+    def set_result(self, params, result, scenario=None, force=False,
+                   walltime=None, cputime=None):
+        """set the result for a paricular parameter set
+
+        :param parms: dictionary of parameters
+        :param result: result value to set
+        :param scenario: the name of the scenario
+        :param force: force setting results irrespective of state
+        :param walltime: the wall time of the run in seconds
+        :param cputime: the CPU time of the run in seconds
+        """
+        return self._request('set_result', params, result,
+                             scenario=scenario, force=force,
+                             walltime=walltime, cputime=cputime)
+
+    def set_results(self, runs, results, scenario=None, force=False,
+                    walltime=None, cputime=None):
+        """set the results for many parameter sets at once
+
+        :param runs: list of dictionaries of parameters or run IDs
+        :param results: list of result values
+        :param scenario: the name of the scenario
+        :param force: force setting results irrespective of state
+        :param walltime: list of the wall times of the runs in seconds
+        :param cputime: list of the CPU times of the runs in seconds
+        """
+        return self._request('set_results', runs, results,
+                             scenario=scenario, force=force,
+                             walltime=walltime, cputime=cputime)
+
+    def get_batch(self, walltime, scenario=None, with_id=False,
+                  default_cost=None):
+        """get parameter sets that fit into an allocation
+
+        :param walltime: the length of the allocation in seconds
+        :param scenario: the name of the scenario
+        :param with_id: when set to True also return run IDs
+        :param default_cost: the wall time assumed for parameter sets
+                             without a prediction
+        :return: list of dictionaries of parameter values or of pairs of run
+                 ID and parameter values
+        :raises NoNewRun: if there is no new parameter set
+        """
+        result = self._request('get_batch', walltime, scenario=scenario,
+                               with_id=with_id, default_cost=default_cost)
+        if with_id:
+            return [tuple(r) for r in result]
+        return result
+
+    def predict_cost(self, params, k=4, scenario=None):
+        """predict the wall time of a run
+
+        :param params: dictionary of parameter values
+        :param k: the number of completed runs to use
+        :param scenario: the name of the scenario
+        :return: the predicted wall time in seconds or None
+        """
+        return self._request('predict_cost', params, k=k, scenario=scenario)
+
+    def __call__(self, x, grad, scenario=None):
+        """look up parameters
+
+        :param x: vector containing parameter values
+        :param grad: vector of length 0 or vector that is filled with the
+                     gradient if a finite difference scheme is set
+        :type grad: numpy.ndarray
+        :param scenario: the name of the scenario
+        :raises NewRun: when lookup fails
+        :raises Waiting: when completed entries are required
+        :return: returns the value if lookup succeeds and state is completed
+                 return a proxy value otherwise
+        """
+        if grad.size == 0:
+            return self.get_result(self.values2params(x), scenario=scenario)
+        value, g = self._request('__call__', numpy.asarray(x), grad,
+                                 scenario=scenario)
+        grad[:] = g
+        return value
+
+
+def main():
+    from .config import ObjFunConfig
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', type=Path,
+                        help='name of configuration file')
+    parser.add_argument('--host', default='localhost',
+                        help='the name of the host to listen on')
+    parser.add_argument('--port', type=int, default=0,
+                        help='the port to listen on')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='the number of results kept in memory')
+    parser.add_argument('--db',
+                        help='database connection string, by default the '
+                        'database of the configuration or the database in '
+                        'the base directory is used')
+    args = parser.parse_args()
+
+    cfg = ObjFunConfig(args.config)
+    db = args.db
+    if db is None and not str(cfg.cfg['setup']['db']).startswith(
+            f'{SCHEME}://'):
+        db = cfg.cfg['setup']['db']
+    objfun = cfg.createObjectiveFunction(db=db)
+
+    server = ObjectiveFunctionServer(objfun, host=args.host, port=args.port,
+                                     cache_size=args.cache_size)
+    logging.info(f'serving objective function at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+__all__ = ['LookupSnapshot', 'SnapshotEntry']
+
+import glob
+import os
+import struct
+import tempfile
+import threading
+from collections import namedtuple
+import numpy
+
+from .common import LookupState
+
+MAGIC = b'OFLS\x03'
+HEADER = struct.Struct('<5sxxxQQQ')
+RECORD = numpy.dtype([('runid', '<i8'), ('state', '<i4'),
+                      ('in_file', 'u1'), ('result', '<f8')])
+
+SnapshotEntry = namedtuple('SnapshotEntry',
+                           ['runid', 'state', 'result', 'in_file'])
+
+
+def _atomic_write(fname, chunks):
+    """write the chunks to a temporary file and rename it"""
+    dirname, basename = os.path.split(str(fname))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=f'.{basename}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for data in chunks:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpname, fname)
+    except Exception:
+        os.unlink(tmpname)
+        raise
+
+
+class LookupSnapshot:
+    """a memory mapped index of the completed runs
+
+    The snapshot maps the keys of runs, ie the scenario ID followed by the
+    transformed parameter values, to the run ID, the state and the scalar
+    result of the run and whether the result is stored in the result file
+    named after the run ID. The snapshot file holds the keys sorted in a
+    contiguous array followed by the records of the runs, both of which are
+    memory mapped so that opening the snapshot reads nothing and a lookup
+    is a binary search touching a few pages. The keys are stored as big
+    endian integers with the sign bit flipped, so that their bytes compare
+    in the same order as the values.
+
+    New entries, including entries of runs that are no longer completed,
+    are appended to a journal file which is read into memory. Entries of
+    the journal take precedence over those of the snapshot. Each snapshot
+    has a generation number and its own journal. Once the journal holds
+    more than min_journal entries and a quarter of the entries of the
+    snapshot both are merged into a snapshot of the next generation which
+    replaces the old one and the old journal is removed. Appending to the
+    journal and merging it hold an exclusive lock on the journal, so that
+    no entries are appended to a journal that has been merged.
+
+    :param fname: the name of the snapshot file, the journal is stored next
+                  to it with the suffix .journal followed by the generation
+    :type fname: Path
+    :param num_keys: the number of integers of each key
+    :type num_keys: int
+    :param min_journal: the minimum number of journal entries before the
+                        snapshot is compacted automatically
+    :type min_journal: int
+    """
+
+    def __init__(self, fname, num_keys, min_journal=1024):
+        self._fname = str(fname)
+        self._num_keys = num_keys
+        self._min_journal = min_journal
+        self._key_dtype = numpy.dtype(f'V{8 * num_keys}')
+        self._journal_dtype = numpy.dtype(
+            [('key', self._key_dtype)] + RECORD.descr)
+        self._lock = threading.RLock()
+        self._open()
+
+    @property
+    def fname(self):
+        """the name of the snapshot file"""
+        return self._fname
+
+    @property
+    def journal(self):
+        """the name of the journal of the current generation"""
+        return f'{self._fname}.journal{self._generation}'
+
+    def __len__(self):
+        return len(self._keys) + len(self._journal)
+
+    def _encode(self, keys):
+        """encode keys so that their bytes sort like the values"""
+        keys = numpy.asarray(keys, dtype='<i8').reshape(-1, self._num_keys)
+        keys = (keys.view('<u8') ^ numpy.uint64(1 << 63)).astype('>u8')
+        return numpy.ascontiguousarray(keys).view(self._key_dtype).ravel()
+
+    def _identity(self):
+        """identify the snapshot file so that replacements are noticed"""
+        try:
+            st = os.stat(self._fname)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _open(self):
+        """map the snapshot and read the journal"""
+        self._ident = self._identity()
+        self._keys = numpy.empty(0, dtype=self._key_dtype)
+        self._records = numpy.empty(0, dtype=RECORD)
+        self._generation = 0
+        self._offset = 0
+        self._journal = {}
+        if self._ident is not None:
+            with open(self._fname, 'rb') as f:
+                magic, num_keys, count, generation = HEADER.unpack(
+                    f.read(HEADER.size))
+            if magic != MAGIC:
+                raise RuntimeError(f'{self._fname} is not a snapshot')
+            if num_keys != self._num_keys:
+                raise RuntimeError(f'the keys of snapshot {self._fname} '
+                                   'do not match the parameters')
+            if count > 0:
+                self._keys = numpy.memmap(
+                    self._fname, dtype=self._key_dtype, mode='r',
+                    offset=HEADER.size, shape=(count, ))
+                self._records = numpy.memmap(
+                    self._fname, dtype=RECORD, mode='r',
+                    offset=HEADER.size + count * self._key_dtype.itemsize,
+                    shape=(count, ))
+            self._generation = generation
+        self._read_journal()
+
+    def _read_journal(self):
+        """read the entries appended to the journal since the last read
+
+        :return: True if new entries were read
+        """
+        try:
+            with open(self.journal, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        # an entry that is being written is read next time
+        count = len(data) // self._journal_dtype.itemsize
+        entries = numpy.frombuffer(
+            data, dtype=self._journal_dtype, count=count)
+        for entry in entries:
+            self._journal[entry['key'].tobytes()] = entry
+        self._offset += count * self._journal_dtype.itemsize
+        return count > 0
+
+    def _update(self):
+        """pick up the changes of other processes
+
+        :return: True if anything changed
+        """
+        if self._identity() != self._ident:
+            self._open()
+            return True
+        return self._read_journal()
+
+    def lookup(self, key):
+        """look up a run
+
+        The changes of other processes are picked up first, so that runs
+        which are no longer completed are not found.
+
+        :param key: sequence of integers
+        :return: the entry of the run or None if the key is not found
+        :rtype: SnapshotEntry
+        """
+        key = self._encode([key])[0]
+        with self._lock:
+            self._update()
+            entry = self._find(key)
+        if entry is None:
+            return None
+        return SnapshotEntry(int(entry['runid']),
+                             LookupState(int(entry['state'])),
+                             float(entry['result']), bool(entry['in_file']))
+
+    def _find(self, key):
+        entry = self._journal.get(key.tobytes())
+        if entry is not None:
+            return entry
+        i = numpy.searchsorted(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._records[i]
+        return None
+
+    def _locked_journal(self):
+        """open the journal of the current generation and lock it
+
+        :return: the open journal or None if the snapshot was replaced in
+                 the meantime
+        """
+        # only available on POSIX systems
+        import fcntl
+        f = open(self.journal, 'ab')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if self._identity() != self._ident:
+            # the journal was merged, remove it if it was created again
+            if os.fstat(f.fileno()).st_size == 0:
+                try:
+                    os.unlink(self.journal)
+                except FileNotFoundError:
+                    pass
+            f.close()
+            self._open()
+            return None
+        return f
+
+    def append(self, keys, runids, states, results, in_file=None):
+        """add entries
+
+        The entries are appended to the journal with a single write so
+        that entries of concurrent processes are not interleaved.
+
+        :param keys: the keys of the runs, one row of integers per run
+        :param runids: the IDs of the runs
+        :param states: the states of the runs
+        :param results: the scalar results of the runs, NaN if the result
+                        is not a scalar
+        :param in_file: whether the results of the runs are stored in the
+                        result files named after the run IDs, by default
+                        False
+        """
+        entries = numpy.empty(len(runids), dtype=self._journal_dtype)
+        if len(entries) == 0:
+            return
+        entries['key'] = self._encode(keys)
+        entries['runid'] = runids
+        entries['state'] = [LookupState(s).value for s in states]
+        entries['result'] = results
+        entries['in_file'] = False if in_file is None else in_file
+        with self._lock:
+            f = None
+            while f is None:
+                f = self._locked_journal()
+            with f:
+                f.write(entries.tobytes())
+            # the entries are read again from the journal which is harmless
+            for entry in entries:
+                self._journal[entry['key'].tobytes()] = entry
+            compact = len(self._journal) > max(self._min_journal,
+                                               len(self._keys) // 4)
+        if compact:
+            self.compact()
+
+    def compact(self):
+        """merge the journal into a snapshot of the next generation"""
+        with self._lock:
+            f = self._locked_journal()
+            if f is None:
+                # another process merged the journal
+                return
+            with f:
+                self._read_journal()
+                journal = numpy.array(list(self._journal.values()),
+                                      dtype=self._journal_dtype)
+                keys = numpy.concatenate([self._keys, journal['key']])
+                records = numpy.concatenate(
+                    [self._records,
+                     journal[list(RECORD.names)].astype(RECORD)])
+                # the sort is stable so the last of equal keys is the newest
+                order = numpy.argsort(keys, kind='stable')
+                keys = keys[order]
+                records = records[order]
+                newest = numpy.ones(len(keys), dtype=bool)
+                newest[:-1] = keys[1:] != keys[:-1]
+                keys = keys[newest]
+                records = records[newest]
+                header = HEADER.pack(MAGIC, self._num_keys, len(keys),
+                                     self._generation + 1)
+                _atomic_write(self._fname,
+                              [header, keys.tobytes(), records.tobytes()])
+                # the journal is removed while it is locked so that
+                # processes waiting for the lock notice the new snapshot
+                os.unlink(self.journal)
+            self._open()
+
+    def clear(self):
+        """remove the snapshot and the journals"""
+        with self._lock:
+            for fname in [self._fname] + glob.glob(
+                    glob.escape(self._fname) + '.journal*'):
+                try:
+                    os.unlink(fname)
+                except FileNotFoundError:
+                    pass
+            self._open()
@@ -0,0 +1,176 @@
+__all__ = ['SpatialIndex']
+
+import heapq
+import itertools
+import numpy
+
+
+class _Node:
+    """a node of the k-d tree
+
+    A leaf holds a dictionary of points, an inner node splits its points
+    along the dimension dim at the value split. Each node keeps the
+    bounding box of the points added to it.
+    """
+
+    __slots__ = ['lo', 'hi', 'points', 'dim', 'split', 'left', 'right']
+
+    def __init__(self, num_dims):
+        self.lo = numpy.full(num_dims, numpy.inf)
+        self.hi = numpy.full(num_dims, -numpy.inf)
+        self.points = {}
+        self.dim = None
+        self.split = None
+        self.left = None
+        self.right = None
+
+    def extend(self, x):
+        """extend the bounding box to include x"""
+        numpy.minimum(self.lo, x, out=self.lo)
+        numpy.maximum(self.hi, x, out=self.hi)
+
+    def distance(self, x):
+        """the distance between x and the bounding box"""
+        return numpy.linalg.norm(
+            numpy.maximum(numpy.maximum(self.lo - x, x - self.hi), 0))
+
+
+class SpatialIndex:
+    """a spatial index of points in the unit hypercube
+
+    The points are stored in a k-d tree whose leaves are split along the
+    dimension with the largest spread once they hold more than leaf_size
+    points, so that the cells adapt to the distribution of the points in
+    any number of dimensions. Points can be added and removed
+    incrementally. Queries only visit the nodes whose bounding boxes can
+    contain matches.
+
+    :param num_dims: the number of dimensions
+    :type num_dims: int
+    :param leaf_size: the maximum number of points of a leaf
+    :type leaf_size: int
+    """
+
+    def __init__(self, num_dims: int, leaf_size: int = 16) -> None:
+        """constructor"""
+        self._num_dims = num_dims
+        self._leaf_size = leaf_size
+        self._root = _Node(num_dims)
+        self._leaves = {}
+
+    @property
+    def num_dims(self):
+        """the number of dimensions"""
+        return self._num_dims
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def __contains__(self, key):
+        return key in self._leaves
+
+    def add(self, key, x):
+        """add a point to the index
+
+        :param key: the key identifying the point, eg the run ID
+        :param x: the normalised coordinates of the point
+        """
+        if key in self._leaves:
+            self.remove(key)
+        x = numpy.array(x, dtype=float)
+        node = self._root
+        node.extend(x)
+        while node.points is None:
+            node = node.left if x[node.dim] < node.split else node.right
+            node.extend(x)
+        node.points[key] = x
+        self._leaves[key] = node
+        if len(node.points) > self._leaf_size:
+            self._split(node)
+
+    def _split(self, node):
+        """split a leaf along the dimension with the largest spread"""
+        keys = list(node.points)
+        x = numpy.array([node.points[k] for k in keys])
+        dim = int(numpy.argmax(x.max(axis=0) - x.min(axis=0)))
+        values = numpy.unique(x[:, dim])
+        if len(values) == 1:
+            # all points coincide
+            return
+        node.dim = dim
+        node.split = values[len(values) // 2]
+        node.left = _Node(self.num_dims)
+        node.right = _Node(self.num_dims)
+        for k, p in zip(keys, x):
+            child = node.left if p[dim] < node.split else node.right
+            child.extend(p)
+            child.points[k] = p
+            self._leaves[k] = child
+        node.points = None
+
+    def point(self, key):
+        """the coordinates of a point
+
+        :param key: the key identifying the point
+        """
+        return self._leaves[key].points[key]
+
+    def remove(self, key):
+        """remove a point from the index
+
+        :param key: the key identifying the point
+        """
+        del self._leaves.pop(key).points[key]
+
+    def in_box(self, lb, ub):
+        """find all points within a box
+
+        :param lb: the lower corner of the box
+        :param ub: the upper corner of the box
+        :return: list of keys
+        """
+        lb = numpy.asarray(lb, dtype=float)
+        ub = numpy.asarray(ub, dtype=float)
+        result = []
+        stack = [self._root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if numpy.any(node.hi < lb) or numpy.any(node.lo > ub):
+                continue
+            if node.points is None:
+                stack += [node.left, node.right]
+                continue
+            for key, x in node.points.items():
+                if numpy.all(x >= lb) and numpy.all(x <= ub):
+                    result.append(key)
+        return result
+
+    def nearest(self, x, k=1):
+        """find the k nearest points
+
+        :param x: the normalised coordinates of the query point
+        :param k: the number of points to find
+        :return: list of pairs of key and distance sorted by distance
+        """
+        x = numpy.asarray(x, dtype=float)
+        best = []
+        # the nodes are visited in order of the distance of their bounding
+        # boxes, the counter breaks ties
+        counter = itertools.count()
+        queue = [(self._root.distance(x), next(counter), self._root)]
+        while len(queue) > 0:
+            d, _, node = heapq.heappop(queue)
+            if len(best) == k and d > -best[0][0]:
+                break
+            if node.points is None:
+                for child in [node.left, node.right]:
+                    heapq.heappush(
+                        queue, (child.distance(x), next(counter), child))
+                continue
+            for key, p in node.points.items():
+                dist = numpy.linalg.norm(p - x)
+                if len(best) < k:
+                    heapq.heappush(best, (-dist, key))
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, (-dist, key))
+        return [(key, -dist) for dist, key in sorted(best, reverse=True)]
@@ -0,0 +1,297 @@
+__all__ = ['ResultStorage']
+
+import argparse
+import bz2
+import io
+import json
+import lzma
+import os
+import struct
+import tempfile
+import time
+import zlib
+from pathlib import Path
+import numpy
+
+MAGIC = b'OFRS\x01'
+NPY_MAGIC = b'\x93NUMPY'
+
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(
+        data, 6 if level is None else level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(
+        data, preset=6 if level is None else level), lzma.decompress),
+    'bz2': (lambda data, level: bz2.compress(
+        data, 9 if level is None else max(level, 1)), bz2.decompress),
+}
+
+
+def _shuffle(data, itemsize):
+    """group the n-th bytes of all items together"""
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+        -1, itemsize).T.tobytes()
+
+
+def _unshuffle(data, itemsize):
+    """undo the byte shuffle"""
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+        itemsize, -1).T.tobytes()
+
+
+class ResultStorage:
+    """store result arrays compactly
+
+    With the default options arrays are stored unchanged in the numpy
+    ``.npy`` format. Otherwise the arrays are stored in a simple container:
+    the array is optionally cast to a smaller floating point type, split
+    into chunks of a fixed number of values and each chunk is compressed
+    separately. Before compression the bytes of the values are shuffled,
+    ie the first bytes of all values are followed by the second bytes and
+    so on, which makes floating point data much more compressible.
+    Arrays are always read with their original data type. Files in either
+    format can be read whatever the options of the storage.
+
+    :param dtype: the data type used to store floating point arrays, eg
+                  float32. By default the data type of the array is kept
+    :param compression: the compression, one of zlib, lzma or bz2. By
+                        default the data is not compressed
+    :param level: the compression level, by default the level of the
+                  compression library is used
+    :type level: int
+    :param shuffle: shuffle the bytes before compressing. Default=True
+    :type shuffle: bool
+    :param chunk_size: the number of values per chunk. By default the array
+                       is stored in a single chunk
+    :type chunk_size: int
+    """
+
+    def __init__(self, dtype=None, compression=None, level=None,
+                 shuffle=True, chunk_size=None):
+        if compression == 'none':
+            compression = None
+        if compression is not None and compression not in CODECS:
+            raise ValueError(f'unknown compression {compression}')
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError('chunk size must be positive')
+        self._dtype = None if dtype is None else numpy.dtype(dtype)
+        self._compression = compression
+        self._level = level
+        self._shuffle = shuffle
+        self._chunk_size = chunk_size
+
+    def __repr__(self):
+        return (f'ResultStorage(dtype={self.dtype}, '
+                f'compression={self.compression}, level={self._level}, '
+                f'shuffle={self._shuffle}, chunk_size={self.chunk_size})')
+
+    @property
+    def dtype(self):
+        """the data type used to store floating point arrays"""
+        return self._dtype
+
+    @property
+    def compression(self):
+        """the compression"""
+        return self._compression
+
+    @property
+    def chunk_size(self):
+        """the number of values per chunk"""
+        return self._chunk_size
+
+    @property
+    def compact(self):
+        """whether arrays are stored in the compact format"""
+        return self.dtype is not None or self.compression is not None \
+            or self.chunk_size is not None
+
+    @property
+    def suffix(self):
+        """the suffix of the files"""
+        return '.npc' if self.compact else '.npy'
+
+    def dumps(self, result):
+        """serialise an array
+
+        :param result: the array to store
+        :return: the serialised array
+        :rtype: bytes
+        """
+        result = numpy.asarray(result)
+        if not self.compact:
+            data = io.BytesIO()
+            numpy.save(data, result)
+            return data.getvalue()
+
+        values = result.ravel()
+        if self.dtype is not None and values.dtype.kind == 'f':
+            values = values.astype(self.dtype)
+        values = numpy.ascontiguousarray(values)
+        itemsize = values.dtype.itemsize
+        chunk_size = self.chunk_size or max(values.size, 1)
+
+        chunks = []
+        for i in range(0, values.size, chunk_size):
+            data = values[i:i + chunk_size].tobytes()
+            if self.compression is not None:
+                if self._shuffle:
+                    data = _shuffle(data, itemsize)
+                data = CODECS[self.compression][0](data, self._level)
+            chunks.append(data)
+
+        header = json.dumps({
+            'dtype': values.dtype.str,
+            'original': result.dtype.str,
+            'shape': result.shape,
+            'compression': self.compression,
+            'shuffle': self._shuffle,
+            'chunk_size': chunk_size,
+            'chunks': [len(c) for c in chunks]}).encode()
+        return b''.join([MAGIC, struct.pack('<I', len(header)), header,
+                         *chunks])
+
+    @staticmethod
+    def _read_header(f):
+        f.read(len(MAGIC))
+        size = struct.unpack('<I', f.read(4))[0]
+        return json.loads(f.read(size))
+
+    @staticmethod
+    def _decode(header, data):
+        dtype = numpy.dtype(header['dtype'])
+        if header['compression'] is not None:
+            data = CODECS[header['compression']][1](data)
+            if header['shuffle']:
+                data = _unshuffle(data, dtype.itemsize)
+        return numpy.frombuffer(data, dtype=dtype)
+
+    def loads(self, data):
+        """deserialise an array
+
+        :param data: the serialised array
+        :type data: bytes
+        :return: the array
+        """
+        return self._load(io.BytesIO(data))
+
+    def load(self, fname, start=None, stop=None):
+        """read an array from a file
+
+        When start or stop are given only the values of the flattened
+        array in the range are returned and only the chunks containing
+        them are read.
+
+        :param fname: the name of the file
+        :param start: index of the first value
+        :param stop: index after the last value
+        :return: the array
+        """
+        with open(fname, 'rb') as f:
+            return self._load(f, start=start, stop=stop)
+
+    def _load(self, f, start=None, stop=None):
+        select = start is not None or stop is not None
+        magic = f.read(len(NPY_MAGIC))
+        f.seek(0)
+        if magic == NPY_MAGIC:
+            result = numpy.load(f)
+            if select:
+                return result.ravel()[start:stop]
+            return result
+        if not magic.startswith(MAGIC[:4]):
+            raise RuntimeError('unknown result file format')
+
+        header = self._read_header(f)
+        offset = f.tell()
+        size = int(numpy.prod(header['shape']))
+        start, stop, _ = slice(start, stop).indices(size)
+        chunk_size = header['chunk_size']
+        offsets = numpy.cumsum([offset] + header['chunks'])
+        first = start // chunk_size
+        last = -(-stop // chunk_size) if stop > start else first
+
+        values = []
+        for i in range(first, last):
+            f.seek(offsets[i])
+            values.append(self._decode(header, f.read(header['chunks'][i])))
+        if len(values) > 0:
+            values = numpy.concatenate(values)
+        else:
+            values = numpy.empty(0, dtype=header['dtype'])
+        values = values.astype(header['original'])
+        if select:
+            return values[start - first * chunk_size:stop - first * chunk_size]
+        return values.reshape(header['shape'])
+
+
+def benchmark(size=200000, repeat=5, seed=0):
+    """compare disk usage and read latency of the storage options
+
+    :param size: the number of values of the result array
+    :param repeat: the number of times each file is read
+    :param seed: the seed of the random number generator
+    :return: list of tuples of the storage, the file size in bytes, the
+             time to write and the time to read the array in seconds and
+             the largest relative error
+    """
+    rng = numpy.random.default_rng(seed)
+    # residuals are usually smooth with some noise
+    x = numpy.linspace(0, 20, size)
+    result = numpy.sin(x) * numpy.exp(-x / 10) + 1e-3 * rng.standard_normal(
+        size)
+
+    options = [ResultStorage(),
+               ResultStorage(dtype='float32')]
+    for compression in CODECS:
+        options.append(ResultStorage(compression=compression))
+        options.append(ResultStorage(compression=compression,
+                                     shuffle=False))
+        options.append(ResultStorage(dtype='float32',
+                                     compression=compression))
+    options.append(ResultStorage(dtype='float32', compression='zlib',
+                                 chunk_size=size // 16))
+
+    timings = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for i, storage in enumerate(options):
+            fname = Path(tmpdir) / f'result_{i}{storage.suffix}'
+            t = time.perf_counter()
+            fname.write_bytes(storage.dumps(result))
+            write = time.perf_counter() - t
+            t = time.perf_counter()
+            for r in range(repeat):
+                values = storage.load(fname)
+            read = (time.perf_counter() - t) / repeat
+            scale = numpy.maximum(numpy.abs(result), 1e-300)
+            error = numpy.max(numpy.abs(values - result) / scale)
+            timings.append((storage, os.path.getsize(fname), write, read,
+                            error))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark the result storage options')
+    parser.add_argument('-n', '--size', type=int, default=200000,
+                        help='the number of values of the result array')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='the number of times each file is read')
+    args = parser.parse_args()
+
+    timings = benchmark(size=args.size, repeat=args.repeat)
+    print(f'{"dtype":8} {"compression":11} {"shuffle":7} {"chunks":>7} '
+          f'{"size/kB":>9} {"ratio":>6} {"write/ms":>9} {"read/ms":>8} '
+          f'{"error":>8}')
+    base = timings[0][1]
+    for storage, nbytes, write, read, error in timings:
+        chunks = 1 if storage.chunk_size is None else \
+            -(-args.size // storage.chunk_size)
+        shuffle = storage._shuffle and storage.compression is not None
+        print(f'{str(storage.dtype or "float64"):8} '
+              f'{str(storage.compression or "none"):11} {str(shuffle):7} '
+              f'{chunks:7d} {nbytes / 1024:9.1f} {base / nbytes:6.2f} '
+              f'{write * 1000:9.2f} {read * 1000:8.2f} {error:8.1e}')
+
+
+if __name__ == '__main__':
+    main()
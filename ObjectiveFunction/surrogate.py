@@ -0,0 +1,156 @@
+__all__ = ['Surrogate', 'SurrogateRBF', 'SurrogateQuadratic']
+
+from abc import ABC, abstractmethod
+import itertools
+import numpy
+
+
+class Surrogate(ABC):
+    """a surrogate model fitted to completed runs
+
+    The surrogate model approximates the objective function using the
+    results of completed runs. Points are added incrementally and the model
+    is refitted the next time a prediction is requested.
+
+    :param num_dims: the number of dimensions of parameter space
+    :type num_dims: int
+    """
+
+    def __init__(self, num_dims: int) -> None:
+        """constructor"""
+        self._num_dims = num_dims
+        self._points = {}
+        self._model = None
+
+    @property
+    def num_dims(self):
+        """the number of dimensions of parameter space"""
+        return self._num_dims
+
+    @property
+    def num_points(self):
+        """the number of points used to fit the surrogate"""
+        return len(self._points)
+
+    @property
+    @abstractmethod
+    def min_points(self):
+        """the minimum number of points required for a fit"""
+        pass
+
+    @property
+    def ready(self):
+        """whether there are sufficient points to fit the surrogate"""
+        return self.num_points >= self.min_points
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def add(self, key, x, y):
+        """add a point to the surrogate
+
+        :param key: a unique key identifying the point, eg the run ID
+        :param x: the normalised coordinates of the point
+        :param y: the value of the objective function at the point
+        """
+        if key in self._points:
+            return
+        self._points[key] = (numpy.asarray(x, dtype=float),
+                             numpy.asarray(y, dtype=float))
+        self._model = None
+
+    def remove(self, key):
+        """remove a point from the surrogate
+
+        :param key: the key identifying the point
+        """
+        del self._points[key]
+        self._model = None
+
+    def predict(self, x):
+        """predict the value of the objective function
+
+        :param x: the normalised coordinates of the point
+        :return: the predicted value
+        """
+        if not self.ready:
+            raise RuntimeError('not enough points to fit surrogate')
+        if self._model is None:
+            points, values = zip(*self._points.values())
+            self._model = self._fit(numpy.array(points),
+                                    numpy.array(values))
+        return self._predict(self._model, numpy.asarray(x, dtype=float))
+
+    @abstractmethod
+    def _fit(self, x, y):
+        """fit the surrogate
+
+        :param x: array of shape (num_points, num_dims)
+        :param y: array of shape (num_points, ...) containing the values
+        :return: the fitted model
+        """
+        pass
+
+    @abstractmethod
+    def _predict(self, model, x):
+        """evaluate the fitted model at x"""
+        pass
+
+
+class SurrogateRBF(Surrogate):
+    """a cubic radial basis function surrogate with a linear tail
+
+    :param num_dims: the number of dimensions of parameter space
+    :type num_dims: int
+    """
+
+    @property
+    def min_points(self):
+        return self.num_dims + 1
+
+    def _fit(self, x, y):
+        n = len(x)
+        r = numpy.linalg.norm(x[:, None, :] - x[None, :, :], axis=-1)
+        p = numpy.hstack((numpy.ones((n, 1)), x))
+        a = numpy.block([[r ** 3, p],
+                         [p.T, numpy.zeros((p.shape[1], p.shape[1]))]])
+        b = numpy.concatenate(
+            (y.reshape(n, -1), numpy.zeros((p.shape[1], y[0].size))))
+        coeffs = numpy.linalg.lstsq(a, b, rcond=None)[0]
+        return x, coeffs, y.shape[1:]
+
+    def _predict(self, model, x):
+        centres, coeffs, shape = model
+        r = numpy.linalg.norm(centres - x, axis=-1)
+        basis = numpy.concatenate((r ** 3, [1.], x))
+        return (basis @ coeffs).reshape(shape)
+
+
+class SurrogateQuadratic(Surrogate):
+    """a quadratic surrogate fitted by least squares
+
+    :param num_dims: the number of dimensions of parameter space
+    :type num_dims: int
+    """
+
+    @property
+    def min_points(self):
+        return (self.num_dims + 1) * (self.num_dims + 2) // 2
+
+    def _features(self, x):
+        x = numpy.atleast_2d(x)
+        features = [numpy.ones(len(x))]
+        features += [x[:, i] for i in range(self.num_dims)]
+        features += [x[:, i] * x[:, j] for i, j in
+                     itertools.combinations_with_replacement(
+                         range(self.num_dims), 2)]
+        return numpy.stack(features, axis=-1)
+
+    def _fit(self, x, y):
+        coeffs = numpy.linalg.lstsq(self._features(x),
+                                    y.reshape(len(x), -1), rcond=None)[0]
+        return coeffs, y.shape[1:]
+
+    def _predict(self, model, x):
+        coeffs, shape = model
+        return (self._features(x)[0] @ coeffs).reshape(shape)
@@ -32,6 +32,9 @@ setup(
             'sphinx<4.0',
             'sphinx_rtd_theme',
         ],
+        'export': [
+            'pyarrow',
+        ],
         'lint': [
             'flake8>=3.5.0',
         ],
@@ -45,6 +48,11 @@ setup(
             'objfun-nlopt = ObjectiveFunction.optimise:main',
             'objfun-dfols = ObjectiveFunction.dfols:main',
             'objfun-example-model = ObjectiveFunction.example:main',
+            'objfun-server = ObjectiveFunction.service:main',
+            'objfun-benchmark-storage = ObjectiveFunction.storage:main',
+            'objfun-gc = ObjectiveFunction.garbage:main',
+            'objfun-export = ObjectiveFunction.export:main',
+            'objfun-multi = ObjectiveFunction.multi:main',
         ],
     },
     author=author,
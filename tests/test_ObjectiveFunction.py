@@ -14,6 +14,15 @@ class DummyObjectiveFunction(ObjectiveFunction):
     def set_result(self, params, result, scenario=None):
         raise NotImplementedError
 
+    def _read_result(self, run):
+        raise NotImplementedError
+
+    def _random_result(self):
+        raise NotImplementedError
+
+    def _write_result(self, runid, result):
+        raise NotImplementedError
+
 
 @pytest.fixture
 def rundir(tmpdir_factory):
@@ -220,6 +229,25 @@ class TestObjectiveFunction:
         o = objectiveA
         objfun("study", o.basedir, paramsA)
 
+    def test_objective_function_fingerprint(self, objfun, objectiveA,
+                                            paramsA, monkeypatch):
+        o = objectiveA
+        assert o._study.fingerprint == o._fingerprint()
+
+        def check_study(self):
+            raise AssertionError('detailed check should be skipped')
+        monkeypatch.setattr(o.__class__, '_check_study', check_study,
+                            raising=False)
+        objfun("study", o.basedir, paramsA)
+
+    def test_objective_function_fingerprint_missing(self, objfun, objectiveA,
+                                                    paramsA):
+        o = objectiveA
+        o._study.fingerprint = None
+        o.session.commit()
+        o2 = objfun("study", o.basedir, paramsA)
+        assert o2._study.fingerprint == o._fingerprint()
+
     @pytest.mark.parametrize("minv,maxv,resolution",
                              [
                                  (-6, 0, 1e-6),
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+import numpy
+
+from ObjectiveFunction import ObjectiveFunctionResidual
+from ObjectiveFunction import AsyncObjectiveFunction
+from ObjectiveFunction import NewRun, NoNewRun
+
+
+@pytest.fixture
+def rundir(tmpdir_factory):
+    res = tmpdir_factory.mktemp("of-async")
+    return res
+
+
+@pytest.fixture
+def objfun(rundir, paramsA):
+    return ObjectiveFunctionResidual("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     threadsafe=True)
+
+
+@pytest.fixture
+def points(objfun):
+    points = [objfun.values2params([a, 1., -2.])
+              for a in numpy.linspace(-1, 1, 8)]
+    for params in points:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+    return points
+
+
+def model(params):
+    return numpy.arange(10) * params['a']
+
+
+def test_not_threadsafe(rundir, paramsA):
+    objfun = ObjectiveFunctionResidual("study", rundir, paramsA)
+    with pytest.raises(RuntimeError):
+        AsyncObjectiveFunction(objfun)
+
+
+def test_async(objfun, points):
+    async def worker(aobjfun):
+        count = 0
+        while True:
+            try:
+                params = await aobjfun.get_new()
+            except NoNewRun:
+                return count
+            await asyncio.sleep(0.01)
+            await aobjfun.set_result(params, model(params))
+            count += 1
+
+    async def main():
+        async with AsyncObjectiveFunction(objfun, max_workers=4) as aobjfun:
+            waiting = [aobjfun.wait_for(p, interval=0.01) for p in points]
+            workers = [worker(aobjfun) for i in range(4)]
+            return await asyncio.gather(asyncio.gather(*waiting),
+                                        asyncio.gather(*workers))
+
+    results, counts = asyncio.run(main())
+    assert sum(counts) == len(points)
+    for params, result in zip(points, results):
+        assert result == pytest.approx(model(params), abs=1e-5)
@@ -1,10 +1,13 @@
 import pytest
 import numpy
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import inspect
 
-from ObjectiveFunction import ObjectiveFunctionMisfit
+from ObjectiveFunction import ObjectiveFunctionMisfit, SurrogateQuadratic
 from test_ObjectiveFunction import TestObjectiveFunction as TOF
-from ObjectiveFunction import LookupState
-from ObjectiveFunction import PreliminaryRun, NewRun, NoNewRun
+from ObjectiveFunction import LookupState, RunPriority
+from ObjectiveFunction import PreliminaryRun, NewRun, NoNewRun, Waiting
+from ObjectiveFunction.model import DBRun, SHARD_BITS
 
 
 @pytest.fixture
@@ -18,11 +21,453 @@ def resultA():
     return 1000.
 
 
+def quadratic(params):
+    return params['a'] ** 2 + 2 * params['b'] - params['c']
+
+
+@pytest.mark.parametrize("scheme", ['forward', 'central'])
+def test_gradient(rundir, paramsA, scheme):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", gradient=scheme)
+    x = numpy.array([0.5, 1., -2.])
+    grad = numpy.zeros(3)
+    # all perturbed parameter sets are created at once
+    with pytest.raises(NewRun):
+        objfun(x, grad)
+    with pytest.raises(Waiting):
+        objfun(x, grad)
+    while True:
+        try:
+            params = objfun.get_new()
+        except NoNewRun:
+            break
+        objfun.set_result(params, quadratic(params))
+    assert objfun(x, grad) == pytest.approx(quadratic(objfun.values2params(x)))
+    expected = [1., 2., -1.]
+    if scheme == 'forward':
+        assert grad == pytest.approx(expected, abs=1e-2)
+    else:
+        assert grad == pytest.approx(expected)
+
+
+def test_gradient_unsupported(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario")
+    with pytest.raises(RuntimeError):
+        objfun(numpy.array([0.5, 1., -2.]), numpy.zeros(3))
+
+
+def test_surrogate(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     surrogate=SurrogateQuadratic)
+    rng = numpy.random.default_rng(1)
+    lb = objfun.lower_bounds
+    ub = objfun.upper_bounds
+    for x in rng.random((12, 3)):
+        params = objfun.values2params(lb + x * (ub - lb))
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.get_new()
+        objfun.set_result(params, quadratic(params))
+    params = {'a': 0.5, 'b': 1., 'c': -2.}
+    with pytest.raises(NewRun):
+        objfun.get_result(params)
+    # the value of the pending parameter set is predicted
+    assert objfun.get_result(params) == pytest.approx(quadratic(params))
+
+
+def test_speculate(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     surrogate=SurrogateQuadratic)
+    path = [objfun.values2params([0.1 * i, 1., -2.]) for i in range(6)]
+
+    def evaluate():
+        for params in path:
+            objfun.get_result(params)
+
+    # without completed runs there are no predictions
+    with pytest.raises(NewRun):
+        evaluate()
+    assert objfun.speculate(evaluate, max_points=3) == []
+
+    rng = numpy.random.default_rng(1)
+    lb = objfun.lower_bounds
+    ub = objfun.upper_bounds
+    for x in rng.random((12, 3)):
+        params = objfun.values2params(lb + x * (ub - lb))
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.set_result(params, quadratic(params), force=True)
+
+    runids = objfun.speculate(evaluate, max_points=3)
+    assert len(runids) == 3
+    assert [objfun.getParameters(r) for r in runids] == [
+        pytest.approx(p) for p in path[1:4]]
+    with pytest.raises(LookupError):
+        objfun.state(path[4])
+    # the blocking run is handed out first
+    assert objfun.get_new() == pytest.approx(path[0])
+    for params in path[1:4]:
+        assert objfun.state(params) == LookupState.NEW
+        assert objfun.get_new() == pytest.approx(params)
+    # lookups outside speculation are not affected
+    with pytest.raises(NewRun):
+        evaluate()
+
+
+def test_runs_in_box(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False)
+    points = [[0., 1., -2.], [0.5, 1., -2.], [0.5, 1.5, -2.], [-1., 0., -5.]]
+    for x in points:
+        params = objfun.values2params(x)
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.get_new()
+        objfun.set_result(params, quadratic(params))
+    assert objfun.runs_in_box([0., 0.5, -3], [1, 1.2, -1]) == [1, 2]
+    assert objfun.runs_in_box([-2., -1., -6], [1, 1.2, -1]) == [1, 2, 4]
+    nearest = objfun.nearest_runs([0.4, 1.1, -2.], k=2)
+    assert [n[0] for n in nearest] == [2, 1]
+    assert objfun.getParameters(2) == pytest.approx(
+        objfun.values2params(points[1]))
+
+
+def test_index_update(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False)
+    other = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                    scenario="scenario", prelim=False)
+    points = [objfun.values2params([a, 1., -2.]) for a in [0., 0.5, 1.]]
+    for params in points:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+    objfun.get_new()
+    objfun.set_result(points[0], quadratic(points[0]))
+    box = ([-1., 0., -5.], [1., 2., 0.])
+    assert objfun.runs_in_box(*box) == [1]
+
+    # runs completed later are added
+    for params in points[1:]:
+        objfun.get_new()
+        objfun.set_result(params, quadratic(params))
+    assert objfun.runs_in_box(*box) == [1, 2, 3]
+
+    # runs that are no longer completed are removed
+    objfun.setState(2, LookupState.NEW)
+    assert objfun.runs_in_box(*box) == [1, 3]
+    other.setState(3, LookupState.NEW)
+    assert objfun.runs_in_box(*box) == [1]
+    assert [n[0] for n in objfun.nearest_runs([1., 1., -2.], k=1)] == [1]
+    objfun.setState(3, LookupState.COMPLETED)
+    assert objfun.runs_in_box(*box) == [1, 3]
+
+
+def test_approximate_hit(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     tolerance={'a': 2, 'b': 0, 'c': 0})
+    params = {'a': 0., 'b': 1., 'c': -2.}
+    with pytest.raises(NewRun):
+        objfun.get_result(params)
+    objfun.get_new()
+    objfun.set_result(params, 10.)
+    # within tolerance
+    near = {'a': 2e-6, 'b': 1., 'c': -2.}
+    assert objfun.get_result(near) == 10.
+    assert objfun.getApproximateHits() == [(1, near)]
+    # replayed lookups are recorded once
+    assert objfun.get_result(near) == 10.
+    other = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                    scenario="scenario",
+                                    tolerance={'a': 2, 'b': 0, 'c': 0})
+    assert other.get_result(near) == 10.
+    assert objfun.getApproximateHits() == [(1, near)]
+    with pytest.raises(LookupError):
+        objfun.state(near)
+    # outside tolerance
+    for far in [{'a': 3e-6, 'b': 1., 'c': -2.},
+                {'a': 0., 'b': 1. + 1e-7, 'c': -2.}]:
+        with pytest.raises(NewRun):
+            objfun.get_result(far)
+    assert len(objfun.getApproximateHits()) == 1
+
+
+def test_enqueue_duplicates(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False)
+    points = [{'a': 0., 'b': 1., 'c': -2.},
+              {'a': 0.5, 'b': 1., 'c': -2.},
+              {'a': 0., 'b': 1., 'c': -2.},
+              # identical at the resolution of the parameters
+              {'a': 0.5, 'b': 1. + 1e-9, 'c': -2.}]
+    assert objfun.enqueue(points) == [1, 2, 1, 2]
+    assert objfun.enqueue(points[2:] + points[2:]) == [1, 2, 1, 2]
+    objfun.get_new()
+    objfun.get_new()
+    with pytest.raises(NoNewRun):
+        objfun.get_new()
+
+
+def test_priority(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False)
+    points = [objfun.values2params([a, 1., -2.])
+              for a in numpy.linspace(-1, 1, 5)]
+    runs = objfun.enqueue(points[:3])
+    assert objfun.enqueue(points[1:4], priority=RunPriority.SPECULATIVE) \
+        == runs[1:] + [4]
+    # lookups are blocking
+    with pytest.raises(NewRun):
+        objfun.get_result(points[4])
+    # a lookup promotes a new parameter set
+    objfun.get_result(points[2])
+
+    order = [points[2], points[4], points[1], points[3], points[0]]
+    for params in order:
+        assert objfun.get_new() == pytest.approx(params)
+    with pytest.raises(NoNewRun):
+        objfun.get_new()
+
+
+def test_cost_schedule(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     schedule='shortest')
+    for a in [-1., 0., 1.]:
+        params = objfun.values2params([a, 1., -2.])
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.get_new()
+        objfun.set_result(params, quadratic(params),
+                          walltime=10 * (a + 1) + 1, cputime=1.)
+    assert objfun.predict_cost(objfun.values2params([0., 1., -2.])) == 11.
+
+    points = [objfun.values2params([a, 1., -2.]) for a in [0.9, -0.9, 0.1]]
+    objfun.enqueue(points)
+    for i in [1, 2, 0]:
+        assert objfun.get_new() == pytest.approx(points[i])
+
+    points = [objfun.values2params([a, 1., -2.]) for a in [0.8, -0.8]]
+    objfun.enqueue(points)
+    assert objfun.get_batch(10.) == [pytest.approx(points[1])]
+    # at least one parameter set is returned
+    assert objfun.get_batch(1.) == [pytest.approx(points[0])]
+    with pytest.raises(NoNewRun):
+        objfun.get_batch(10.)
+
+
+def test_batch_without_costs(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False)
+    points = [objfun.values2params([a, 1., -2.])
+              for a in numpy.linspace(-1, 1, 5)]
+    objfun.enqueue(points)
+    # without recorded wall times a run is assumed to fill the allocation
+    assert objfun.get_batch(100.) == [pytest.approx(points[0])]
+    assert objfun.get_batch(100., default_cost=40.) == [
+        pytest.approx(p) for p in points[1:3]]
+    for params in points[:3]:
+        assert objfun.state(params) == LookupState.ACTIVE
+    for params in points[3:]:
+        assert objfun.state(params) == LookupState.NEW
+
+
+def test_iter_runs(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False)
+    assert list(objfun.iter_runs()) == []
+    points = [objfun.values2params([a, 1., -2.])
+              for a in numpy.linspace(-1, 1, 5)]
+    objfun.enqueue(points)
+    objfun.get_new()
+    objfun.set_result(points[0], quadratic(points[0]))
+
+    records = list(objfun.iter_runs(chunk=2))
+    assert [r.id for r in records] == [1, 2, 3, 4, 5]
+    for r, params in zip(records, points):
+        assert r.values == pytest.approx(objfun.params2values(params),
+                                         abs=1e-6)
+    assert records[0].state == LookupState.COMPLETED
+    assert records[0].result == pytest.approx(quadratic(points[0]))
+    assert records[1].result is None
+
+    records = list(objfun.iter_runs(state=LookupState.NEW, chunk=3))
+    assert [r.id for r in records] == [2, 3, 4, 5]
+
+    # pending changes of the session are not committed
+    run = objfun._getRun(points[1])
+    run.state = LookupState.CANCELLED
+    objfun.session.flush()
+    assert len(list(objfun.iter_runs(chunk=2))) == 5
+    objfun.session.rollback()
+    assert objfun.state(points[1]) == LookupState.NEW
+
+
+def test_expire_on_commit(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     expire_on_commit=False)
+    other = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                    scenario="scenario", prelim=False)
+    study = objfun._study
+    scenario = objfun._scenario
+    for a in [-1., 0., 1.]:
+        params = objfun.values2params([a, 1., -2.])
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        # the state changed by another process is seen
+        other.get_new()
+        assert objfun.state(params) == LookupState.ACTIVE
+        other.set_result(params, quadratic(params))
+        assert objfun.get_result(params) == quadratic(params)
+    # neither the study nor the scenario are reloaded
+    assert objfun._study is study
+    assert objfun._scenario is scenario
+    assert objfun.getScenario("scenario") is scenario
+    assert not inspect(study).expired_attributes
+    assert not inspect(scenario).expired_attributes
+
+    objfun.setStartPoints([params])
+    other.setStartPoints([params, params])
+    assert len(objfun.getStartPoints()) == 2
+    objfun.setStartPoints([params])
+    assert len(other.getStartPoints()) == 1
+    objfun.close()
+    assert objfun.get_result(params) == quadratic(params)
+
+
+def test_readonly(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False)
+    points = [objfun.values2params([a, 1., -2.]) for a in [-1., 0., 1.]]
+    for params in points[:2]:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+    objfun.get_new()
+    objfun.set_result(points[0], quadratic(points[0]))
+
+    with pytest.raises(LookupError):
+        ObjectiveFunctionMisfit.open_readonly("other", rundir, paramsA)
+    with pytest.raises(LookupError):
+        ObjectiveFunctionMisfit.open_readonly("study", rundir, paramsA,
+                                              scenario="other")
+    with pytest.raises(ValueError):
+        ObjectiveFunctionMisfit("study", rundir, paramsA, cache_table=True)
+
+    mtime = (rundir / 'objective_function.sqlite').stat().mtime
+    reader = ObjectiveFunctionMisfit.open_readonly("study", rundir, paramsA,
+                                                   scenario="scenario")
+    assert reader.readonly
+    assert reader.get_result(points[0]) == quadratic(points[0])
+    assert reader.state(points[1]) == LookupState.NEW
+    # lookups never create entries
+    with pytest.raises(LookupError):
+        reader.get_result(points[2])
+    with pytest.raises(RuntimeError):
+        reader.setState(reader.getRunID(points[1]), LookupState.ACTIVE)
+    reader.session.rollback()
+    with pytest.raises(RuntimeError):
+        reader.cancel()
+    reader.session.rollback()
+    assert (rundir / 'objective_function.sqlite').stat().mtime == mtime
+
+    # the lookup table is kept in memory until it is refreshed
+    with pytest.raises(NewRun):
+        objfun.get_result(points[2])
+    with pytest.raises(LookupError):
+        reader.state(points[2])
+    reader.refresh()
+    assert reader.state(points[2]) == LookupState.NEW
+
+
+def test_threadsafe(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     threadsafe=True)
+    points = [objfun.values2params([a, 1., -2.])
+              for a in numpy.linspace(-1, 1, 20)]
+    for params in points:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+
+    def work(n):
+        claimed = []
+        while True:
+            try:
+                params = objfun.get_new()
+            except NoNewRun:
+                objfun.close()
+                return claimed
+            objfun.set_result(params, quadratic(params))
+            claimed.append(params['a'])
+
+    with ThreadPoolExecutor(4) as pool:
+        claimed = sum(pool.map(work, range(4)), [])
+    # each parameter set was computed exactly once
+    assert sorted(claimed) == pytest.approx([p['a'] for p in points],
+                                            abs=1e-6)
+    for params in points:
+        assert objfun.get_result(params) == pytest.approx(quadratic(params))
+
+
+def test_sharded(rundir, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="other", prelim=False,
+                                     sharded=True)
+    objfun.setDefaultScenario("scenario")
+    assert objfun.sharded
+    params = objfun.values2params([0., 1., -2.])
+    runids = {}
+    for scenario in ["scenario", "other"]:
+        with pytest.raises(NewRun):
+            objfun.get_result(params, scenario=scenario)
+        runids[scenario] = objfun.get_new(scenario=scenario,
+                                          with_id=True)[0]
+        sid = objfun.getScenario(scenario).id
+        assert runids[scenario] >> SHARD_BITS == sid
+        assert (rundir / f'objective_function_scenario{sid}.sqlite').exists()
+    # runs are found by their ID whatever the selected scenario
+    assert objfun.getState(runids["other"]) == LookupState.ACTIVE
+    objfun.set_result(params, 1.)
+    assert objfun.getState(runids["scenario"]) == LookupState.COMPLETED
+    assert objfun.getState(runids["other"]) == LookupState.ACTIVE
+    assert objfun.get_result(params) == 1.
+
+    # a transaction of one shard does not block the other shard
+    writer = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                     scenario="other", sharded=True)
+    writer.setState(runids["other"], LookupState.CONFIGURED)
+    writer.session.query(DBRun).filter_by(
+        id=runids["other"]).update({'state': LookupState.ACTIVE})
+    objfun.set_result(params, 2., scenario="scenario", force=True)
+    writer.session.commit()
+    objfun.set_results([runids["other"]], [3.])
+    assert objfun.get_result(params, scenario="other") == 3.
+
+    # the runs are not stored in the database itself
+    plain = ObjectiveFunctionMisfit("study", rundir, paramsA,
+                                    scenario="scenario")
+    with pytest.raises(LookupError):
+        plain.getState(runids["scenario"])
+
+    reader = ObjectiveFunctionMisfit.open_readonly(
+        "study", rundir, paramsA, scenario="scenario", sharded=True)
+    assert reader.get_result(params) == 2.
+    assert reader.get_result(params, scenario="other") == 3.
+
+
 class TestObjectiveFunctionMisfit(TOF):
     @pytest.fixture
     def objfun(self):
         return ObjectiveFunctionMisfit
 
+    @pytest.fixture
+    def first_runid(self):
+        return 1
+
     @pytest.fixture
     def objectiveAvA(self, objectiveA, valuesA):
         o = objectiveA
@@ -69,6 +514,37 @@ class TestObjectiveFunctionMisfit(TOF):
         with pytest.raises(RuntimeError):
             objectiveA.set_result(valuesA, resultA)
 
+    def test_lookup_slots(self, objectiveA, valuesA, valuesB):
+        if objectiveA.prelim:
+            state, exc = LookupState.PROVISIONAL, PreliminaryRun
+        else:
+            state, exc = LookupState.NEW, NewRun
+        # each slot holds its own provisional parameter set
+        objectiveA.slot = 0
+        with pytest.raises(exc):
+            objectiveA.get_result(valuesA)
+        objectiveA.slot = 1
+        with pytest.raises(exc):
+            objectiveA.get_result(valuesB)
+        assert objectiveA.state(valuesA) == state
+        assert objectiveA.state(valuesB) == state
+        # the parameter set of another slot is shared
+        objectiveA.slot = 0
+        if objectiveA.prelim:
+            with pytest.raises(NewRun):
+                objectiveA.get_result(valuesB)
+        else:
+            objectiveA.get_result(valuesB)
+        assert objectiveA.state(valuesA) == state
+        assert objectiveA.state(valuesB) == LookupState.NEW
+
+    def test_start_points(self, objectiveA, valuesA, valuesB):
+        assert objectiveA.getStartPoints() == []
+        objectiveA.setStartPoints([valuesA, valuesB])
+        assert objectiveA.getStartPoints() == [valuesA, valuesB]
+        objectiveA.setStartPoints([valuesB])
+        assert objectiveA.getStartPoints() == [valuesB]
+
     def test_get_setState(self, objectiveAvA):
         rid, p = objectiveAvA.get_with_state(LookupState.NEW, with_id=True,
                                              new_state=LookupState.CONFIGURING)
@@ -96,10 +572,11 @@ class TestObjectiveFunctionMisfit(TOF):
         with pytest.raises(NoNewRun):
             objectiveAvA.get_new()
 
-    def test_get_with_state_with_id(self, objectiveAvA, valuesA):
+    def test_get_with_state_with_id(self, objectiveAvA, valuesA,
+                                    first_runid):
         rid, p = objectiveAvA.get_with_state(LookupState.NEW, with_id=True,
                                              new_state=LookupState.CONFIGURING)
-        assert rid == 1
+        assert rid == first_runid
         assert p == valuesA
         # the state should be configuring now
         assert objectiveAvA.state(valuesA) == LookupState.CONFIGURING
@@ -107,9 +584,9 @@ class TestObjectiveFunctionMisfit(TOF):
         with pytest.raises(LookupError):
             objectiveAvA.get_with_state(LookupState.NEW)
 
-    def test_get_new_with_id(self, objectiveAvA, valuesA):
+    def test_get_new_with_id(self, objectiveAvA, valuesA, first_runid):
         rid, p = objectiveAvA.get_new(with_id=True)
-        assert rid == 1
+        assert rid == first_runid
         assert p == valuesA
         # the state should be new now
         assert objectiveAvA.state(valuesA) == LookupState.ACTIVE
@@ -137,6 +614,70 @@ class TestObjectiveFunctionMisfit(TOF):
         with pytest.raises(RuntimeError):
             objectiveAvA.set_result(valuesA, resultA)
 
+    def test_set_results(self, objectiveAvA, valuesA, valuesB, resultA):
+        for i in range(2):
+            try:
+                objectiveAvA.get_result(valuesB)
+            except (PreliminaryRun, NewRun):
+                pass
+        runB = objectiveAvA.getRunID(valuesB)
+        objectiveAvA.get_new()
+        # nothing is stored if any run is in the wrong state
+        with pytest.raises(RuntimeError):
+            objectiveAvA.set_results([valuesA, runB], [resultA, resultA])
+        assert objectiveAvA.state(valuesA) == LookupState.ACTIVE
+        with pytest.raises(LookupError):
+            objectiveAvA.set_results([valuesA, {'a': 0.1, 'b': 1, 'c': -2}],
+                                     [resultA, resultA])
+        objectiveAvA.get_new()
+        objectiveAvA.set_results([valuesA, runB], [resultA, resultA])
+        assert objectiveAvA.state(valuesA) == LookupState.COMPLETED
+        assert objectiveAvA.getState(runB) == LookupState.COMPLETED
+
+    def test_cancel(self, objectiveAvA, valuesA, valuesB, resultA):
+        for i in range(2):
+            try:
+                objectiveAvA.get_result(valuesB)
+            except (PreliminaryRun, NewRun):
+                pass
+        runA = objectiveAvA.getRunID(valuesA)
+        runB = objectiveAvA.getRunID(valuesB)
+        assert objectiveAvA.cancel(keep=[valuesA]) == 1
+        assert objectiveAvA.is_cancelled(runB)
+        assert not objectiveAvA.is_cancelled(runA)
+        # only runs outside the box are cancelled
+        assert objectiveAvA.cancel(lb={'a': -0.1}, ub={'a': 0.1}) == 0
+        # active runs are only cancelled when requested
+        objectiveAvA.get_new()
+        assert objectiveAvA.cancel() == 0
+        assert objectiveAvA.cancel(active=True) == 1
+        with pytest.raises(RuntimeError):
+            objectiveAvA.set_result(valuesA, resultA)
+        # a lookup revives a cancelled run
+        with pytest.raises(NewRun):
+            objectiveAvA.get_result(valuesB)
+        assert objectiveAvA.getState(runB) == LookupState.NEW
+
+    def test_cancel_slots(self, objectiveAvA, valuesA, valuesB):
+        objectiveAvA.slot = 1
+        for i in range(2):
+            try:
+                objectiveAvA.get_result(valuesB)
+            except (PreliminaryRun, NewRun):
+                pass
+        runA = objectiveAvA.getRunID(valuesA)
+        runB = objectiveAvA.getRunID(valuesB)
+        # only the runs of the slot of the caller are cancelled
+        assert objectiveAvA.cancel() == 1
+        assert objectiveAvA.is_cancelled(runB)
+        assert not objectiveAvA.is_cancelled(runA)
+        objectiveAvA.slot = 0
+        with pytest.raises(NewRun):
+            objectiveAvA.get_result(valuesB)
+        objectiveAvA.slot = 1
+        assert objectiveAvA.cancel(all_slots=True) == 2
+        assert objectiveAvA.is_cancelled(runA)
+
     def test_call(self, objectiveAvA, valuesA, resultA):
         objectiveAvA.get_new()
         objectiveAvA.set_result(valuesA, resultA)
@@ -174,3 +715,22 @@ class TestObjectiveFunctionMisfitPrelim(TestObjectiveFunctionMisfit):
         # parameter set is in wrong state ('n')
         with pytest.raises(RuntimeError):
             objectiveA.set_result(valuesA, resultA)
+
+
+class TestObjectiveFunctionMisfitNoExpire(TestObjectiveFunctionMisfit):
+    @pytest.fixture
+    def objectiveA(self, objfun, rundir, paramsA):
+        return objfun("study", rundir, paramsA,
+                      scenario="scenario", expire_on_commit=False)
+
+
+class TestObjectiveFunctionMisfitSharded(TestObjectiveFunctionMisfit):
+    @pytest.fixture
+    def objectiveA(self, objfun, rundir, paramsA):
+        return objfun("study", rundir, paramsA,
+                      scenario="scenario", sharded=True)
+
+    @pytest.fixture
+    def first_runid(self):
+        # the IDs of the runs of the first scenario
+        return (1 << SHARD_BITS) + 1
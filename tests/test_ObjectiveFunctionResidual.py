@@ -1,7 +1,13 @@
+import gc
+import os
+import weakref
 import pytest
 import numpy
+from functools import partial
+from sqlalchemy import inspect
 
 from ObjectiveFunction import ObjectiveFunctionResidual
+from ObjectiveFunction.objective_function import _flush_at_exit
 from test_ObjectiveFunctionMisfit import TestObjectiveFunctionMisfit as TOFM
 from ObjectiveFunction import LookupState
 from ObjectiveFunction import PreliminaryRun, NewRun
@@ -105,3 +111,129 @@ class TestObjectiveFunctionResidualPrelim(TestObjectiveFunctionResidual):
         # parameter set is in wrong state ('n')
         with pytest.raises(RuntimeError):
             objectiveA.set_result(valuesA, resultA)
+
+
+def test_buffered(tmp_path, paramsA, resultA):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False,
+                                       buffered=True, batch_size=3)
+    points = [objfun.values2params([a, 1., -2.])
+              for a in numpy.linspace(-1, 1, 4)]
+    for params in points:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.get_new()
+
+    # results are queued
+    for params in points[:2]:
+        objfun.set_result(params, resultA * params['a'])
+        assert objfun.state(params) == LookupState.ACTIVE
+    assert len(list(tmp_path.glob('residuals_*.npy'))) == 0
+    with pytest.raises(RuntimeError):
+        objfun.set_result(points[0], resultA)
+
+    # the queue is flushed when the batch is full
+    objfun.set_result(points[2], resultA * points[2]['a'])
+    for params in points[:3]:
+        assert objfun.state(params) == LookupState.COMPLETED
+        assert objfun.get_result(params) == pytest.approx(
+            resultA * params['a'])
+
+    objfun.set_result(points[3], resultA)
+    assert objfun.state(points[3]) == LookupState.ACTIVE
+    objfun.flush()
+    assert objfun.state(points[3]) == LookupState.COMPLETED
+    assert len(list(tmp_path.glob('residuals_*.npy'))) == 4
+    assert len(list(tmp_path.glob('.residuals_*'))) == 0
+
+
+def test_buffered_release(tmp_path, paramsA):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", buffered=True)
+    ref = weakref.ref(objfun)
+    objfun.close()
+    del objfun
+    gc.collect()
+    # flushing at exit does not keep the objective function alive
+    assert ref() is None
+
+
+def test_buffered_unreferenced(tmp_path, paramsA, resultA):
+    def produce():
+        objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                           scenario="scenario", prelim=False,
+                                           buffered=True)
+        params = objfun.values2params([0., 1., -2.])
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.get_new()
+        objfun.set_result(params, resultA)
+        return params
+
+    params = produce()
+    gc.collect()
+    # the objective function with queued results is kept alive until they
+    # are flushed at exit
+    _flush_at_exit()
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario")
+    assert objfun.state(params) == LookupState.COMPLETED
+    assert objfun.get_result(params) == pytest.approx(resultA)
+
+
+@pytest.mark.parametrize("buffered,durable,synced",
+                         [(False, None, False), (False, True, True),
+                          (True, None, True), (True, False, False)])
+def test_durable(tmp_path, paramsA, resultA, monkeypatch, buffered, durable,
+                 synced):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False,
+                                       buffered=buffered, durable=durable)
+    assert objfun.durable == synced
+    params = objfun.values2params([0., 1., -2.])
+    with pytest.raises(NewRun):
+        objfun.get_result(params)
+    objfun.get_new()
+
+    fds = []
+    fsync = os.fsync
+
+    def counting_fsync(fd):
+        fds.append(fd)
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', counting_fsync)
+    objfun.set_result(params, resultA)
+    objfun.flush()
+    assert objfun.get_result(params) == pytest.approx(resultA)
+    # the file and the base directory are only synchronised when durable
+    assert len(fds) == (2 if synced else 0)
+
+
+class TestObjectiveFunctionResidualInline(TestObjectiveFunctionResidual):
+    @pytest.fixture
+    def objfun(self):
+        return partial(ObjectiveFunctionResidual, inline=True)
+
+
+def test_inline(tmp_path, paramsA, resultA):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False,
+                                       inline=True)
+    params = objfun.values2params([0., 1., -2.])
+    with pytest.raises(NewRun):
+        objfun.get_result(params)
+    objfun.get_new()
+    objfun.set_result(params, resultA)
+    assert len(list(tmp_path.glob('residuals_*'))) == 0
+
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", inline=True)
+    # the result is only loaded when requested
+    run = objfun._getRun(params)
+    assert run.path is None
+    assert 'data' in inspect(run.blob).unloaded
+    objfun.close()
+    run = objfun._getRun(params, with_result=True)
+    assert 'data' not in inspect(run.blob).unloaded
+    assert objfun.get_result(params) == pytest.approx(resultA)
@@ -3,6 +3,7 @@ import pandas
 import numpy
 
 from ObjectiveFunction import ObjectiveFunctionSimObs
+from ObjectiveFunction import ObjectiveFunctionResidual
 from ObjectiveFunction import LookupState
 from ObjectiveFunction import NewRun
 
@@ -52,6 +53,36 @@ class TestObjectiveFunctionSimObs(TOFR):
             ObjectiveFunctionSimObs("study", o.basedir, paramsA,
                                     ['A', 'B', 'C', 'wrong'])
 
+    def test_objective_function_fingerprint_class(self, objectiveA, paramsA,
+                                                  obsnames):
+        o = objectiveA
+        fingerprint = o._study.fingerprint
+        # opening the study with another class keeps its fingerprint
+        other = ObjectiveFunctionResidual("study", o.basedir, paramsA)
+        assert other._study.fingerprint == fingerprint
+        o2 = ObjectiveFunctionSimObs("study", o.basedir, paramsA, obsnames)
+        assert o2._study.fingerprint == fingerprint
+
+    def test_objective_function_class_fingerprint(self, objectiveA, paramsA,
+                                                  obsnames, monkeypatch):
+        o = objectiveA
+        assert o._study.class_fingerprint == o._class_fingerprint()
+
+        def check_class(self):
+            raise AssertionError('detailed check should be skipped')
+        monkeypatch.setattr(ObjectiveFunctionSimObs, '_check_class',
+                            check_class)
+        ObjectiveFunctionSimObs("study", o.basedir, paramsA,
+                                list(reversed(obsnames)))
+
+    def test_objective_function_class_fingerprint_missing(
+            self, objectiveA, paramsA, obsnames):
+        o = objectiveA
+        o._study.class_fingerprint = None
+        o.session.commit()
+        o2 = ObjectiveFunctionSimObs("study", o.basedir, paramsA, obsnames)
+        assert o2._study.class_fingerprint == o._class_fingerprint()
+
     def test_num_residuals(self, objectiveA, obsnames):
         assert objectiveA.num_residuals == len(obsnames)
 
@@ -116,3 +147,12 @@ class TestObjectiveFunctionSimObsPrelim(TestObjectiveFunctionSimObs):
         # parameter set is in wrong state ('n')
         with pytest.raises(RuntimeError):
             objectiveA.set_result(valuesA, resultA)
+
+
+class TestObjectiveFunctionSimObsInline(TestObjectiveFunctionSimObs):
+    @pytest.fixture
+    def objfun(self, obsnames):
+        def wrapper(*args, **kwds):
+            return ObjectiveFunctionSimObs(*args, obsnames, inline=True,
+                                           **kwds)
+        return wrapper
@@ -0,0 +1,97 @@
+import pytest
+from pathlib import Path
+
+from ObjectiveFunction import ObjFunConfig, ParameterFloat
+
+CONFIG = """
+[setup]
+study = study
+scenario = scenario
+basedir = $OBJFUN_TEST_DIR
+objfun = simobs
+[parameters]
+[[float_parameters]]
+[[[a]]]
+value = 0.5
+min = 0
+max = 1
+[targets]
+obsA = 1.5
+obsB = 2.5
+"""
+
+
+@pytest.fixture
+def cfgname(tmp_path, monkeypatch):
+    monkeypatch.setenv('OBJFUN_TEST_DIR', str(tmp_path))
+    monkeypatch.delenv('OBJFUN_CONFIG_CACHE', raising=False)
+    cfgname = tmp_path / 'objfun.cfg'
+    cfgname.write_text(CONFIG)
+    return cfgname
+
+
+def test_config(cfgname, tmp_path):
+    cfg = ObjFunConfig(cfgname)
+    assert cfg.study == 'study'
+    assert cfg.basedir == tmp_path
+    assert cfg.parameters == {'a': ParameterFloat(0.5, 0, 1)}
+    assert list(cfg.targets.index) == ['obsA', 'obsB']
+    assert cfg.startValues == [{'a': 0.5}]
+    assert not cfg.storage.compact
+
+
+def test_config_cache(cfgname, tmp_path):
+    cache = tmp_path / 'cache'
+    cfg = ObjFunConfig(cfgname, cache=cache)
+    assert len(list(cache.glob('*.json'))) == 1
+    cached = ObjFunConfig(cfgname, cache=cache)
+    assert type(cached.cfg) is type(cfg.cfg)
+    assert cached.cfg == cfg.cfg
+    assert cached.parameters == cfg.parameters
+    assert cached.values == cfg.values
+    assert cached.targets.equals(cfg.targets)
+
+
+def test_config_cache_version(cfgname, tmp_path, monkeypatch):
+    cache = tmp_path / 'cache'
+    ObjFunConfig(cfgname, cache=cache)
+    # a new version of the package does not use old cache entries
+    monkeypatch.setattr('ObjectiveFunction.config.__version__', '0.0.0')
+    ObjFunConfig(cfgname, cache=cache)
+    assert len(list(cache.glob('*.json'))) == 2
+
+
+def test_config_cache_malformed(cfgname, tmp_path):
+    cache = tmp_path / 'cache'
+    ObjFunConfig(cfgname, cache=cache)
+    cacheName, = cache.glob('*.json')
+    cacheName.write_text('{"setup": []}')
+    cfg = ObjFunConfig(cfgname, cache=cache)
+    assert cfg.study == 'study'
+
+
+def test_config_cache_env(cfgname, tmp_path, monkeypatch):
+    cache = tmp_path / 'cache'
+    monkeypatch.setenv('OBJFUN_CONFIG_CACHE', str(cache))
+    ObjFunConfig(cfgname)
+    # a change of the environment changes the key
+    monkeypatch.setenv('OBJFUN_TEST_DIR', str(tmp_path / 'other'))
+    cfg = ObjFunConfig(cfgname)
+    assert len(list(cache.glob('*.json'))) == 2
+    assert cfg.cfg['setup']['basedir'] == str(tmp_path / 'other')
+
+
+def test_config_missing():
+    with pytest.raises(RuntimeError):
+        ObjFunConfig(Path('no_such_file.cfg'))
+
+
+def test_start_points(cfgname):
+    cfg = ObjFunConfig(cfgname)
+    objfun = cfg.objectiveFunction
+    objfun.createScenario('other')
+    objfun.setStartPoints([{'a': 0.25}], scenario='other')
+    assert cfg.getStartPoints('other') == [{'a': 0.25}]
+    # the start points of the configuration are stored with the scenario
+    assert cfg.startPoints == [{'a': 0.5}]
+    assert objfun.getStartPoints() == [{'a': 0.5}]
@@ -0,0 +1,102 @@
+import pytest
+import numpy
+import pandas
+
+from ObjectiveFunction import ObjectiveFunctionMisfit
+from ObjectiveFunction import ObjectiveFunctionResidual
+from ObjectiveFunction import ObjectiveFunctionSimObs
+from ObjectiveFunction import NewRun
+
+pytest.importorskip('pyarrow')
+from ObjectiveFunction.export import export, read_export  # noqa: E402
+
+
+def populate(objfun, result):
+    points = [objfun.values2params([a, 1., -2.])
+              for a in numpy.linspace(-1, 1, 7)]
+    for params in points:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+    # leave the last parameter set incomplete
+    for params in points[:-1]:
+        objfun.get_new()
+        objfun.set_result(params, result(params), walltime=2.)
+    return points
+
+
+@pytest.mark.parametrize("fmt", ['arrow', 'parquet'])
+def test_export_misfit(tmp_path, paramsA, fmt):
+    objfun = ObjectiveFunctionMisfit("study", tmp_path, paramsA,
+                                     scenario="scenario", prelim=False)
+    points = populate(objfun, lambda p: p['a'] ** 2)
+    fname = tmp_path / f'study.{fmt}'
+    assert export(objfun, fname, chunk_size=3) == len(points)
+
+    data, arrays, metadata = read_export(fname)
+    assert arrays == {}
+    assert metadata['result'] == 'misfit'
+    assert list(data.runid) == list(range(1, len(points) + 1))
+    assert list(data.scenario.unique()) == ['scenario']
+    for p in paramsA:
+        assert data[p].values == pytest.approx([x[p] for x in points],
+                                               abs=1e-6)
+    assert list(data.state) == ['COMPLETED'] * 6 + ['NEW']
+    assert data.misfit.values[:-1] == pytest.approx(
+        [x['a'] ** 2 for x in points[:-1]], abs=1e-5)
+    assert numpy.isnan(data.misfit.values[-1])
+    assert data.walltime.values[0] == 2.
+
+
+def test_export_batches(tmp_path, paramsA, monkeypatch):
+    monkeypatch.setattr('ObjectiveFunction.export.IN_BATCH', 2)
+    objfun = ObjectiveFunctionMisfit("study", tmp_path, paramsA,
+                                     scenario="scenario", prelim=False)
+    points = populate(objfun, lambda p: p['a'] ** 2)
+    fname = tmp_path / 'study.arrow'
+    # the chunks are larger than the batches of IDs
+    export(objfun, fname, chunk_size=5)
+    data, arrays, metadata = read_export(fname)
+    assert list(data.runid) == list(range(1, len(points) + 1))
+    for p in paramsA:
+        assert data[p].values == pytest.approx([x[p] for x in points],
+                                               abs=1e-6)
+
+
+def test_export_residual(tmp_path, paramsA):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False)
+    points = populate(objfun, lambda p: numpy.arange(5) * p['a'])
+    fname = tmp_path / 'study.arrow'
+    export(objfun, fname, chunk_size=4)
+
+    data, arrays, metadata = read_export(fname)
+    residuals = arrays['residuals']
+    assert residuals.shape == (len(points), 5)
+    for x, r in zip(points[:-1], residuals):
+        assert r == pytest.approx(numpy.arange(5) * x['a'], abs=1e-5)
+    assert numpy.all(numpy.isnan(residuals[-1]))
+
+    # the arrays of the batches are not copied
+    data, arrays, metadata = read_export(fname, concatenate=False)
+    chunks = arrays['residuals']
+    assert [len(c) for c in chunks] == [4, 3]
+    assert not any(c.flags.owndata for c in chunks)
+    assert numpy.concatenate(chunks) == pytest.approx(residuals,
+                                                      nan_ok=True)
+
+
+def test_export_simobs(tmp_path, paramsA):
+    obsnames = ['obsA', 'obsB', 'obsC']
+    objfun = ObjectiveFunctionSimObs("study", tmp_path, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     observationNames=obsnames)
+    populate(objfun, lambda p: pandas.Series([1., 2., p['a']],
+                                             index=obsnames))
+    fname = tmp_path / 'study.arrow'
+    export(objfun, fname, scenario="scenario")
+
+    data, arrays, metadata = read_export(fname)
+    assert metadata['observationNames'] == obsnames
+    assert arrays['simobs'][0] == pytest.approx([1., 2., -1.])
+    # the arrays of a single chunk are not copied
+    assert not arrays['simobs'].flags.owndata
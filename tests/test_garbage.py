@@ -0,0 +1,94 @@
+import os
+import pytest
+import numpy
+
+from ObjectiveFunction import ObjectiveFunctionResidual, ResultStorage
+from ObjectiveFunction import LookupState, NewRun
+from ObjectiveFunction.garbage import collect_garbage, enforce_quota
+
+
+@pytest.fixture
+def objfun(tmp_path, paramsA):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False)
+    for a in numpy.linspace(-1, 1, 5):
+        params = objfun.values2params([a, 1., -2.])
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.get_new()
+        objfun.set_result(params, numpy.linspace(0, 1, 1000) * a)
+    return objfun
+
+
+def test_collect_garbage(objfun, tmp_path):
+    # a forced result replaces the previous file
+    objfun._storage = ResultStorage(compression='zlib')
+    params = objfun.values2params([0., 1., -2.])
+    objfun.set_result(params, numpy.ones(1000), force=True)
+    assert len(list(tmp_path.glob('residuals_*'))) == 5
+
+    orphan = tmp_path / 'residuals_99.npy'
+    orphan.write_bytes(b'orphan')
+    # a result that is being stored is not referenced yet
+    storing = tmp_path / 'residuals_96.npy'
+    storing.write_bytes(b'storing')
+    temporary = tmp_path / '.residuals_98.npy.x1y2'
+    temporary.write_bytes(b'temporary')
+    recent = tmp_path / '.residuals_97.npy.x1y2'
+    recent.write_bytes(b'recent')
+    os.utime(orphan, (0, 0))
+    os.utime(temporary, (0, 0))
+    missing = objfun.getRunID(objfun.values2params([1., 1., -2.]))
+    os.unlink(objfun._query_runs().filter_by(id=missing).one().path)
+
+    stats = collect_garbage(objfun, dry_run=True, requeue=True)
+    assert stats['orphans'] == [str(orphan)]
+    assert stats['temporary'] == [str(temporary)]
+    assert stats['missing'] == [missing]
+    assert stats['freed'] == len(b'orphan') + len(b'temporary')
+    assert orphan.exists()
+    assert objfun.getState(missing) == LookupState.COMPLETED
+
+    collect_garbage(objfun, requeue=True)
+    assert not orphan.exists()
+    assert not temporary.exists()
+    assert recent.exists()
+    assert storing.exists()
+    storing.unlink()
+    assert len(list(tmp_path.glob('residuals_*'))) == 4
+    assert objfun.getState(missing) == LookupState.NEW
+    assert objfun.get_result(params) == pytest.approx(numpy.ones(1000))
+
+
+def test_enforce_quota(objfun, tmp_path):
+    usage = sum(f.stat().st_size for f in tmp_path.glob('residuals_*'))
+    centre = objfun.values2params([-1., 1., -2.])
+    assert enforce_quota(objfun, usage, centre=centre) == []
+
+    evicted = enforce_quota(objfun, usage - 1, centre=centre, dry_run=True)
+    assert [e[0] for e in evicted] == [5]
+    assert len(list(tmp_path.glob('residuals_*.npc'))) == 0
+
+    # the results furthest from the centre are compacted first
+    evicted = enforce_quota(objfun, usage - 10000, centre=centre)
+    assert [e[0] for e in evicted] == [5, 4]
+    assert len(list(tmp_path.glob('residuals_*.npc'))) == 2
+    assert len(list(tmp_path.glob('residuals_*.npy'))) == 3
+    for a in numpy.linspace(-1, 1, 5):
+        params = objfun.values2params([a, 1., -2.])
+        assert objfun.get_result(params) == pytest.approx(
+            numpy.linspace(0, 1, 1000) * a, abs=1e-6)
+
+    # by default the centre is the run with the smallest residuals and
+    # results are moved to the archive
+    archive = tmp_path / 'archive'
+    evicted = enforce_quota(objfun, 0, archive=archive)
+    evicted = [e[0] for e in evicted]
+    assert set(evicted[:2]) == {1, 5}
+    assert set(evicted[2:4]) == {2, 4}
+    assert evicted[4] == 3
+    assert len(list(tmp_path.glob('residuals_*'))) == 0
+    assert len(list(archive.glob('residuals_*'))) == 5
+    params = objfun.values2params([1., 1., -2.])
+    assert objfun.get_result(params) == pytest.approx(
+        numpy.linspace(0, 1, 1000), abs=1e-6)
@@ -0,0 +1,101 @@
+import threading
+import pytest
+import numpy
+
+from ObjectiveFunction import ObjectiveFunctionMisfit
+from ObjectiveFunction import LookupState, NewRun
+from ObjectiveFunction.multi import combine_status, run_scenarios
+
+
+def quadratic(params):
+    return sum(v ** 2 for v in params.values())
+
+
+@pytest.fixture(params=[False, True])
+def objfun(tmp_path, paramsA, request):
+    objfun = ObjectiveFunctionMisfit("study", tmp_path, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     threadsafe=True, sharded=request.param)
+    for s in ['scenarioA', 'scenarioB', 'scenarioC']:
+        objfun.createScenario(s)
+    return objfun
+
+
+def test_combine_status():
+    assert combine_status([]) == 'done'
+    assert combine_status(['done', 'waiting']) == 'waiting'
+    assert combine_status(['waiting', 'new', 'done']) == 'new'
+
+
+def test_slot(objfun):
+    objfun.slot = 1
+
+    def work(slot):
+        if slot is not None:
+            objfun.slot = slot
+        return objfun.slot
+
+    t = threading.Thread(target=work, args=(2, ))
+    t.start()
+    t.join()
+    # the slot is local to the thread that sets it
+    assert objfun.slot == 1
+    # other threads use the slot that was set last
+    slots = []
+    t = threading.Thread(target=lambda: slots.append(work(None)))
+    t.start()
+    t.join()
+    assert slots == [2]
+
+
+def test_call_scenario(objfun):
+    x = numpy.array([0.5, 1., -2.])
+    with pytest.raises(NewRun):
+        objfun(x, numpy.array([]), scenario='scenarioA')
+    assert objfun.getRunID(objfun.values2params(x), scenario='scenarioA') \
+        is not None
+    with pytest.raises(LookupError):
+        objfun.getRunID(objfun.values2params(x))
+
+
+def test_run_scenarios(objfun):
+    scenarios = ['scenarioA', 'scenarioB', 'scenarioC']
+    x = {s: [numpy.array([a, 1., -2.]) for a in [-0.5, 0.5]]
+         for s in scenarios}
+
+    def optimise(scenario):
+        status = []
+        for slot, values in enumerate(x[scenario]):
+            objfun.slot = slot
+            try:
+                objfun(values, numpy.array([]), scenario=scenario)
+            except NewRun:
+                status.append('new')
+                continue
+            # a proxy value is returned for runs that are not completed
+            if objfun.state(objfun.values2params(values),
+                            scenario=scenario) == LookupState.COMPLETED:
+                status.append('done')
+            else:
+                status.append('waiting')
+        objfun.close()
+        return status
+
+    status = run_scenarios(optimise, scenarios, max_workers=2)
+    assert status == {s: 'new' for s in scenarios}
+
+    # complete the runs of one scenario
+    for values in x['scenarioB']:
+        params = objfun.get_new(scenario='scenarioB')
+        objfun.set_result(params, quadratic(params), scenario='scenarioB')
+    status = run_scenarios(optimise, scenarios, max_workers=2)
+    assert status == {'scenarioA': 'waiting', 'scenarioB': 'done',
+                      'scenarioC': 'waiting'}
+    assert combine_status(status.values()) == 'waiting'
+    for s in scenarios:
+        for slot, values in enumerate(x[s]):
+            run = objfun.getRunID(objfun.values2params(values), scenario=s)
+            assert run is not None
+
+    with pytest.raises(LookupError):
+        run_scenarios(optimise, ['missing'])
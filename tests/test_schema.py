@@ -0,0 +1,152 @@
+import sqlite3
+import pytest
+
+from ObjectiveFunction import ObjectiveFunctionMisfit
+from ObjectiveFunction import LookupState, NewRun
+from ObjectiveFunction.model import SCHEMA_VERSION, schema_version
+
+# a database created by the first release, ie before schema versions
+BASELINE = """
+    BEGIN TRANSACTION;
+    CREATE TABLE obsnames (
+        id INTEGER NOT NULL,
+        name VARCHAR,
+        study_id INTEGER,
+        PRIMARY KEY (id),
+        CONSTRAINT _unique_params UNIQUE (name, study_id),
+        FOREIGN KEY(study_id) REFERENCES studies (id)
+    );
+    CREATE TABLE parameters (
+        id INTEGER NOT NULL,
+        name VARCHAR,
+        study_id INTEGER,
+        type VARCHAR,
+        PRIMARY KEY (id),
+        CONSTRAINT _unique_params UNIQUE (name, study_id),
+        FOREIGN KEY(study_id) REFERENCES studies (id)
+    );
+    INSERT INTO "parameters" VALUES(1,'a',1,'parameterfloat');
+    INSERT INTO "parameters" VALUES(2,'b',1,'parameterfloat');
+    INSERT INTO "parameters" VALUES(3,'c',1,'parameterfloat');
+    CREATE TABLE parameters_float (
+        id INTEGER NOT NULL,
+        minv FLOAT,
+        maxv FLOAT,
+        resolution FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(id) REFERENCES parameters (id)
+    );
+    INSERT INTO "parameters_float" VALUES(1,-1.0,1.0,1.0e-06);
+    INSERT INTO "parameters_float" VALUES(2,0.0,2.0,1.0e-07);
+    INSERT INTO "parameters_float" VALUES(3,-5.0,0.0,1.0e-06);
+    CREATE TABLE parameters_int (
+        id INTEGER NOT NULL,
+        minv INTEGER,
+        maxv INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(id) REFERENCES parameters (id)
+    );
+    CREATE TABLE run_parameters (
+        id INTEGER NOT NULL,
+        lid INTEGER,
+        pid INTEGER,
+        value INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(lid) REFERENCES runs (id),
+        FOREIGN KEY(pid) REFERENCES parameters (id)
+    );
+    INSERT INTO "run_parameters" VALUES(1,1,1,1500000);
+    INSERT INTO "run_parameters" VALUES(2,1,2,10000000);
+    INSERT INTO "run_parameters" VALUES(3,1,3,3000000);
+    INSERT INTO "run_parameters" VALUES(4,2,1,500000);
+    INSERT INTO "run_parameters" VALUES(5,2,2,10000000);
+    INSERT INTO "run_parameters" VALUES(6,2,3,3000000);
+    CREATE TABLE runs (
+        id INTEGER NOT NULL,
+        scenario_id INTEGER,
+        state VARCHAR(14),
+        type VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(scenario_id) REFERENCES scenarios (id)
+    );
+    INSERT INTO "runs" VALUES(1,1,'COMPLETED','residual');
+    INSERT INTO "runs" VALUES(2,1,'NEW','residual');
+    CREATE TABLE runs_misfit (
+        id INTEGER NOT NULL,
+        misfit FLOAT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(id) REFERENCES runs (id)
+    );
+    INSERT INTO "runs_misfit" VALUES(1,1.5);
+    INSERT INTO "runs_misfit" VALUES(2,NULL);
+    CREATE TABLE runs_path (
+        id INTEGER NOT NULL,
+        path VARCHAR,
+        PRIMARY KEY (id),
+        FOREIGN KEY(id) REFERENCES runs (id)
+    );
+    CREATE TABLE scenarios (
+        id INTEGER NOT NULL,
+        name VARCHAR,
+        study_id INTEGER,
+        PRIMARY KEY (id),
+        CONSTRAINT _unique_scenario UNIQUE (name, study_id),
+        FOREIGN KEY(study_id) REFERENCES studies (id)
+    );
+    INSERT INTO "scenarios" VALUES(1,'scenario',1);
+    CREATE TABLE studies (
+        id INTEGER NOT NULL,
+        name VARCHAR,
+        PRIMARY KEY (id),
+        UNIQUE (name)
+    );
+    INSERT INTO "studies" VALUES(1,'study');
+    COMMIT;
+"""
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'objective_function.sqlite')
+    conn.executescript(BASELINE)
+    conn.close()
+    return tmp_path
+
+
+def test_upgrade(baseline, paramsA):
+    with pytest.raises(RuntimeError):
+        ObjectiveFunctionMisfit.open_readonly(
+            "study", baseline, paramsA, scenario="scenario")
+
+    objfun = ObjectiveFunctionMisfit("study", baseline, paramsA,
+                                     scenario="scenario", prelim=False)
+    with objfun.session.get_bind().connect() as conn:
+        assert schema_version(conn) == SCHEMA_VERSION
+    completed = objfun.values2params([0.5, 1., -2.])
+    assert objfun.get_result(completed) == 1.5
+    new = objfun.values2params([-0.5, 1., -2.])
+    assert objfun.state(new) == LookupState.NEW
+    assert objfun.get_new() == pytest.approx(new)
+    objfun.set_result(new, 2.5)
+    with pytest.raises(NewRun):
+        objfun.get_result(objfun.values2params([0., 1., -2.]))
+    assert objfun.getRunID(objfun.values2params([0., 1., -2.])) == 3
+
+    # the upgraded database can be opened read-only
+    reader = ObjectiveFunctionMisfit.open_readonly(
+        "study", baseline, paramsA, scenario="scenario")
+    assert reader.get_result(new) == 2.5
+
+
+def test_newer_version(baseline, paramsA):
+    ObjectiveFunctionMisfit("study", baseline, paramsA, scenario="scenario")
+    conn = sqlite3.connect(baseline / 'objective_function.sqlite')
+    conn.execute('UPDATE schema_version SET version = ?',
+                 (SCHEMA_VERSION + 1, ))
+    conn.commit()
+    conn.close()
+    # use a new engine
+    db = f'sqlite:///{baseline}/./objective_function.sqlite'
+    with pytest.raises(RuntimeError):
+        ObjectiveFunctionMisfit("study", baseline, paramsA, db=db,
+                                scenario="scenario")
@@ -0,0 +1,176 @@
+import threading
+from contextlib import contextmanager
+import pytest
+import numpy
+
+from ObjectiveFunction import ObjectiveFunctionResidual, ObjFunConfig
+from ObjectiveFunction import ObjectiveFunctionMisfit, SurrogateQuadratic
+from ObjectiveFunction import ObjectiveFunctionServer, ObjectiveFunctionClient
+from ObjectiveFunction import LookupState, PreliminaryRun, NewRun, Waiting
+from ObjectiveFunction import NoNewRun, ParameterFloat
+
+
+@contextmanager
+def serve(objfun, **kwds):
+    server = ObjectiveFunctionServer(objfun, **kwds)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def server(tmp_path, paramsA):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario")
+    with serve(objfun) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server, paramsA):
+    return ObjectiveFunctionClient(server.url, paramsA)
+
+
+def test_wrong_scheme(paramsA):
+    with pytest.raises(ValueError):
+        ObjectiveFunctionClient('http://localhost:1234', paramsA)
+
+
+def test_lookup(client, valuesA, valuesB):
+    with pytest.raises(PreliminaryRun):
+        client.get_result(valuesA)
+    assert client.state(valuesA) == LookupState.PROVISIONAL
+    with pytest.raises(Waiting):
+        client.get_result(valuesB)
+    with pytest.raises(PreliminaryRun):
+        client.get_result(valuesA)
+    with pytest.raises(NewRun):
+        client.get_result(valuesA)
+    with pytest.raises(LookupError):
+        client.getRunID(valuesB)
+
+    runid, params = client.get_new(with_id=True)
+    assert params == pytest.approx(valuesA)
+    assert client.getState(runid) == LookupState.ACTIVE
+    with pytest.raises(NoNewRun):
+        client.get_new()
+
+    result = numpy.arange(10.)
+    client.set_result(params, result)
+    assert client.state(params) == LookupState.COMPLETED
+    assert client.get_result(params) == pytest.approx(result)
+    # the second lookup is served from the cache
+    assert client.get_result(params) == pytest.approx(result)
+    with pytest.raises(RuntimeError):
+        client.set_result(params, result)
+
+
+def test_slots(server, client, paramsA, valuesA, valuesB):
+    other = ObjectiveFunctionClient(server.url, paramsA)
+    other.slot = 1
+    with pytest.raises(PreliminaryRun):
+        client.get_result(valuesA)
+    with pytest.raises(PreliminaryRun):
+        other.get_result(valuesB)
+    assert client.state(valuesA) == LookupState.PROVISIONAL
+    assert server.objfun.slot == 0
+
+
+def test_scenarios(client, valuesA):
+    client.createScenario('other')
+    assert sorted(client.scenarios) == ['other', 'scenario']
+    x = client.params2values(valuesA)
+    with pytest.raises(PreliminaryRun):
+        client(x, numpy.array([]), scenario='other')
+    assert client.state(valuesA, scenario='other') == \
+        LookupState.PROVISIONAL
+    with pytest.raises(LookupError):
+        client.state(valuesA)
+
+
+def test_speculate(client, valuesA):
+    # the server has no surrogate model
+    assert client.speculate(lambda: client.get_result(valuesA)) == []
+    with pytest.raises(LookupError):
+        client.getRunID(valuesA)
+
+
+def test_speculate_surrogate(tmp_path, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", tmp_path, paramsA,
+                                     scenario="scenario",
+                                     surrogate=SurrogateQuadratic)
+    rng = numpy.random.default_rng(1)
+    lb = objfun.lower_bounds
+    ub = objfun.upper_bounds
+    for x in rng.random((12, 3)):
+        params = objfun.values2params(lb + x * (ub - lb))
+        with pytest.raises(PreliminaryRun):
+            objfun.get_result(params)
+        objfun.set_result(params, numpy.sum(x ** 2), force=True)
+    with serve(objfun) as server:
+        client = ObjectiveFunctionClient(server.url, paramsA)
+        path = [client.values2params([0.1 * i, 1., -2.]) for i in range(4)]
+
+        def evaluate():
+            for params in path:
+                client.get_result(params)
+
+        runids = client.speculate(evaluate, max_points=2)
+        assert [client.getParameters(r) for r in runids] == [
+            pytest.approx(p) for p in path[:2]]
+        with pytest.raises(LookupError):
+            client.getRunID(path[2])
+
+
+def test_config(tmp_path):
+    objfun = ObjectiveFunctionResidual(
+        "study", tmp_path, {'a': ParameterFloat(0, -1, 1)},
+        scenario="scenario")
+    with serve(objfun) as server:
+        cfgname = tmp_path / 'objfun.cfg'
+        cfgname.write_text(f"""
+[setup]
+study = study
+scenario = scenario
+basedir = {tmp_path}
+objfun = residual
+db = {server.url}
+[parameters]
+[[float_parameters]]
+[[[a]]]
+value = 0
+min = -1
+max = 1
+""")
+        cfg = ObjFunConfig(cfgname)
+        assert isinstance(cfg.objectiveFunction, ObjectiveFunctionClient)
+
+
+def test_wrong_parameters(server, paramsB):
+    # the parameters of the client must match the study served
+    with pytest.raises(RuntimeError):
+        ObjectiveFunctionClient(server.url, paramsB)
+
+
+def test_cache_size(tmp_path, paramsA, valuesA, valuesB):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False)
+    points = [valuesA, valuesB]
+    for params in points:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+        objfun.get_new()
+        objfun.set_result(params, numpy.arange(3.))
+    with serve(objfun, cache_size=1) as server:
+        client = ObjectiveFunctionClient(server.url, paramsA)
+        client.get_result(valuesA)
+        assert len(server._cache) == 1
+        # the least recently used result is dropped
+        client.get_result(valuesB)
+        assert len(server._cache) == 1
+        assert client.get_result(valuesA) == pytest.approx(numpy.arange(3.))
+        assert len(server._cache) == 1
@@ -0,0 +1,169 @@
+import importlib.util
+import sys
+import pytest
+import numpy
+from sqlalchemy import event
+
+from ObjectiveFunction import ObjectiveFunctionMisfit
+from ObjectiveFunction import ObjectiveFunctionResidual
+from ObjectiveFunction import LookupState, NewRun
+from ObjectiveFunction.snapshot import LookupSnapshot
+
+
+def quadratic(params):
+    return sum(v ** 2 for v in params.values())
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    return LookupSnapshot(tmp_path / 'test.snapshot', 3, min_journal=4)
+
+
+def test_lookup(snapshot):
+    completed = LookupState.COMPLETED
+    assert len(snapshot) == 0
+    assert snapshot.lookup([1, 2, 3]) is None
+    snapshot.append([[1, 2, 3], [1, -2, 3]], [10, 11], [completed] * 2,
+                    [0.5, numpy.nan])
+    assert len(snapshot) == 2
+    entry = snapshot.lookup([1, 2, 3])
+    assert entry.runid == 10
+    assert entry.state == completed
+    assert entry.result == 0.5
+    assert numpy.isnan(snapshot.lookup([1, -2, 3]).result)
+    assert snapshot.lookup([1, 2, -3]) is None
+
+
+def test_compact(tmp_path, snapshot):
+    completed = LookupState.COMPLETED
+    keys = numpy.array([[1, i, -i] for i in range(5)])
+    snapshot.append(keys, range(5), [completed] * 5, range(5))
+    # the journal is merged into the snapshot once it is full
+    assert len(snapshot._keys) == 5
+    assert len(snapshot._journal) == 0
+
+    reader = LookupSnapshot(tmp_path / 'test.snapshot', 3)
+    assert len(reader) == 5
+    for i in range(5):
+        assert reader.lookup(keys[i]).runid == i
+
+    # the journal is replaced when it is merged
+    assert len(list(tmp_path.glob('test.snapshot.journal*'))) == 0
+
+    # newer entries replace older ones
+    snapshot.append([keys[2], [2, 0, 0]], [20, 21], [completed] * 2,
+                    [2.5, 3.])
+    assert reader.lookup([2, 0, 0]).runid == 21
+    assert reader.lookup(keys[2]).result == 2.5
+    snapshot.compact()
+    assert len(snapshot) == 6
+    assert snapshot.lookup(keys[2]).result == 2.5
+    assert reader.lookup(keys[2]).result == 2.5
+    assert [p.name for p in tmp_path.glob('test.snapshot.journal*')] == []
+
+    # runs that are no longer completed are seen by other processes
+    snapshot.append([keys[1]], [1], [LookupState.NEW], [numpy.nan])
+    assert reader.lookup(keys[1]).state == LookupState.NEW
+
+    # partially written entries are ignored
+    with open(snapshot.journal, 'ab') as f:
+        f.write(b'partial')
+    assert LookupSnapshot(tmp_path / 'test.snapshot', 3).lookup(
+        keys[4]).runid == 4
+
+    with pytest.raises(RuntimeError):
+        LookupSnapshot(tmp_path / 'test.snapshot', 2)
+    snapshot.clear()
+    assert list(tmp_path.iterdir()) == []
+    assert len(snapshot) == 0
+
+
+def test_misfit(tmp_path, paramsA):
+    objfun = ObjectiveFunctionMisfit("study", tmp_path, paramsA,
+                                     scenario="scenario", prelim=False,
+                                     snapshot=True)
+    points = [objfun.values2params([a, 1., -2.]) for a in [-1., 0., 1.]]
+    for params in points:
+        with pytest.raises(NewRun):
+            objfun.get_result(params)
+    objfun.get_new()
+    objfun.set_result(points[0], quadratic(points[0]))
+    objfun.get_new()
+    objfun.set_results(points[1:2], [quadratic(points[1])])
+    objfun.set_result(points[0], 1., force=True)
+    runid = objfun.getRunID(points[1])
+    objfun.setState(runid, LookupState.NEW)
+    assert objfun.state(points[1]) == LookupState.NEW
+    assert objfun.get_result(points[1]) != quadratic(points[1])
+    objfun.get_new()
+    objfun.set_result(points[1], quadratic(points[1]))
+
+    other = ObjectiveFunctionMisfit("study", tmp_path, paramsA,
+                                    scenario="scenario", snapshot=True)
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    engine = other.session.get_bind()
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        # completed runs are looked up without querying the database
+        assert other.get_result(points[0]) == 1.
+        assert other.get_result(points[1]) == quadratic(points[1])
+        assert len(statements) == 0
+        # other runs are looked up in the database
+        assert other.state(points[2]) == LookupState.NEW
+        assert len(statements) > 0
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_residual(tmp_path, paramsA):
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False)
+    params = objfun.values2params([0., 1., -2.])
+    with pytest.raises(NewRun):
+        objfun.get_result(params)
+    objfun.get_new()
+    objfun.set_result(params, numpy.arange(10.))
+
+    # the completed runs of an existing study are added to the snapshot
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", snapshot=True)
+    assert len(objfun.snapshot) == 0
+    objfun.compact_snapshot(rebuild=True)
+    assert len(objfun.snapshot) == 1
+    assert objfun._snapshot_entry(params).runid == objfun.getRunID(params)
+    assert objfun.get_result(params) == pytest.approx(numpy.arange(10.))
+
+    # the result file of a completed run is read without querying the
+    # database
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    engine = objfun.session.get_bind()
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        assert objfun.get_result(params) == pytest.approx(numpy.arange(10.))
+        assert len(statements) == 0
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    # a run that was enqueued again is read from the database
+    objfun.setState(objfun.getRunID(params), LookupState.NEW)
+    assert objfun.state(params) == LookupState.NEW
+    assert objfun._lookupRun(params).state == LookupState.NEW
+
+    with pytest.raises(RuntimeError):
+        ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                  scenario="scenario").compact_snapshot()
+
+
+def test_import_without_fcntl(monkeypatch):
+    # file locking is only needed once entries are appended
+    monkeypatch.setitem(sys.modules, 'fcntl', None)
+    spec = importlib.util.find_spec('ObjectiveFunction.snapshot')
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
@@ -0,0 +1,80 @@
+import pytest
+import numpy
+
+from ObjectiveFunction import SpatialIndex
+
+
+@pytest.fixture
+def points():
+    rng = numpy.random.default_rng(1)
+    return rng.random((200, 3))
+
+
+@pytest.fixture
+def index(points):
+    index = SpatialIndex(3, leaf_size=4)
+    for i, x in enumerate(points):
+        index.add(i, x)
+    return index
+
+
+def test_len(index, points):
+    assert len(index) == len(points)
+    assert 10 in index
+
+
+def test_remove(index, points):
+    index.remove(10)
+    assert 10 not in index
+    assert len(index) == len(points) - 1
+    assert 10 not in index.in_box([0, 0, 0], [1, 1, 1])
+
+
+def test_in_box(index, points):
+    lb = numpy.array([0.2, 0.1, 0.3])
+    ub = numpy.array([0.7, 0.6, 0.9])
+    expected = numpy.nonzero(
+        numpy.all((points >= lb) & (points <= ub), axis=1))[0]
+    assert sorted(index.in_box(lb, ub)) == list(expected)
+
+
+@pytest.mark.parametrize("k", [1, 5, 20])
+def test_nearest(index, points, k):
+    x = numpy.array([0.45, 0.2, 0.8])
+    d = numpy.linalg.norm(points - x, axis=1)
+    expected = numpy.argsort(d)[:k]
+    result = index.nearest(x, k=k)
+    assert [r[0] for r in result] == list(expected)
+    assert [r[1] for r in result] == pytest.approx(d[expected])
+
+
+def test_nearest_empty():
+    assert SpatialIndex(2).nearest([0.5, 0.5]) == []
+
+
+def test_coincident():
+    index = SpatialIndex(2, leaf_size=2)
+    for i in range(5):
+        index.add(i, [0.5, 0.5])
+    index.add(5, [0.1, 0.9])
+    assert sorted(index.in_box([0.4, 0.4], [0.6, 0.6])) == list(range(5))
+    assert index.nearest([0.1, 0.8])[0][0] == 5
+
+
+def test_high_dimension():
+    rng = numpy.random.default_rng(2)
+    points = rng.random((2000, 12))
+    index = SpatialIndex(12)
+    for i, x in enumerate(points):
+        index.add(i, x)
+    for i in range(0, 2000, 2):
+        index.remove(i)
+    x = rng.random(12)
+    d = numpy.linalg.norm(points[1::2] - x, axis=1)
+    expected = 2 * numpy.argsort(d)[:3] + 1
+    assert [r[0] for r in index.nearest(x, k=3)] == list(expected)
+    lb = x - 0.3
+    ub = x + 0.3
+    inside = numpy.all((points >= lb) & (points <= ub), axis=1)
+    inside[::2] = False
+    assert sorted(index.in_box(lb, ub)) == list(numpy.nonzero(inside)[0])
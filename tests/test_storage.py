@@ -0,0 +1,89 @@
+import pytest
+import numpy
+
+from ObjectiveFunction import ResultStorage, ObjectiveFunctionResidual
+from ObjectiveFunction import NewRun
+
+
+@pytest.fixture
+def result():
+    return numpy.sin(numpy.linspace(0, 10, 1001))
+
+
+def test_default(tmp_path, result):
+    storage = ResultStorage()
+    assert not storage.compact
+    fname = tmp_path / f'result{storage.suffix}'
+    fname.write_bytes(storage.dumps(result))
+    # the default format is readable by numpy
+    assert numpy.load(fname) == pytest.approx(result)
+    assert storage.load(fname, start=10, stop=20) == pytest.approx(
+        result[10:20])
+
+
+@pytest.mark.parametrize("compression", [None, 'zlib', 'lzma', 'bz2'])
+@pytest.mark.parametrize("shuffle", [True, False])
+@pytest.mark.parametrize("chunk_size", [None, 1, 100, 2000])
+def test_roundtrip(result, compression, shuffle, chunk_size):
+    storage = ResultStorage(compression=compression, shuffle=shuffle,
+                            chunk_size=chunk_size)
+    values = storage.loads(storage.dumps(result))
+    assert values.dtype == result.dtype
+    assert numpy.array_equal(values, result)
+
+
+def test_float32(tmp_path, result):
+    storage = ResultStorage(dtype='float32', compression='zlib')
+    data = storage.dumps(result)
+    assert len(data) < result.nbytes / 2
+    values = storage.loads(data)
+    # the values are returned with their original type
+    assert values.dtype == numpy.float64
+    assert values == pytest.approx(result, rel=1e-6, abs=1e-7)
+
+    # integer arrays are not cast
+    ints = numpy.arange(12).reshape(3, 4)
+    values = storage.loads(storage.dumps(ints))
+    assert values.dtype == ints.dtype
+    assert numpy.array_equal(values, ints)
+
+
+@pytest.mark.parametrize("start,stop", [(None, 10), (95, 105), (990, None),
+                                        (-5, None), (500, 500)])
+def test_partial(tmp_path, result, start, stop):
+    storage = ResultStorage(compression='zlib', chunk_size=100)
+    fname = tmp_path / f'result{storage.suffix}'
+    fname.write_bytes(storage.dumps(result))
+    assert numpy.array_equal(storage.load(fname, start=start, stop=stop),
+                             result[start:stop])
+
+
+def test_wrong_options(tmp_path):
+    with pytest.raises(ValueError):
+        ResultStorage(compression='snappy')
+    with pytest.raises(ValueError):
+        ResultStorage(chunk_size=0)
+    fname = tmp_path / 'result.npc'
+    fname.write_bytes(b'not a result')
+    with pytest.raises(RuntimeError):
+        ResultStorage().load(fname)
+
+
+def test_residual(tmp_path, paramsA, result):
+    storage = ResultStorage(dtype='float32', compression='zlib',
+                            chunk_size=256)
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario", prelim=False,
+                                       storage=storage)
+    params = objfun.values2params([0., 1., -2.])
+    with pytest.raises(NewRun):
+        objfun.get_result(params)
+    objfun.get_new()
+    objfun.set_result(params, result)
+    assert len(list(tmp_path.glob('residuals_*.npc'))) == 1
+    assert objfun.get_result(params) == pytest.approx(result, abs=1e-6)
+
+    # files are read whatever the storage options
+    objfun = ObjectiveFunctionResidual("study", tmp_path, paramsA,
+                                       scenario="scenario")
+    assert objfun.get_result(params) == pytest.approx(result, abs=1e-6)
@@ -0,0 +1,68 @@
+import pytest
+import numpy
+
+from ObjectiveFunction import SurrogateRBF, SurrogateQuadratic
+
+
+def quadratic(x):
+    return 1 + x[0] - 2 * x[1] + 3 * x[0] * x[1] + x[1] ** 2
+
+
+@pytest.fixture
+def points():
+    rng = numpy.random.default_rng(1)
+    return rng.random((12, 2))
+
+
+@pytest.mark.parametrize("surrogate", [SurrogateRBF, SurrogateQuadratic])
+def test_not_ready(surrogate):
+    s = surrogate(2)
+    assert not s.ready
+    with pytest.raises(RuntimeError):
+        s.predict([0.5, 0.5])
+
+
+@pytest.mark.parametrize("surrogate", [SurrogateRBF, SurrogateQuadratic])
+def test_interpolate(surrogate, points):
+    s = surrogate(2)
+    for i, x in enumerate(points):
+        s.add(i, x, quadratic(x))
+    assert s.ready
+    for x in points:
+        assert s.predict(x) == pytest.approx(quadratic(x))
+
+
+def test_quadratic_exact(points):
+    s = SurrogateQuadratic(2)
+    for i, x in enumerate(points):
+        s.add(i, x, quadratic(x))
+    assert s.predict([0.3, 0.7]) == pytest.approx(quadratic([0.3, 0.7]))
+
+
+@pytest.mark.parametrize("surrogate", [SurrogateRBF, SurrogateQuadratic])
+def test_vector(surrogate, points):
+    s = surrogate(2)
+    for i, x in enumerate(points):
+        s.add(i, x, [quadratic(x), -quadratic(x)])
+    r = s.predict(points[0])
+    assert r.shape == (2, )
+    assert r == pytest.approx([quadratic(points[0]), -quadratic(points[0])])
+
+
+def test_add_duplicate(points):
+    s = SurrogateRBF(2)
+    s.add(1, points[0], 1.)
+    s.add(1, points[1], 2.)
+    assert s.num_points == 1
+    assert 1 in s
+
+
+def test_remove(points):
+    s = SurrogateQuadratic(2)
+    for i, x in enumerate(points):
+        s.add(i, x, quadratic(x))
+    s.add(len(points), [0.5, 0.5], 100.)
+    assert s.predict([0.5, 0.5]) != pytest.approx(quadratic([0.5, 0.5]))
+    s.remove(len(points))
+    assert len(points) not in s
+    assert s.predict([0.5, 0.5]) == pytest.approx(quadratic([0.5, 0.5]))